@@ -0,0 +1,5 @@
+'''Offline benchmarks of the genome browser builders on deterministic synthetic data.
+
+  python benchmarks/suite.py --size small --output results.json
+  python benchmarks/suite.py --size small --compare results.json
+'''
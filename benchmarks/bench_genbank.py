@@ -0,0 +1,46 @@
+'''Measure the GenBank parser throughput on a synthetic multi-record GenBank file.
+
+Usage:
+  python benchmarks/bench_genbank.py [records] [length] [features] [repeats]
+'''
+import os, sys, time, shutil, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import genomebrowser
+from generators import genbank
+
+
+def timeit(gbk, repeats):
+  '''time parse_genbank over several runs, return the best time and the number of segments'''
+  best = float('inf')
+  for i in range(repeats):
+    tmp = tempfile.mkdtemp()
+    genomebrowser.createDB(tmp)
+    db = genomebrowser.openDB(tmp)
+    t0 = time.time()
+    sequences = genomebrowser.TwoBitWriter(os.path.join(tmp, genomebrowser.SEQUENCES))
+    with genomebrowser.bulk_load(db):
+      c = db.cursor()
+      con = genomebrowser.open_file(gbk)
+      genomebrowser.parse_genbank(con, c, sequences, dict(), [])
+      con.close()
+    sequences.close()
+    best = min(best, time.time()-t0)
+    segments = db.execute('SELECT count(*) FROM tbl_segments').fetchone()[0]
+    db.close()
+    shutil.rmtree(tmp)
+  return best, segments
+
+
+if __name__ == '__main__':
+  records = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+  length = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+  features = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+  repeats = int(sys.argv[4]) if len(sys.argv) > 4 else 3
+  tmp = tempfile.mkdtemp()
+  gbk = os.path.join(tmp, 'synthetic.gbk')
+  genbank(gbk, records, length, features)
+  size = os.path.getsize(gbk)/float(1 << 20)
+  seconds, segments = timeit(gbk, repeats)
+  print('%.1f MB, %d features in %.3f s: %.1f MB/s, %d features/s' % (size, segments, seconds, size/seconds, segments/seconds))
+  shutil.rmtree(tmp)
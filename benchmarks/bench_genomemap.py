@@ -0,0 +1,41 @@
+'''Compare the numpy and pure python genome map builders on a synthetic coverage bed file.
+
+Usage:
+  python benchmarks/bench_genomemap.py [rows] [repeats]
+'''
+import os, sys, time, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import genomebrowser
+from generators import coverage_bed
+
+
+def timeit(bed, assembly, repeats):
+  '''time genomemapJSON over several runs, return the best time and the output'''
+  best = float('inf')
+  for i in range(repeats):
+    t0 = time.time()
+    data = genomebrowser.genomemapJSON(bed, assembly)
+    best = min(best, time.time()-t0)
+  return best, data
+
+
+if __name__ == '__main__':
+  rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+  repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+  assembly = [['chr%d' % (i+1), 0, 250000000 - i*8000000] for i in range(22)]
+  bed = os.path.join(tempfile.mkdtemp(), 'coverage.bed')
+  coverage_bed(bed, rows, assembly)
+
+  numpy = genomebrowser.numpy
+  if numpy is None:
+    print('numpy is not installed, only the pure python path can be timed.')
+  genomebrowser.numpy = None
+  python_time, python_data = timeit(bed, assembly, repeats)
+  print('python: %.3f s' % python_time)
+  if numpy is not None:
+    genomebrowser.numpy = numpy
+    numpy_time, numpy_data = timeit(bed, assembly, repeats)
+    print('numpy:  %.3f s (%.1fx)' % (numpy_time, python_time/numpy_time))
+    print('identical json: %s' % (numpy_data == python_data))
+  os.remove(bed)
@@ -0,0 +1,156 @@
+'''Deterministic generators of synthetic genome data: the same arguments and seed always write the same file.'''
+import random
+
+BASES = 'ACGT'
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+
+def synthetic_assembly(chromosomes, length):
+  '''an assembly of chromosomes of decreasing length, the first one "length" bases long'''
+  return [['chr%d' % (i+1), 0, max(1, length - i*length//(2*chromosomes))] for i in range(chromosomes)]
+
+
+def scaled(rows, assembly):
+  '''split a number of rows over the chromosomes of an assembly in proportion to their length'''
+  total = sum(map(lambda x: x[2], assembly))
+  return [max(1, rows*chrom[2]//total) for chrom in assembly]
+
+
+def gene_bed(filename, rows, assembly, seed = 1):
+  '''write a sorted bed12 file of stranded genes with up to ten exons'''
+  r = random.Random(seed)
+  con = open(filename, 'w')
+  k = 0
+  for chrom, n in zip(assembly, scaled(rows, assembly)):
+    starts = sorted(r.randrange(0, max(1, chrom[2]-20000)) for i in range(n))
+    for start in starts:
+      exons = r.randint(1, 10)
+      size = r.randint(500, 20000)
+      blockSizes = [r.randint(50, max(50, size//exons//2)) for i in range(exons)]
+      blockStarts = sorted(r.sample(range(1, size-blockSizes[-1]), exons-1)) if exons > 1 else []
+      blockStarts = [0] + blockStarts
+      for i in range(1, exons):
+        blockStarts[i] = max(blockStarts[i], blockStarts[i-1]+blockSizes[i-1])
+      end = start + blockStarts[-1] + blockSizes[-1]
+      con.write('%s\t%d\t%d\tGENE%d\t0\t%s\t%d\t%d\t0\t%d\t%s\t%s\n' % (chrom[0], start, end, k, r.choice('+-'), start, end, exons,
+        ','.join(map(str, blockSizes)) + ',', ','.join(map(str, blockStarts)) + ','))
+      k += 1
+  con.close()
+
+
+def coverage_bed(filename, rows, assembly, seed = 1):
+  '''write a sorted coverage bed file with rows of equal width over the assembly'''
+  r = random.Random(seed)
+  con = open(filename, 'w')
+  for chrom, n in zip(assembly, scaled(rows, assembly)):
+    width = max(1, chrom[2]//n)
+    for i in range(n):
+      con.write('%s\t%d\t%d\t.\t%.3f\n' % (chrom[0], i*width, (i+1)*width, r.random()*100))
+  con.close()
+
+
+def gff3(filename, genes, assembly, seed = 1):
+  '''write a sorted GFF3 file of genes with one or two transcripts and their exons, each gene closed by a ### directive'''
+  r = random.Random(seed)
+  con = open(filename, 'w')
+  con.write('##gff-version 3\n')
+  k = 0
+  for chrom, n in zip(assembly, scaled(genes, assembly)):
+    starts = sorted(r.randrange(1, max(2, chrom[2]-20000)) for i in range(n))
+    for start in starts:
+      end = start + r.randint(500, 20000)
+      strand = r.choice('+-')
+      con.write('%s\tsynthetic\tgene\t%d\t%d\t.\t%s\t.\tID=gene%d;Name=G%d;biotype=%s\n' % (chrom[0], start, end, strand, k, k, r.choice(['protein_coding', 'lncRNA', 'pseudogene'])))
+      for t in range(r.randint(1, 2)):
+        con.write('%s\tsynthetic\tmRNA\t%d\t%d\t.\t%s\t0\tID=tx%d.%d;Parent=gene%d;product=synthetic protein %d\n' % (chrom[0], start, end, strand, k, t, k, k))
+        exons = r.randint(1, 8)
+        step = (end-start)//exons
+        for e in range(exons):
+          s = start + e*step
+          con.write('%s\tsynthetic\texon\t%d\t%d\t.\t%s\t.\tParent=tx%d.%d\n' % (chrom[0], s, s + r.randint(1, step-1), strand, k, t))
+      con.write('###\n')
+      k += 1
+  con.close()
+
+
+def vcf(filename, variants, samples, assembly, seed = 1):
+  '''write a sorted VCF file of biallelic SNVs with QUAL, DP and CSQ fields and GT:DP genotypes for a number of samples'''
+  r = random.Random(seed)
+  con = open(filename, 'w')
+  con.write('##fileformat=VCFv4.2\n')
+  con.write('##INFO=<ID=DP,Number=1,Type=Integer,Description="Total Depth">\n')
+  con.write('##INFO=<ID=CSQ,Number=.,Type=String,Description="Consequence annotations. Format: Allele|Consequence|Gene">\n')
+  con.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+  con.write('##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read Depth">\n')
+  for chrom in assembly:
+    con.write('##contig=<ID=%s,length=%d>\n' % (chrom[0], chrom[2]))
+  con.write('\t'.join(['#CHROM','POS','ID','REF','ALT','QUAL','FILTER','INFO','FORMAT'] + ['S%d' % (i+1) for i in range(samples)]) + '\n')
+  genotypes = ['0/0', '0/1', '1/1', '0|1', '1|0', './.']
+  k = 0
+  for chrom, n in zip(assembly, scaled(variants, assembly)):
+    positions = sorted(set(r.randrange(1, chrom[2]+1) for i in range(n)))
+    for pos in positions:
+      ref, alt = r.sample(BASES, 2)
+      qual = '%.1f' % (r.random()*100) if r.random() < 0.9 else '.'
+      ID = 'rs%d' % k if r.random() < 0.5 else '.'
+      info = 'DP=%d;CSQ=%s|%s|GENE%d' % (r.randint(1, 100), alt, r.choice(['missense_variant', 'synonymous_variant', 'intron_variant']), k//10)
+      calls = ['%s:%d' % (r.choice(genotypes), r.randint(0, 60)) for i in range(samples)]
+      con.write('\t'.join([chrom[0], str(pos), ID, ref, alt, qual, 'PASS', info, 'GT:DP'] + calls) + '\n')
+      k += 1
+  con.close()
+
+
+def fasta(filename, assembly, seed = 1, width = 60):
+  '''write a FASTA file with the sequences of an assembly, including soft masked and N runs'''
+  r = random.Random(seed)
+  con = open(filename, 'w')
+  for chrom in assembly:
+    con.write('>%s synthetic\n' % chrom[0])
+    runs = []
+    left = chrom[2]
+    while left > 0:
+      n = min(left, r.randint(100, 5000))
+      kind = r.random()
+      if kind < 0.05:
+        runs.append('N'*n)
+      elif kind < 0.3:
+        runs.append(''.join(r.choices(BASES, k=n)).lower())
+      else:
+        runs.append(''.join(r.choices(BASES, k=n)))
+      left -= n
+    bases = ''.join(runs)
+    for p in range(0, len(bases), width):
+      con.write(bases[p:p+width] + '\n')
+  con.close()
+
+
+def genbank(filename, records, length, features, seed = 1):
+  '''write a GenBank file with genes, spliced CDS, multi-line qualifiers and sequence'''
+  r = random.Random(seed)
+  con = open(filename, 'w')
+  for k in range(records):
+    name = 'SEQ%d' % k
+    con.write('LOCUS       %s            %d bp    DNA     linear   BCT 01-JAN-2000\n' % (name, length))
+    con.write('DEFINITION  synthetic record %d.\nACCESSION   %s\nVERSION     %s.1\n' % (k, name, name))
+    con.write('FEATURES             Location/Qualifiers\n')
+    con.write('     source          1..%d\n                     /organism="Synthetic"\n' % length)
+    step = max(1, length // features)
+    for i in range(features):
+      s = 1 + i*step
+      e = min(length, s + step - 1)
+      loc = '%d..%d' % (s, e) if i % 3 else 'complement(%d..%d)' % (s, e)
+      con.write('     gene            %s\n                     /gene="g%d_%d"\n' % (loc, k, i))
+      if i % 4 == 0 and e - s > 20:
+        loc = 'join(%d..%d,%d..%d)' % (s, s+(e-s)//3, s+2*(e-s)//3, e)
+      con.write('     CDS             %s\n                     /locus_tag="T%d_%d"\n' % (loc, k, i))
+      con.write('                     /product="hypothetical protein %d"\n' % i)
+      con.write('                     /note="synthetic feature with a\n                     two line note"\n')
+      protein = ''.join(r.choice(AMINO_ACIDS) for _ in range(150))
+      con.write('                     /translation="%s"\n' % '\n                     '.join(protein[j:j+58] for j in range(0, len(protein), 58)))
+    con.write('ORIGIN      \n')
+    seq = ''.join(r.choice('acgt') for _ in range(length))
+    for p in range(0, length, 60):
+      chunk = seq[p:p+60]
+      con.write('%9d %s\n' % (p+1, ' '.join(chunk[j:j+10] for j in range(0, len(chunk), 10))))
+    con.write('//\n')
+  con.close()
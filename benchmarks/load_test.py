@@ -0,0 +1,65 @@
+'''Load test a running query server with random viewport queries from concurrent keep-alive clients.
+
+Usage:
+  python benchmarks/load_test.py [url] [clients] [seconds] [width]
+'''
+import sys, json, time, random, asyncio, urllib.parse
+
+
+async def request(reader, writer, host, path):
+  '''send a keep-alive GET request, return the status and the body'''
+  writer.write(('GET %s HTTP/1.1\r\nHost: %s\r\n\r\n' % (path, host)).encode('latin-1'))
+  await writer.drain()
+  status = int((await reader.readline()).split()[1])
+  length = 0
+  while True:
+    line = await reader.readline()
+    if line in (b'\r\n', b''):
+      break
+    key, value = line.decode('latin-1').split(':', 1)
+    if key.lower() == 'content-length':
+      length = int(value)
+  return status, await reader.readexactly(length)
+
+
+async def client(url, chromosomes, endpoints, width, deadline, seed, latencies, errors):
+  '''issue random viewport queries until the deadline'''
+  r = random.Random(seed)
+  reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+  while time.perf_counter() < deadline:
+    chr, last = r.choice(chromosomes)
+    start = r.randrange(0, max(1, last-width))
+    path = '%s?%s' % (r.choice(endpoints), urllib.parse.urlencode({'chr': chr, 'start': start, 'end': start+width}))
+    t0 = time.perf_counter()
+    status, body = await request(reader, writer, url.netloc, path)
+    latencies.append(time.perf_counter()-t0)
+    if status != 200:
+      errors.append(status)
+  writer.close()
+
+
+def percentile(values, p):
+  return values[min(len(values)-1, int(p*len(values)))]
+
+
+async def main(address, clients, seconds, width):
+  url = urllib.parse.urlsplit(address)
+  reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+  status, body = await request(reader, writer, url.netloc, '/chromosomes')
+  writer.close()
+  chromosomes = json.loads(body)
+  latencies = []
+  errors = []
+  deadline = time.perf_counter() + seconds
+  await asyncio.gather(*[client(url, chromosomes, ['/query', '/summary'], width, deadline, i, latencies, errors) for i in range(clients)])
+  latencies.sort()
+  print('%d requests in %.1f s: %.1f requests/s, %d errors' % (len(latencies), seconds, len(latencies)/seconds, len(errors)))
+  print('latency p50 %.2f ms, p95 %.2f ms, p99 %.2f ms' % tuple(1000*percentile(latencies, p) for p in (0.5, 0.95, 0.99)))
+
+
+if __name__ == '__main__':
+  address = sys.argv[1] if len(sys.argv) > 1 else 'http://127.0.0.1:8000'
+  clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+  seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+  width = int(sys.argv[4]) if len(sys.argv) > 4 else 100000
+  asyncio.run(main(address, clients, seconds, width))
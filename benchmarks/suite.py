@@ -0,0 +1,219 @@
+'''Time and memory-profile the genome browser entry points on synthetic data and write the results as json.
+
+Every case runs "repeats" times on fresh output directories and keeps the best time; unless --no-memory
+is given, one more run under tracemalloc gives the peak of Python memory allocated by the case (memory
+used by sqlite itself is not traced). With --compare, the run is checked against an earlier result file
+and the command fails if a case got slower by more than the tolerance.
+
+Usage:
+  python benchmarks/suite.py [--size small|medium|large] [--repeats N] [--cases a,b] [--no-memory] [--output file.json] [--compare old.json] [--tolerance 0.2]
+'''
+import os, sys, io, json, time, random, shutil, sqlite3, platform, resource, argparse, tempfile, tracemalloc, contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import genomebrowser
+import generators
+
+SIZES = {
+  'small': {'chromosomes': 4, 'length': 2000000, 'genes': 5000, 'values': 20000, 'gff': 1000, 'variants': 5000, 'samples': 10, 'records': 5, 'record': 200000, 'features': 200, 'queries': 200},
+  'medium': {'chromosomes': 10, 'length': 20000000, 'genes': 100000, 'values': 500000, 'gff': 20000, 'variants': 100000, 'samples': 50, 'records': 20, 'record': 1000000, 'features': 1000, 'queries': 1000},
+  'large': {'chromosomes': 24, 'length': 100000000, 'genes': 1000000, 'values': 5000000, 'gff': 200000, 'variants': 1000000, 'samples': 100, 'records': 50, 'record': 2000000, 'features': 2000, 'queries': 2000},
+}
+
+
+def inputs(directory, size, seed = 1):
+  '''write the synthetic input files of a size into a directory'''
+  p = SIZES[size]
+  assembly = generators.synthetic_assembly(p['chromosomes'], p['length'])
+  files = {
+    'genes': os.path.join(directory, 'genes.bed'),
+    'values': os.path.join(directory, 'values.bed'),
+    'gff': os.path.join(directory, 'genes.gff3'),
+    'vcf': os.path.join(directory, 'variants.vcf'),
+    'fasta': os.path.join(directory, 'genome.fa'),
+    'gbk': os.path.join(directory, 'genome.gbk'),
+  }
+  generators.gene_bed(files['genes'], p['genes'], assembly, seed)
+  generators.coverage_bed(files['values'], p['values'], assembly, seed)
+  generators.gff3(files['gff'], p['gff'], assembly, seed)
+  generators.vcf(files['vcf'], p['variants'], p['samples'], assembly, seed)
+  generators.fasta(files['fasta'], assembly, seed)
+  generators.genbank(files['gbk'], p['records'], p['record'], p['features'], seed)
+  return assembly, files
+
+
+def viewports(assembly, n, seed = 1):
+  '''random regions of 10kb to 1Mb'''
+  r = random.Random(seed)
+  regions = []
+  for i in range(n):
+    chrom = r.choice(assembly)
+    width = min(chrom[2], int(10**r.uniform(4, 6)))
+    start = r.randrange(0, chrom[2]-width+1)
+    regions.append((chrom[0], start, start+width))
+  return regions
+
+
+def browser(assembly, work):
+  return genomebrowser.genomebrowser(assembly, directory=os.path.join(work, 'browser'))
+
+
+# Each case prepares what it needs in a fresh work directory and returns the function to measure.
+
+def case_genomemap(assembly, files, work, loaded):
+  return lambda: genomebrowser.genomemap(assembly, files['values'], os.path.join(work, 'map'))
+
+def case_genomebrowser(assembly, files, work, loaded):
+  return lambda: genomebrowser.genomebrowser(assembly, files['values'], directory=os.path.join(work, 'browser'))
+
+def case_addTrack(assembly, files, work, loaded):
+  gb = browser(assembly, work)
+  return lambda: gb.addTrack(files['genes'], 'genes', 'exons')
+
+def case_addTrack_value(assembly, files, work, loaded):
+  gb = browser(assembly, work)
+  return lambda: gb.addTrack(files['values'], 'values', 'value')
+
+def case_addGFF(assembly, files, work, loaded):
+  gb = browser(assembly, work)
+  return lambda: gb.addGFF(files['gff'])
+
+def case_addVCF(assembly, files, work, loaded):
+  gb = browser(assembly, work)
+  return lambda: gb.addVCF(files['vcf'])
+
+def case_addSequence(assembly, files, work, loaded):
+  gb = browser(assembly, work)
+  return lambda: gb.addSequence(files['fasta'])
+
+def case_gbk2genomebrowser(assembly, files, work, loaded):
+  return lambda: genomebrowser.gbk2genomebrowser(files['gbk'], directory=os.path.join(work, 'gbk'))
+
+def each(method, regions):
+  '''call a query method on every region, dropping the results'''
+  for region in regions:
+    method(*region)
+
+def case_query(assembly, files, work, loaded):
+  return lambda: each(loaded[0].query, loaded[1])
+
+def case_querySummary(assembly, files, work, loaded):
+  return lambda: each(loaded[0].querySummary, loaded[1])
+
+def case_getSequence(assembly, files, work, loaded):
+  return lambda: each(loaded[0].getSequence, loaded[1])
+
+CASES = ['genomemap', 'genomebrowser', 'addTrack', 'addTrack_value', 'addGFF', 'addVCF', 'addSequence', 'gbk2genomebrowser', 'query', 'querySummary', 'getSequence']
+
+
+def load_all(assembly, files, work, queries):
+  '''a genome browser holding every synthetic input, for the query cases'''
+  gb = browser(assembly, work)
+  with gb.batch():
+    gb.addTrack(files['genes'], 'genes', 'exons')
+    gb.addTrack(files['values'], 'values', 'value')
+    gb.addGFF(files['gff'])
+    gb.addVCF(files['vcf'])
+  gb.addSequence(files['fasta'])
+  return gb, viewports(assembly, queries)
+
+
+def measure(name, assembly, files, loaded, repeats, memory = True):
+  '''best time over the repeats and peak traced memory of a case'''
+  case = globals()['case_' + name]
+  times = []
+  peak = None
+  for i in range(repeats + memory):
+    work = tempfile.mkdtemp()
+    try:
+      with contextlib.redirect_stdout(io.StringIO()):
+        run = case(assembly, files, work, loaded)
+        if i == repeats:
+          tracemalloc.start()
+          run()
+          peak = tracemalloc.get_traced_memory()[1]
+          tracemalloc.stop()
+        else:
+          t0 = time.perf_counter()
+          run()
+          times.append(time.perf_counter() - t0)
+    finally:
+      shutil.rmtree(work)
+  return {'seconds': min(times), 'runs': times, 'peak_python_bytes': peak}
+
+
+def compare(old, new, tolerance):
+  '''print the time ratio of every case against an earlier run, return the names of the cases slower than the tolerance'''
+  slower = []
+  for name in new['results']:
+    if name not in old['results']:
+      continue
+    ratio = new['results'][name]['seconds'] / old['results'][name]['seconds']
+    flag = ''
+    if ratio > 1 + tolerance:
+      slower.append(name)
+      flag = '  REGRESSION'
+    print('%-20s %9.3f s -> %9.3f s  %5.2fx%s' % (name, old['results'][name]['seconds'], new['results'][name]['seconds'], ratio, flag))
+  return slower
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark the genome browser builders on synthetic data.')
+  parser.add_argument('--size', choices=sorted(SIZES), default='small')
+  parser.add_argument('--repeats', type=int, default=3)
+  parser.add_argument('--cases', default=','.join(CASES), help='comma separated cases among: ' + ', '.join(CASES))
+  parser.add_argument('--output', help='json file to write the results to')
+  parser.add_argument('--compare', help='json file of an earlier run to compare with')
+  parser.add_argument('--tolerance', type=float, default=0.2, help='relative slowdown reported as a regression')
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--no-memory', dest='memory', action='store_false', help='skip the run under tracemalloc, which is several times slower')
+  args = parser.parse_args()
+  cases = args.cases.split(',')
+  for name in cases:
+    if name not in CASES:
+      parser.error("unknown case '%s'" % name)
+
+  data = tempfile.mkdtemp()
+  try:
+    assembly, files = inputs(data, args.size, args.seed)
+    loaded = None
+    if set(cases) & set(['query', 'querySummary', 'getSequence']):
+      with contextlib.redirect_stdout(io.StringIO()):
+        loaded = load_all(assembly, files, data, SIZES[args.size]['queries'])
+    results = dict()
+    for name in cases:
+      results[name] = measure(name, assembly, files, loaded, args.repeats, args.memory)
+      peak = results[name]['peak_python_bytes']
+      print('%-20s %9.3f s  %s' % (name, results[name]['seconds'], '' if peak is None else '%8.1f MB' % (peak/float(1 << 20))))
+    report = {
+      'size': args.size,
+      'parameters': SIZES[args.size],
+      'seed': args.seed,
+      'repeats': args.repeats,
+      'inputs': dict((key, os.path.getsize(path)) for key, path in files.items()),
+      'python': platform.python_version(),
+      'sqlite': sqlite3.sqlite_version,
+      'numpy': genomebrowser.numpy is not None,
+      'platform': platform.platform(),
+      'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+      'results': results,
+    }
+  finally:
+    shutil.rmtree(data)
+
+  if args.output:
+    con = open(args.output, 'w')
+    json.dump(report, con, indent=2)
+    con.close()
+  if args.compare:
+    con = open(args.compare)
+    old = json.load(con)
+    con.close()
+    if compare(old, report, args.tolerance):
+      sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,219 @@
+import os, io, zlib, struct, collections, concurrent.futures
+
+# BGZF is gzip made of independent blocks of at most 64kb, each one announcing its
+# compressed size in a 'BC' extra subfield, so blocks can be inflated in parallel
+# and addressed by virtual offsets (block offset << 16 | offset inside the block).
+
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+BGZF_READAHEAD = 64
+
+
+def is_bgzf(filename):
+  '''check if a file is BGZF compressed'''
+  con = open(filename,'rb')
+  header = con.read(18)
+  con.close()
+  return len(header) == 18 and header[:4] == BGZF_MAGIC and header[12:14] == b'BC'
+
+
+def inflate(data):
+  '''inflate the raw deflate payload of a block'''
+  return zlib.decompress(data, -15)
+
+
+class BgzfReader(io.RawIOBase):
+  '''raw reader of BGZF files which inflates the following blocks in a thread pool'''
+
+  def __init__(self, filename, threads = None):
+    self.__con__ = open(filename,'rb')
+    self.__threads__ = threads or min(8, os.cpu_count() or 1)
+    self.__pool__ = concurrent.futures.ThreadPoolExecutor(self.__threads__)
+    self.__pending__ = collections.deque()
+    self.__ahead__ = 1
+    self.__buffer__ = b''
+    self.__pos__ = 0
+    self.__eof__ = False
+
+  def readable(self):
+    return True
+
+  def __block__(self):
+    '''read the next compressed block from disk'''
+    header = self.__con__.read(12)
+    if len(header) < 12:
+      return None
+    xlen = struct.unpack('<H', header[10:12])[0]
+    extra = self.__con__.read(xlen)
+    bsize = None
+    i = 0
+    while i+4 <= len(extra):
+      slen = struct.unpack('<H', extra[i+2:i+4])[0]
+      if extra[i:i+2] == b'BC':
+        bsize = struct.unpack('<H', extra[i+4:i+6])[0]
+      i += 4+slen
+    if header[:4] != BGZF_MAGIC or bsize is None:
+      raise IOError('invalid BGZF block')
+    data = self.__con__.read(bsize+1-12-xlen)
+    return data[:-8]
+
+  def __fill__(self):
+    '''schedule blocks until enough of them are being inflated'''
+    while not self.__eof__ and len(self.__pending__) < self.__ahead__:
+      block = self.__block__()
+      if block is None:
+        self.__eof__ = True
+      else:
+        self.__pending__.append(self.__pool__.submit(inflate, block))
+    # read ahead further each time, up to BGZF_READAHEAD blocks, so short region reads stay cheap
+    self.__ahead__ = min(2*self.__ahead__, BGZF_READAHEAD)
+
+  def readinto(self, b):
+    while self.__pos__ >= len(self.__buffer__):
+      if len(self.__pending__) == 0:
+        self.__fill__()
+        if len(self.__pending__) == 0:
+          return 0
+      self.__buffer__ = self.__pending__.popleft().result()
+      self.__pos__ = 0
+      self.__fill__()
+    n = min(len(b), len(self.__buffer__)-self.__pos__)
+    b[:n] = self.__buffer__[self.__pos__:self.__pos__+n]
+    self.__pos__ += n
+    return n
+
+  def seek_virtual(self, offset):
+    '''move to a virtual offset'''
+    for future in self.__pending__:
+      future.cancel()
+    self.__pending__.clear()
+    self.__con__.seek(offset >> 16)
+    self.__eof__ = False
+    self.__ahead__ = 1
+    self.__buffer__ = b''
+    self.__pos__ = 0
+    skip = offset & 0xFFFF
+    while skip > 0:
+      data = self.read(skip)
+      if not data:
+        break
+      skip -= len(data)
+
+  def close(self):
+    if not self.closed:
+      for future in self.__pending__:
+        future.cancel()
+      self.__pool__.shutdown(wait=False)
+      self.__con__.close()
+    super().close()
+
+
+def read_index(filename):
+  '''read the tabix (.tbi) or coordinate-sorted (.csi) index of a BGZF file'''
+  if os.path.isfile(filename+'.tbi'):
+    path = filename+'.tbi'
+  elif os.path.isfile(filename+'.csi'):
+    path = filename+'.csi'
+  else:
+    return None
+  con = BgzfReader(path, 1)
+  data = con.read()
+  con.close()
+
+  def unpack(fmt, pos):
+    return struct.unpack_from(fmt, data, pos), pos+struct.calcsize(fmt)
+
+  index = {'linear': dict(), 'bins': dict(), 'min_shift': 14, 'depth': 5}
+  csi = data[:4] == b'CSI\x01'
+  if data[:4] == b'TBI\x01':
+    (n_ref,), pos = unpack('<i', 4)
+    header = data[pos:]
+  elif csi:
+    (index['min_shift'], index['depth'], l_aux), pos = unpack('<3i', 4)
+    header = data[pos:pos+l_aux]
+    (n_ref,), pos = unpack('<i', pos+l_aux)
+  else:
+    raise IOError('unknown index format')
+  if len(header) < 28:
+    raise IOError('index without tabix header')
+  fmt, col_seq, col_beg, col_end, meta, skip, l_nm = struct.unpack_from('<7i', header, 0)
+  names = header[28:28+l_nm].decode('utf-8').rstrip('\0').split('\0')
+  if not csi:
+    pos += 28+l_nm
+  for ref in range(n_ref):
+    bins = dict()
+    (n_bin,), pos = unpack('<i', pos)
+    for i in range(n_bin):
+      if csi:
+        (b, loffset, n_chunk), pos = unpack('<IQi', pos)
+      else:
+        (b, n_chunk), pos = unpack('<Ii', pos)
+      chunks = struct.unpack_from('<%dQ' % (2*n_chunk), data, pos)
+      pos += 16*n_chunk
+      bins[b] = list(zip(chunks[0::2], chunks[1::2]))
+    index['bins'][names[ref]] = bins
+    if not csi:
+      (n_intv,), pos = unpack('<i', pos)
+      index['linear'][names[ref]] = struct.unpack_from('<%dQ' % n_intv, data, pos)
+      pos += 8*n_intv
+  index['format'] = fmt
+  index['columns'] = (col_seq-1, col_beg-1, col_end-1)
+  index['meta'] = chr(meta)
+  index['skip'] = skip
+  return index
+
+
+def reg2bins(start, end, min_shift = 14, depth = 5):
+  '''list the bins that may hold records overlapping [start,end)'''
+  bins = []
+  end -= 1
+  shift = min_shift + depth*3
+  offset = 0
+  for level in range(depth+1):
+    bins.extend(range(offset+(start >> shift), offset+(end >> shift)+1))
+    shift -= 3
+    offset += 1 << (level*3)
+  return bins
+
+
+def read_region(filename, chrom, start, end, index = None):
+  '''yield the lines of an indexed BGZF file overlapping a 0-based, half-open region'''
+  if index is None:
+    index = read_index(filename)
+  if index is None or chrom not in index['bins']:
+    return
+  bins = index['bins'][chrom]
+  chunks = []
+  for b in reg2bins(max(start,0), end, index['min_shift'], index['depth']):
+    chunks.extend(bins.get(b, []))
+  linear = index['linear'].get(chrom)
+  if linear:
+    i = min(max(start,0) >> 14, len(linear)-1)
+    chunks = [x for x in chunks if x[1] > linear[i]]
+  if len(chunks) == 0:
+    return
+  col_seq, col_beg, col_end = index['columns']
+  vcf = (index['format'] & 0xFFFF) == 2
+  zero = (index['format'] & 0x10000) != 0
+  raw = BgzfReader(filename)
+  raw.seek_virtual(min(map(lambda x: x[0], chunks)))
+  con = io.TextIOWrapper(io.BufferedReader(raw, 1 << 16), encoding='utf-8', errors='replace')
+  try:
+    for line in con:
+      if line.startswith(index['meta']):
+        continue
+      aux = line.rstrip('\n').split('\t')
+      if aux[col_seq] != chrom:
+        break
+      s = int(aux[col_beg]) - (0 if zero else 1)
+      if s >= end:
+        break
+      if vcf:
+        e = s + len(aux[3])
+      elif col_end >= 0 and col_end != col_beg:
+        e = int(aux[col_end])
+      else:
+        e = s+1
+      if e > start:
+        yield line.rstrip('\n')
+  finally:
+    con.close()
@@ -1,50 +1,187 @@
-import os, json, re, sqlite3, shutil, tempfile, math
+import os, sys, json, re, sqlite3, shutil, tempfile, math, time, itertools, contextlib, concurrent.futures, functools, array, struct, mmap, hashlib, inspect, gzip, warnings
 # from .utils import createHTML, unique, open_file
-from utils import createHTML, unique, open_file
+from utils import createHTML, unique, open_file, BUFFER_SIZE
+from bgzf import is_bgzf, read_index, read_region
+from twobit import TwoBitWriter, TwoBitReader
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+
+def read_bed(filename):
+  '''read a bed file one line at a time, yielding a tuple per line'''
+  con = open_file(filename)
+  try:
+    for line in con:
+      line = line.rstrip().split("\t")
+      n = len(line)
+      for i in (1,2,6,7,9):
+        if i < n:
+          line[i] = int(line[i])
+      yield tuple(line)
+  finally:
+    con.close()
 
 
 def load_bed(filename):
   '''load a bed file into a list of lists'''
-  con = open_file(filename)
-  bed = list()
-  for line in con:
-    try: line = line.decode('utf-8')
-    except: pass
-    line = line.rstrip().split("\t")
-    aux = []
-    for i in range(len(line)):
-      val = line[i]
-      if i in [1,2,6,7,9]:
-        val = int(val)
-      aux.append(val)
-    bed.append(aux)
-  con.close()
-  return bed
+  return list(map(list, read_bed(filename)))
+
+
+FASTA_BLOCK = 1 << 24
+
+
+def read_lengths(fasta):
+  '''return the assembly of a fasta file from its .gb.lengths sidecar, None if it is missing or was written for another version of the file'''
+  try:
+    con = open(fasta+'.gb.lengths')
+    sidecar = json.load(con)
+    con.close()
+  except (OSError, ValueError):
+    return None
+  if not isinstance(sidecar,dict) or sidecar.get('size') != os.path.getsize(fasta) or sidecar.get('mtime') != os.path.getmtime(fasta):
+    return None
+  return [[name,0,length] for name, length in sidecar['lengths']]
+
+
+def write_lengths(fasta, assembly):
+  '''record the lengths of the sequences of a fasta file in a sidecar, with the size and modification time of the file they were measured on'''
+  sidecar = {'size': os.path.getsize(fasta), 'mtime': os.path.getmtime(fasta), 'lengths': [[x[0],x[2]] for x in assembly]}
+  try:
+    con = open(fasta+'.gb.lengths','w')
+    json.dump(sidecar, con)
+    con.close()
+  except OSError:
+    pass
+
+
+def scan_fasta(fasta, store = None):
+  '''read a fasta file once in large blocks and return its assembly, packing the bases into a sequence store writer if given'''
+  records = []
+  text = open_file(fasta)
+  con = text.buffer
+
+  def lines(data):
+    i = 0
+    while i < len(data):
+      if data[i:i+1] == b'>':
+        e = data.find(b'\n', i)
+        e = len(data) if e == -1 else e
+        name = re.split(' |\\|',data[i+1:e].decode('utf-8','replace').strip())[0]
+        records.append([name, 0])
+        if store is not None:
+          store.start(name)
+        i = e+1
+      else:
+        j = data.find(b'\n>', i)
+        j = len(data) if j == -1 else j+1
+        if len(records):
+          bases = data[i:j].translate(None, b' \t\r\n')
+          records[-1][1] += len(bases)
+          if store is not None:
+            store.write(bases.decode('ascii','replace'))
+        i = j
+
+  tail = b''
+  while True:
+    block = con.read(FASTA_BLOCK)
+    data = tail + block
+    if len(block):
+      cut = data.rfind(b'\n')+1
+      tail = data[cut:]
+      data = data[:cut]
+    lines(data)
+    if len(block) == 0:
+      break
+  text.close()
+  return list(map(lambda x: [x[0],0,x[1]], records))
 
 
 def get_assembly_from_fasta(fasta):
-  '''return an assembly from a fasta file'''
-  c = ''
+  '''return an assembly from fasta files, reusing the lengths recorded in their sidecars. Files without a valid sidecar are scanned and one is written for them'''
   assembly = []
   for i in fasta:
-    con = open_file(i)
-    for line in con:
-      try: line = line.decode('utf-8')
-      except: pass
-      line = line.strip()
-      if line.startswith('>'):
-        c = re.split(" |\|",re.sub("^>","",line))[0]
-        assembly.append([c,0,0])
-      else:
-        assembly[-1][2] = assembly[-1][2] + len(line)
-    con.close()
+    lengths = read_lengths(i)
+    if lengths is None:
+      lengths = scan_fasta(i)
+      write_lengths(i, lengths)
+    assembly.extend(lengths)
   return assembly
 
 
+def fasta_key(fasta):
+  '''identify a fasta file by path, size and modification time'''
+  return (os.path.abspath(fasta), os.path.getsize(fasta), os.path.getmtime(fasta))
+
+
+SEQUENCES = 'sequences.2bit'
+
+
+@functools.lru_cache(maxsize=16)
+def sequence_store(path, mtime):
+  '''open the sequence store of a genome browser, cached while the file is unchanged'''
+  return TwoBitReader(path)
+
+
+class Assembly(list):
+  '''a genome assembly, the list of its [chromosome, start, end] rows, which computes the values derived from them once'''
+
+  @functools.cached_property
+  def names(self):
+    '''chromosome names in order of first appearance'''
+    return unique(map(lambda x: x[0], self))
+
+  @functools.cached_property
+  def lengths(self):
+    '''length of each chromosome, in order'''
+    lengths = dict.fromkeys(self.names, 0)
+    for row in self:
+      if row[2] > lengths[row[0]]:
+        lengths[row[0]] = row[2]
+    return lengths
+
+  @functools.cached_property
+  def max(self):
+    '''end of the longest row'''
+    return max(map(lambda x: x[2], self))
+
+  @functools.cached_property
+  def cell(self):
+    '''bin size used to reduce a genome map track to about 100000 values'''
+    return math.ceil(sum(self.lengths.values())/100000)
+
+  @functools.cached_property
+  def json(self):
+    '''json for chromosomes' cytobands'''
+    return chromosomesJSON(self)
+
+  @functools.cached_property
+  def map(self):
+    '''json for a genome map without track'''
+    return genomemapJSON(None, self)
+
+
+@functools.lru_cache(maxsize=32)
+def load_assembly(path, mtime):
+  '''read a built-in (json) or bed assembly file, cached while the file is unchanged'''
+  if path.endswith('.json'):
+    return Assembly(json.loads(open(path).read()))
+  return Assembly(load_bed(path))
+
+
 def get_assembly(assembly):
-  '''return the specified assembly'''
+  '''return the specified assembly as an Assembly, fasta files are read by get_assembly_from_fasta'''
   if assembly is None:
     return None
+  if isinstance(assembly,Assembly):
+    return assembly
   if not isinstance(assembly,str):
     fasta = True
     valid = True
@@ -58,14 +195,14 @@ def get_assembly(assembly):
       elif not os.path.isfile(i):
         fasta = False
     if fasta:
-      return get_assembly_from_fasta(assembly)
+      return Assembly(get_assembly_from_fasta(assembly))
     elif valid:
-      return assembly
+      return Assembly(assembly)
   if os.path.isfile(assembly):
-    return load_bed(assembly)
+    return load_assembly(os.path.abspath(assembly), os.path.getmtime(assembly))
   if assembly in ['NCBI36', 'GRCh37', 'GRCh38', 'GRCh37.bands', 'GRCh38.bands']:
-    assembly = os.path.join(os.path.dirname(__file__), 'assemblies', assembly+'.json')
-    return json.loads(open(assembly).read())
+    assembly = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assemblies', assembly+'.json')
+    return load_assembly(assembly, os.path.getmtime(assembly))
   print("Available assemblies are: 'NCBI36', 'GRCh37', 'GRCh38', 'GRCh37.bands', 'GRCh38.bands', but not '%s'." % assembly)
   return None
 
@@ -85,17 +222,18 @@ def chromosomesJSON(assembly):
 def segmentation(track, cell):
   '''segmentation function'''
   seg = dict()
-  for i in range(len(track)):
+  for row in track:
     try:
-      value = float(track[i][4])
+      value = float(row[4])
     except:
       continue
-    j = (track[i][0],math.ceil(((track[i][1]+track[i][2])/2)/cell))
-    try:
-      seg[j][0] += 1
-      seg[j][1] += value
-    except:
+    j = (row[0],math.ceil(((row[1]+row[2])/2)/cell))
+    aux = seg.get(j)
+    if aux is None:
       seg[j] = [1,value]
+    else:
+      aux[0] += 1
+      aux[1] += value
 
   track = []
   for i in seg:
@@ -105,57 +243,262 @@ def segmentation(track, cell):
   return track
 
 
-def genomemapJSON(data, assembly):
-  '''create json for genome map'''
+def bed_chunks(filename, chromosomes):
+  '''read a bed file in chunks of numpy arrays: chromosome code, start, end, score and whether the score is valid'''
+  con = open_file(filename)
+  try:
+    while True:
+      lines = con.readlines(BUFFER_SIZE)
+      if len(lines) == 0:
+        break
+      yield bed_chunk(lines, chromosomes)
+  finally:
+    con.close()
+
+
+def numbers(values, dtype):
+  '''parse a list of strings into a numpy array in one pass, None if any of them is not a plain number'''
+  try:
+    with warnings.catch_warnings():
+      # older numpy versions warn and stop at the first field they cannot parse instead of raising
+      warnings.simplefilter('ignore', DeprecationWarning)
+      array = numpy.fromstring('\t'.join(values), dtype=dtype, sep='\t')
+  except ValueError:
+    return None
+  if len(array) != len(values):
+    return None
+  return array
+
+
+def bed_chunk(lines, chromosomes):
+  '''convert lines of a bed file into numpy arrays. When every line has the same number of fields, the columns are split and parsed at once, otherwise the lines are read one at a time as read_bed does'''
+  k = lines[0].count('\t')+1
+  starts = ends = None
+  text = ''.join(lines)
+  if text.endswith('\n'):
+    text = text[:-1]
+  if k >= 5 and text.count('\t') == (k-1)*len(lines):
+    fields = text.replace('\n','\t').split('\t')
+    names = fields[0::k]
+    starts = numbers(fields[1::k], numpy.int64)
+    ends = numbers(fields[2::k], numpy.int64)
+    scores = fields[4::k]
+  if starts is None or ends is None:
+    rows = [line.rstrip().split('\t') for line in lines]
+    names = [row[0] for row in rows]
+    starts = numpy.array([int(row[1]) for row in rows],dtype=numpy.int64)
+    ends = numpy.array([int(row[2]) for row in rows],dtype=numpy.int64)
+    scores = [row[4] if len(row) > 4 else '' for row in rows]
+  values = numbers(scores, numpy.float64)
+  if values is None:
+    values = []
+    valid = []
+    for score in scores:
+      try:
+        values.append(float(score))
+        valid.append(True)
+      except ValueError:
+        values.append(0.0)
+        valid.append(False)
+    values = numpy.array(values,dtype=numpy.float64)
+    valid = numpy.array(valid,dtype=bool)
+  else:
+    valid = numpy.ones(len(values),dtype=bool)
+  for name in dict.fromkeys(names):
+    chromosomes.setdefault(name,len(chromosomes))
+  codes = numpy.fromiter(map(chromosomes.__getitem__, names), dtype=numpy.int64, count=len(names))
+  return codes, starts, ends, values, valid
+
+
+def segmentation_numpy(chunks, cell):
+  '''vectorized segmentation function over bed chunks, keeps the bins in order of first appearance'''
+  width = 1 << 32
+  slots = dict()
+  counts = numpy.zeros(0, dtype=numpy.int64)
+  # sums start at -0.0, the identity of float addition, so they match the python path exactly
+  sums = numpy.zeros(0, dtype=numpy.float64)
+  for codes, starts, ends, values, valid in chunks:
+    codes, starts, ends, values = codes[valid], starts[valid], ends[valid], values[valid]
+    if len(codes) == 0:
+      continue
+    bins = numpy.ceil(((starts+ends)/2)/cell).astype(numpy.int64)
+    keys, first, inverse = numpy.unique(codes*width+bins, return_index=True, return_inverse=True)
+    for key in keys[numpy.argsort(first, kind='stable')].tolist():
+      if key not in slots:
+        slots[key] = len(slots)
+    if len(slots) > len(counts):
+      size = max(len(slots), 2*len(counts))
+      counts = numpy.concatenate((counts, numpy.zeros(size-len(counts), dtype=numpy.int64)))
+      sums = numpy.concatenate((sums, numpy.full(size-len(sums), -0.0)))
+    slot = numpy.array([slots[key] for key in keys.tolist()], dtype=numpy.int64)[inverse.ravel()]
+    counts += numpy.bincount(slot, minlength=len(counts))
+    numpy.add.at(sums, slot, values)
+  keys = numpy.array(list(slots), dtype=numpy.int64)
+  bins = keys % width
+  return keys // width, (bins-1)*cell, bins*cell, sums[:len(keys)]/counts[:len(keys)]
+
+
+def genomemap_python(data, d, assembly):
+  '''fill the genome map data from a bed file'''
+  rows = read_bed(data)
+  data = list(itertools.islice(rows, 100001))
+  if len(data)>100000:
+    data = itertools.chain(data, rows)
+    cell = assembly.cell
+    if cell>1:
+      data = segmentation(data,cell)
+  dataMin = float("inf")
+  dataMax = float("-inf")
+  chromosomes = assembly.lengths
+  for row in data:
+    if not row[0] in chromosomes:
+      continue
+    value = None
+    try:
+      value = float(row[4])
+    except:
+      continue
+    if row[0] not in d['data'].keys():
+      d['data'][row[0]] = []
+    d['data'][row[0]].append([row[1],row[2],value])
+    if value < dataMin:
+      dataMin = value
+    if value > dataMax:
+      dataMax = value
+  d['dataDomain'] = [dataMin,dataMax]
+
+
+def genomemap_numpy(data, d, assembly):
+  '''fill the genome map data from a bed file with numpy arrays'''
+  names = dict()
+  chunks = bed_chunks(data, names)
+  head = []
+  n = 0
+  for chunk in chunks:
+    head.append(chunk)
+    n += len(chunk[0])
+    if n > 100000:
+      break
+  chunks = itertools.chain(head, chunks)
+  cell = assembly.cell if n > 100000 else 1
+  if cell>1:
+    codes, starts, ends, values = segmentation_numpy(chunks, cell)
+  else:
+    chunks = list(chunks)
+    if len(chunks) == 0:
+      chunks = [[numpy.zeros(0, dtype=t) for t in (numpy.int64,numpy.int64,numpy.int64,numpy.float64,bool)]]
+    codes, starts, ends, values, valid = [numpy.concatenate(x) for x in zip(*chunks)]
+    codes, starts, ends, values = codes[valid], starts[valid], ends[valid], values[valid]
+  names = list(names)
+  keep = numpy.isin(codes, [i for i in range(len(names)) if names[i] in assembly.lengths])
+  codes, starts, ends, values = codes[keep], starts[keep], ends[keep], values[keep]
+  # group rows by chromosome in order of first appearance, keeping the row order
+  present, first = numpy.unique(codes, return_index=True)
+  rank = numpy.empty(len(names), dtype=numpy.int64)
+  rank[present[numpy.argsort(first, kind='stable')]] = numpy.arange(len(present))
+  order = numpy.argsort(rank[codes], kind='stable')
+  codes, starts, ends, values = codes[order], starts[order], ends[order], values[order]
+  bounds = [0] + (numpy.flatnonzero(numpy.diff(codes))+1).tolist() + [len(codes)]
+  for i in range(len(bounds)-1):
+    s = slice(bounds[i], bounds[i+1])
+    if bounds[i] < bounds[i+1]:
+      d['data'][names[codes[bounds[i]]]] = list(map(list, zip(starts[s].tolist(), ends[s].tolist(), values[s].tolist())))
+  values = values[~numpy.isnan(values)].tolist()
+  d['dataDomain'] = [min(values,default=float("inf")),max(values,default=float("-inf"))]
+
+
+def genomemap_data(data, assembly):
+  '''create the genome map dictionary'''
+  assembly = get_assembly(assembly)
   d = dict()
-  d['chromosomes'] = unique(map(lambda x: x[0], assembly))
+  d['chromosomes'] = assembly.names
   d['data'] = dict()
-  d['max'] = max(map(lambda x: x[2], assembly))
+  d['max'] = assembly.max
   if not data is None:
-    data = load_bed(data)
-    if len(data)>100000:
-      chr_max_len = dict()
-      for i in d['chromosomes']:
-        chr_max_len[i] = 0
-      for i in range(len(assembly)):
-        if assembly[i][2] > chr_max_len[assembly[i][0]]:
-          chr_max_len[assembly[i][0]] = assembly[i][2]
-      assembly_len = sum(chr_max_len.values())
-      cell = math.ceil(assembly_len/100000)
-      if cell>1:
-        data = segmentation(data,cell)
-    dataMin = float("inf")
-    dataMax = float("-inf")
-    for i in range(len(data)):
-      if not data[i][0] in d['chromosomes']:
-        continue
-      value = None
-      try:
-        value = float(data[i][4])
-      except:
-        continue
-      if data[i][0] not in d['data'].keys():
-        d['data'][data[i][0]] = []
-      d['data'][data[i][0]].append([data[i][1],data[i][2],value])
-      if value < dataMin:
-        dataMin = value
-      if value > dataMax:
-        dataMax = value
-    d['dataDomain'] = [dataMin,dataMax]
-  return json.dumps(d)
+    if numpy is None:
+      genomemap_python(data, d, assembly)
+    else:
+      genomemap_numpy(data, d, assembly)
+  return d
+
+
+def genomemapJSON(data, assembly):
+  '''create json for genome map'''
+  return json.dumps(genomemap_data(data, assembly))
+
+
+def genomemap_chunks(d):
+  '''yield the json of a genome map dictionary one chromosome at a time, as json.dumps would write it'''
+  for i, key in enumerate(d):
+    yield ('{' if i == 0 else ', ') + json.dumps(key) + ': '
+    if key == 'data':
+      yield '{'
+      for j, chrom in enumerate(d[key]):
+        yield ('' if j == 0 else ', ') + json.dumps(chrom) + ': ' + json.dumps(d[key][chrom])
+      yield '}'
+    else:
+      yield json.dumps(d[key])
+  yield '}'
+
+
+MAP_FILES = {'binary': 'mapdata.bin', 'gzip': 'mapdata.bin.gz', 'brotli': 'mapdata.bin.br'}
+
+
+def genomemap_binary(data, assembly, mapFormat = 'binary'):
+  '''create the genome map json for index.html and the binary file it refers to, return both with the file name'''
+  if mapFormat == 'brotli' and brotli is None:
+    print('brotli is not installed, the genome map data will be gzip compressed.')
+    mapFormat = 'gzip'
+  d = genomemap_data(data, assembly)
+  payload = bytearray()
+  for chrom in d['data']:
+    rows = d['data'][chrom]
+    for column, typecode in ((0,'I'),(1,'I'),(2,'f')):
+      values = array.array(typecode, map(lambda x: x[column], rows))
+      if sys.byteorder == 'big':
+        values.byteswap()
+      payload += values.tobytes()
+    d['data'][chrom] = [len(payload)-12*len(rows), len(rows)]
+  if mapFormat == 'gzip':
+    payload = gzip.compress(bytes(payload), 6)
+  elif mapFormat == 'brotli':
+    payload = brotli.compress(bytes(payload))
+  d['binary'] = {'file': MAP_FILES[mapFormat], 'encoding': mapFormat, 'layout': ['Uint32','Uint32','Float32']}
+  return json.dumps(d), MAP_FILES[mapFormat], bytes(payload)
+
+
+def genomemap_output(data, assembly, mapFormat = 'json'):
+  '''create the genome map json for index.html, and the name and content of its binary file when mapFormat is not "json". Embedded map data is returned as json chunks, so the whole string is never built'''
+  if data is None:
+    return assembly.map, None, None
+  if mapFormat in MAP_FILES:
+    return genomemap_binary(data, assembly, mapFormat)
+  return genomemap_chunks(genomemap_data(data, assembly)), None, None
+
+
+def write_map(directory, filename, payload):
+  '''write the binary genome map data next to index.html'''
+  if filename is not None:
+    con = open(os.path.join(directory, filename), 'wb')
+    con.write(payload)
+    con.close()
 
 
-def genomemap(assembly, mapTrack = None, directory = "GenomeMap"):
+def genomemap(assembly, mapTrack = None, directory = "GenomeMap", mapFormat = "json", assets = None):
   '''Create an interative genome map.
   
   Arguments:
-      assembly -- a genome assembly, D3GB provides human assemblies ('NCBI36', 'GRCh37', 'GRCh38'), human assemblies with cytobands ('GRCh37.bands', 'GRCh38.bands'), or it can be an iterate of fasta file(s) paths or a single bed file path.
+      assembly -- a genome assembly, D3GB provides human assemblies ('NCBI36', 'GRCh37', 'GRCh38'), human assemblies with cytobands ('GRCh37.bands', 'GRCh38.bands'), or it can be an iterate of fasta file(s) paths or a single bed file path. The lengths of fasta files are kept in a private .gb.lengths file next to them, so later runs do not read them again.
       mapTrack -- a bed file path with values to represent on the genome map. (default None)
       directory -- a string representing the directory where the graph will be saved. (default "GenomeBrowser")
+      mapFormat -- a string with the format of the genome map data: "json" embeds it in index.html, "binary", "gzip" or "brotli" write it as typed arrays in a file next to index.html, uncompressed or compressed. (default "json")
+      assets -- a string with a shared directory where the scripts and styles are kept once per version, to be hard linked (or symlinked across file systems) instead of copied into every output directory. (default None)
   '''
   assembly = get_assembly(assembly)
   if assembly is not None:
-    createHTML(directory, ["d3.min.js","jspdf.min.js","functions.js","genomemap.js"], genomemapJSON(mapTrack, assembly), chromosomesJSON(assembly))
+    data, filename, payload = genomemap_output(mapTrack, assembly, mapFormat)
+    createHTML(directory, ["d3.min.js","jspdf.min.js","functions.js","genomemap.js"], data, assembly.json, assets=assets)
+    write_map(directory, filename, payload)
 
 
 def openDB(directory):
@@ -166,18 +509,482 @@ def openDB(directory):
 def createDB(directory):
   '''create sqlite to store tracks'''
   db = openDB(directory)
-  c = db.cursor()
-  c.execute("CREATE TABLE IF NOT EXISTS tbl_tracks (trackid INTEGER PRIMARY KEY, trackname TEXT, type TEXT, color TEXT, data TEXT)")
-  c.execute("CREATE TABLE IF NOT EXISTS tbl_segments (trackid INTEGER, chr TEXT COLLATE NOCASE, start INTEGER, end INTEGER, name TEXT, score TEXT, strand TEXT, thickStart INTEGER, thickEnd INTEGER, itemRGB TEXT, blockCount INTEGER, blockSizes TEXT, blockStarts TEXT)")
-  c.execute("CREATE INDEX location ON tbl_segments (chr,start,end)")
+  create_tables(db.cursor())
   db.commit()
   db.close()
 
 
+def create_tables(c):
+  '''create the track tables in a database'''
+  c.execute("CREATE TABLE IF NOT EXISTS tbl_tracks (trackid INTEGER PRIMARY KEY, trackname TEXT, type TEXT, color TEXT, data TEXT)")
+  c.execute("CREATE TABLE IF NOT EXISTS tbl_segments (trackid INTEGER, chr TEXT COLLATE NOCASE, start INTEGER, end INTEGER, name TEXT, score TEXT, strand TEXT, thickStart INTEGER, thickEnd INTEGER, itemRGB TEXT, blockCount INTEGER, blockSizes TEXT, blockStarts TEXT, bin INTEGER)")
+  c.execute("CREATE TABLE IF NOT EXISTS tbl_zoom (trackid INTEGER, level INTEGER, chr TEXT COLLATE NOCASE, start INTEGER, end INTEGER, count INTEGER, sum REAL, min REAL, max REAL)")
+  c.execute("CREATE INDEX IF NOT EXISTS zoom ON tbl_zoom (trackid,level,chr,start)")
+  c.execute("CREATE TABLE IF NOT EXISTS tbl_external (trackid INTEGER PRIMARY KEY, path TEXT, format TEXT, meta TEXT)")
+  c.execute("CREATE TABLE IF NOT EXISTS tbl_samples (trackid INTEGER PRIMARY KEY, master INTEGER, sample INTEGER)")
+  c.execute("CREATE TABLE IF NOT EXISTS tbl_genotypes (segid INTEGER PRIMARY KEY, format TEXT, present BLOB, layout TEXT, data BLOB)")
+  c.execute("CREATE TABLE IF NOT EXISTS tbl_attributes (segid INTEGER, key TEXT, value TEXT, number REAL)")
+  c.execute("CREATE TABLE IF NOT EXISTS tbl_manifest (input TEXT PRIMARY KEY, size INTEGER, mtime REAL, hash TEXT, params TEXT, tracks TEXT)")
+
+
+def create_indexes(c):
+  '''create the tbl_segments indexes, deferred until the tracks are loaded'''
+  c.execute("CREATE INDEX IF NOT EXISTS location ON tbl_segments (chr,start,end)")
+  c.execute("CREATE INDEX IF NOT EXISTS binned ON tbl_segments (chr,bin)")
+  c.execute("CREATE INDEX IF NOT EXISTS track ON tbl_segments (trackid)")
+  c.execute("CREATE INDEX IF NOT EXISTS attribute_segment ON tbl_attributes (segid,key)")
+  c.execute("CREATE INDEX IF NOT EXISTS attribute_number ON tbl_attributes (key,number)")
+  c.execute("CREATE INDEX IF NOT EXISTS attribute_value ON tbl_attributes (key,value)")
+
+
+def drop_indexes(c):
+  '''drop the tbl_segments indexes before a batch load'''
+  c.execute("DROP INDEX IF EXISTS location")
+  c.execute("DROP INDEX IF EXISTS binned")
+  c.execute("DROP INDEX IF EXISTS track")
+  c.execute("DROP INDEX IF EXISTS attribute_segment")
+  c.execute("DROP INDEX IF EXISTS attribute_number")
+  c.execute("DROP INDEX IF EXISTS attribute_value")
+
+
 def aux_genes(c):
-  '''create the gene auxiliar database table'''
-  c.execute("DROP TABLE IF EXISTS aux_genes")
-  c.execute("CREATE TABLE aux_genes AS SELECT chr, start, end, name, score FROM tbl_segments NATURAL JOIN tbl_tracks WHERE (type='gene' OR type='exons')")
+  '''create the gene auxiliar database table, or bring it up to date by adding the gene tracks it lacks and dropping the rows of tracks that are gone'''
+  columns = [row[1] for row in c.execute("PRAGMA table_info(aux_genes)")]
+  if 'id' not in columns:
+    c.execute("DROP TABLE IF EXISTS aux_genes")
+    c.execute("DROP TABLE IF EXISTS aux_genes_fts")
+    c.execute("CREATE TABLE aux_genes (chr TEXT, start INTEGER, end INTEGER, name TEXT COLLATE NOCASE, score TEXT, trackid INTEGER, id INTEGER PRIMARY KEY)")
+    c.execute("INSERT INTO aux_genes (chr, start, end, name, score, trackid) SELECT chr, start, end, name, score, trackid FROM tbl_segments NATURAL JOIN tbl_tracks WHERE (type='gene' OR type='exons')")
+    c.execute("CREATE INDEX aux_genes_track ON aux_genes (trackid)")
+    c.execute("CREATE INDEX aux_genes_name ON aux_genes (name)")
+    gene_index(c)
+    return
+  genes = "SELECT trackid FROM tbl_tracks WHERE (type='gene' OR type='exons')"
+  # walk the distinct trackids of aux_genes down its index instead of scanning every row
+  present = "WITH RECURSIVE present(track) AS (SELECT min(trackid) FROM aux_genes UNION ALL SELECT (SELECT min(trackid) FROM aux_genes WHERE trackid>track) FROM present WHERE track IS NOT NULL) "
+  c.execute(present + "DELETE FROM aux_genes WHERE trackid IN (SELECT track FROM present WHERE track IS NOT NULL EXCEPT %s)" % genes)
+  c.execute(present + "INSERT INTO aux_genes (chr, start, end, name, score, trackid) SELECT chr, start, end, name, score, trackid FROM tbl_segments WHERE trackid IN (%s EXCEPT SELECT track FROM present)" % genes)
+
+
+def gene_index(c):
+  '''build the full text index of the gene names and attributes, kept in step with aux_genes by triggers. Skipped when sqlite lacks FTS5'''
+  try:
+    c.execute("CREATE VIRTUAL TABLE aux_genes_fts USING fts5(name, score, content='aux_genes', content_rowid='id')")
+  except sqlite3.OperationalError:
+    return
+  c.execute("INSERT INTO aux_genes_fts (aux_genes_fts) VALUES ('rebuild')")
+  c.execute("CREATE TRIGGER aux_genes_insert AFTER INSERT ON aux_genes BEGIN INSERT INTO aux_genes_fts (rowid, name, score) VALUES (new.id, new.name, new.score); END")
+  c.execute("CREATE TRIGGER aux_genes_delete AFTER DELETE ON aux_genes BEGIN INSERT INTO aux_genes_fts (aux_genes_fts, rowid, name, score) VALUES ('delete', old.id, old.name, old.score); END")
+
+
+BATCH_SIZE = 50000
+
+BULK_PRAGMAS = {'journal_mode': 'MEMORY', 'synchronous': 'OFF', 'cache_size': -262144}
+# deletes only change rows already on disk, so they keep the journal and a crash cannot corrupt the database
+DELETE_PRAGMAS = {'cache_size': -262144}
+
+SEGMENT_COLUMNS = ('trackid','chr','start','end','name','score','strand','thickStart','thickEnd','itemRGB','blockCount','blockSizes','blockStarts')
+
+VCF_COLUMNS = ('rowid','trackid','chr','start','end','name','score')
+
+GFF_COLUMNS = ('trackid','chr','start','end','name','score','strand','thickStart','thickEnd','blockCount','blockSizes','blockStarts')
+
+GBK_COLUMNS = ('trackid','chr','start','end','name','score','strand','blockCount','blockSizes','blockStarts')
+
+# UCSC binning scheme: 128kb bins at the finest level, 8 times larger at each level up.
+# Standard bins cover 512Mb, extended bins (offset by 4681) cover larger chromosomes.
+BIN_FIRST_SHIFT = 17
+BIN_NEXT_SHIFT = 3
+BIN_OFFSETS = (512+64+8+1, 64+8+1, 8+1, 1, 0)
+BIN_OFFSETS_EXTENDED = (4096+512+64+8+1, 512+64+8+1, 64+8+1, 8+1, 1, 0)
+BIN_OFFSET_OLD_TO_EXTENDED = 4681
+BIN_STANDARD_MAX = 1 << 29
+
+
+def bin_from_range(start, end):
+  '''return the smallest bin containing the range [start,end)'''
+  if end <= BIN_STANDARD_MAX:
+    offsets = BIN_OFFSETS
+    extended = 0
+  else:
+    offsets = BIN_OFFSETS_EXTENDED
+    extended = BIN_OFFSET_OLD_TO_EXTENDED
+  start = start >> BIN_FIRST_SHIFT
+  end = (end-1) >> BIN_FIRST_SHIFT
+  for offset in offsets:
+    if start == end:
+      return extended + offset + start
+    start >>= BIN_NEXT_SHIFT
+    end >>= BIN_NEXT_SHIFT
+  return extended
+
+
+def bin_ranges(start, end):
+  '''return the (first,last) bin ranges that may hold features overlapping [start,end)'''
+  ranges = []
+  for offsets, extended, limit in ((BIN_OFFSETS, 0, BIN_STANDARD_MAX), (BIN_OFFSETS_EXTENDED, BIN_OFFSET_OLD_TO_EXTENDED, None)):
+    s = max(start, 0)
+    e = end if limit is None else min(end, limit)
+    if s >= e:
+      continue
+    s = s >> BIN_FIRST_SHIFT
+    e = (e-1) >> BIN_FIRST_SHIFT
+    for offset in offsets:
+      ranges.append((extended+offset+s, extended+offset+e))
+      s >>= BIN_NEXT_SHIFT
+      e >>= BIN_NEXT_SHIFT
+  return ranges
+
+
+@contextlib.contextmanager
+def bulk_load(db, pragmas = BULK_PRAGMAS):
+  '''set sqlite pragmas for bulk loading, or the given ones, and restore them afterwards, keeping WAL databases in WAL mode'''
+  db.commit()
+  saved = dict()
+  for pragma in pragmas:
+    value = db.execute('PRAGMA %s' % pragma).fetchone()[0]
+    # a WAL database may be open in other connections, such as the readers of a query server, and leaving WAL would need them closed
+    if pragma == 'journal_mode' and value == 'wal':
+      continue
+    saved[pragma] = value
+    db.execute('PRAGMA %s=%s' % (pragma, pragmas[pragma]))
+  try:
+    yield db
+    db.commit()
+  except:
+    db.rollback()
+    raise
+  finally:
+    for pragma in saved:
+      db.execute('PRAGMA %s=%s' % (pragma, saved[pragma]))
+
+
+def insert_segments(c, rows, columns = SEGMENT_COLUMNS, attributes = False):
+  '''insert an iterable of segment rows in batches, filling their bin, return the number of rows inserted. With attributes, every row ends with a list of (key, value) pairs to store in tbl_attributes'''
+  s = columns.index('start')
+  e = columns.index('end')
+  r = columns.index('rowid') if 'rowid' in columns else None
+  columns = tuple(columns) + ('bin',)
+  sql = 'INSERT INTO tbl_segments (%s) VALUES (%s)' % (','.join(columns), ','.join('?'*len(columns)))
+  rows = iter(rows)
+  n = 0
+  while True:
+    batch = list(itertools.islice(rows, BATCH_SIZE))
+    if len(batch) == 0:
+      break
+    if attributes:
+      # rows without an explicit rowid get max(rowid)+1, one after the other
+      first = c.execute('SELECT coalesce(max(rowid),0) FROM tbl_segments').fetchone()[0] + 1
+      pairs = [(first+i if r is None else row[r], row[-1]) for i, row in enumerate(batch)]
+      batch = [row[:-1] for row in batch]
+    c.executemany(sql, [tuple(row) + (bin_from_range(row[s],row[e]),) for row in batch])
+    if attributes:
+      c.executemany('INSERT INTO tbl_attributes VALUES (?,?,?,?)', [(segid, key, value, attribute_number(value)) for segid, items in pairs for key, value in items])
+    n += len(batch)
+  return n
+
+
+NUMBER_PATTERN = re.compile(r'[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$')
+
+ATTRIBUTE_OPERATORS = {'=': 'value=?', '!=': 'value!=?', '<': 'number<?', '<=': 'number<=?', '>': 'number>?', '>=': 'number>=?', 'contains': 'instr(lower(value),lower(?))>0'}
+
+
+def attribute_number(value):
+  '''the numeric value of an attribute, None if it is not a number'''
+  if value is None or not NUMBER_PATTERN.match(value):
+    return None
+  return float(value)
+
+
+def attribute_filter(filters):
+  '''SQL condition and parameters selecting the tbl_segments rows whose attributes pass every (key, operator, value) filter'''
+  sql = []
+  params = []
+  for key, op, value in filters:
+    if op not in ATTRIBUTE_OPERATORS:
+      raise ValueError("unknown attribute operator '%s'" % op)
+    condition = ATTRIBUTE_OPERATORS[op]
+    if op in ('=','!=') and isinstance(value,(int,float)):
+      condition = condition.replace('value','number')
+    sql.append("tbl_segments.rowid IN (SELECT segid FROM tbl_attributes WHERE key=? AND %s)" % condition)
+    params.extend((key,value))
+  return " AND ".join(sql), params
+
+
+def bed_row(line, trackid, numeric):
+  '''convert the fields of a bed line into a tbl_segments row'''
+  n = len(line)
+  row = [trackid] + line[:12] + [None]*(12-n)
+  for i in (1,2,6,7,9):
+    if i < n:
+      row[i+1] = int(line[i])
+  if numeric and n > 4:
+    row[5] = float(line[4])
+  if n > 5 and line[5] not in ['+','-']:
+    row[6] = None
+  return row
+
+
+def bed_rows(con, trackid, tracktype):
+  '''parse the lines of a bed file into tbl_segments rows'''
+  numeric = tracktype in ['value', 'score']
+  for line in con:
+    yield bed_row(line.rstrip().split("\t"), trackid, numeric)
+
+
+def vcf_description(line):
+  '''get the ID and Description of a vcf header line'''
+  desc = []
+  line = re.findall('<(.+)>',line)[0].split(',')
+  for l in line:
+    l = l.split('=')
+    if l[0] == 'ID':
+      desc.append(l[1])
+    if l[0] == 'Description':
+      desc.append(l[1].replace('"',''))
+  return desc
+
+
+def vcf_fields(aux, datacsq):
+  '''(key, value) pairs of the REF, ALT, QUAL and INFO fields of a vcf record, flags have a None value'''
+  score = [("REF",aux[3])]
+  if aux[4]!='.':
+    score.append(("ALT",aux[4]));
+  if aux[5]!='.':
+    score.append(("QUAL",aux[5]));
+  try:
+    info = aux[7].split(';')
+    for infi in info:
+      if infi.startswith("CSQ="):
+        csq = infi.replace('CSQ=','').split(',')[0].split('|')
+        for i in range(len(datacsq)):
+          if csq[i]!="":
+            score.append((datacsq[i],csq[i]))
+      else:
+        infi = infi.split('=',1)
+        score.append((infi[0],infi[1] if len(infi) > 1 else None))
+  except:
+    pass
+  return score
+
+
+def vcf_info(fields):
+  '''join the fields of a vcf record'''
+  return '|'.join(map(lambda x: x[0] if x[1] is None else x[0]+'='+x[1], fields))
+
+
+def vcf_sample(aux, i):
+  '''join the FORMAT fields of the i-th sample of a vcf record, None if they don't match'''
+  if len(aux) < 9:
+    return None
+  fmt = aux[8].split(":")
+  attr = aux[i+8].split(":")
+  if len(fmt) != len(attr):
+    return None
+  for j in range(len(fmt)):
+    attr[j] = fmt[j]+'='+attr[j]
+  return '|'.join(attr)
+
+
+# Genotypes of the samples of a vcf record are stored in one tbl_genotypes row keyed to the
+# variant's row in tbl_segments. Each FORMAT field is packed as a column over the samples:
+# GT as uint16 codes ('H'), integers as int32 ('i'), decimals as float64 ('d') when they
+# convert back to the same text, comma-separated integers as int32 lists ('l') and text ('t')
+# otherwise. List and text columns start with the uint32 byte offsets of the n samples and of
+# their end, relative to the column, so any sample is read without going through the others.
+GT_PATTERN = re.compile(r'(\d+|\.)(?:([/|])(\d+|\.))?$')
+INT_PATTERN = re.compile(r'-?[1-9]\d{0,8}$|0$')
+FLOAT_PATTERN = re.compile(r'-?\d+\.\d+$')
+GT_ABSENT = 0xFFFF
+INT_MISSING = -2**31
+
+
+def gt_code(gt):
+  '''pack a diploid or haploid GT into 15 bits, None if it can't be packed'''
+  m = GT_PATTERN.match(gt)
+  if m is None:
+    return None
+  code = 0
+  for allele, shift in ((m.group(1),0),(m.group(3),7)):
+    if allele is None:
+      code |= 127 << shift
+    elif allele != '.':
+      if len(allele) > 1 and (allele[0] == '0' or int(allele) > 125):
+        return None
+      code |= (int(allele)+1) << shift
+  if m.group(2) == '|':
+    code |= 1 << 14
+  return code
+
+
+@functools.lru_cache(maxsize=4096)
+def gt_text(code):
+  '''unpack a GT code'''
+  a = code & 127
+  b = (code >> 7) & 127
+  gt = '.' if a == 0 else str(a-1)
+  if b != 127:
+    gt += ('|' if code & (1 << 14) else '/') + ('.' if b == 0 else str(b-1))
+  return gt
+
+
+def little_endian(values):
+  '''the bytes of an array in little-endian order'''
+  if sys.byteorder == 'big':
+    values.byteswap()
+  return values.tobytes()
+
+
+def pack_offsets(pieces):
+  '''join the packed values of the samples behind the offsets of each one and of their end'''
+  offsets = array.array('I')
+  pos = 4*(len(pieces)+1)
+  for piece in pieces:
+    offsets.append(pos)
+    pos += len(piece)
+  offsets.append(pos)
+  return little_endian(offsets) + b''.join(pieces)
+
+
+def pack_column(field, values):
+  '''pack the values of a FORMAT field over the samples, None for absent samples, return its type and bytes'''
+  given = [v for v in values if v is not None]
+  if field == 'GT':
+    codes = [GT_ABSENT if v is None else gt_code(v) for v in values]
+    if None not in codes:
+      return 'H', little_endian(array.array('H', codes))
+  if all(v == '.' or INT_PATTERN.match(v) for v in given):
+    return 'i', little_endian(array.array('i', [INT_MISSING if v is None or v == '.' else int(v) for v in values]))
+  if all(v == '.' or (FLOAT_PATTERN.match(v) and repr(float(v)) == v) for v in given):
+    return 'd', little_endian(array.array('d', [float('nan') if v is None or v == '.' else float(v) for v in values]))
+  lists = [[] if v is None else v.split(',') for v in values]
+  if all(x == '.' or INT_PATTERN.match(x) for v in lists for x in v):
+    return 'l', pack_offsets([little_endian(array.array('i', [INT_MISSING if x == '.' else int(x) for x in v])) for v in lists])
+  return 't', pack_offsets([b'' if v is None else v.encode('utf-8') for v in values])
+
+
+def vcf_genotypes(aux, n):
+  '''pack the n samples of a vcf record into (format, present, layout, data)'''
+  if len(aux) < 9:
+    return None
+  fmt = aux[8].split(":")
+  present = bytearray((n+7)//8)
+  columns = [[] for f in fmt]
+  for i in range(n):
+    attr = aux[i+9].split(":") if i+9 < len(aux) else []
+    if len(attr) == len(fmt):
+      present[i >> 3] |= 1 << (i & 7)
+    else:
+      attr = [None]*len(fmt)
+    for j in range(len(fmt)):
+      columns[j].append(attr[j])
+  layout = []
+  data = bytearray()
+  for j in range(len(fmt)):
+    typ, packed = pack_column(fmt[j], columns[j])
+    layout.append([fmt[j], typ, len(data), len(packed)])
+    data += packed
+  return aux[8], bytes(present), json.dumps(layout, separators=(',',':')), bytes(data)
+
+
+def genotype_values(present, layout, data, i):
+  '''decode the FORMAT values of the i-th sample, None if the sample has no data. Integer lists are decoded as lists, with None for their missing values'''
+  if not (present[i >> 3] >> (i & 7)) & 1:
+    return None
+  values = []
+  for field, typ, offset, size in layout:
+    if typ in ('l','t'):
+      start, end = struct.unpack_from('<2I', data, offset+4*i)
+      if typ == 't':
+        values.append((field, data[offset+start:offset+end].decode('utf-8')))
+        continue
+      value = [None if x == INT_MISSING else x for x in struct.unpack_from('<%di' % ((end-start)//4), data, offset+start)]
+      values.append((field, None if value == [None] else value))
+      continue
+    value = struct.unpack_from('<'+typ, data, offset+i*struct.calcsize(typ))[0]
+    if typ == 'H':
+      value = gt_text(value)
+    elif typ == 'i':
+      value = None if value == INT_MISSING else value
+    elif value != value:
+      value = None
+    values.append((field, value))
+  return values
+
+
+def genotype_string(value):
+  '''format a decoded FORMAT value like in a vcf sample'''
+  if value is None:
+    return '.'
+  if isinstance(value,str):
+    return value
+  if isinstance(value,list):
+    return ','.join(map(genotype_string, value))
+  return repr(value)
+
+
+def genotype_text(values):
+  '''join decoded FORMAT values like a vcf sample'''
+  return '|'.join(map(lambda x: x[0]+'='+genotype_string(x[1]), values))
+
+
+def region_filter(chr, start, end):
+  '''SQL condition and parameters selecting the tbl_segments rows overlapping a region through the bin index'''
+  params = []
+  sub = []
+  for r in bin_ranges(start, end):
+    sub.append("SELECT rowid FROM tbl_segments WHERE chr=? AND bin BETWEEN ? AND ?")
+    params.extend((chr,r[0],r[1]))
+  if len(sub) == 0:
+    return "0", []
+  params.extend((end,start))
+  return "tbl_segments.rowid IN (%s) AND start<? AND end>?" % " UNION ALL ".join(sub), params
+
+
+@functools.lru_cache(maxsize=64)
+def external_index(path, mtime):
+  '''read and cache the tabix index of an external track'''
+  return read_index(path)
+
+
+def external_rows(trackname, path, fmt, meta, chrom, start, end):
+  '''read the features of an external track overlapping a region, as rows of genomebrowser.query'''
+  rows = []
+  lines = read_region(path, chrom, start, end, external_index(path, os.path.getmtime(path)))
+  if fmt == 'bed':
+    numeric = meta['type'] in ['value', 'score']
+    for line in lines:
+      row = bed_row(line.split("\t"), trackname, numeric)
+      if row[2] < end and row[3] > start:
+        rows.append(tuple(row))
+  elif fmt == 'vcf':
+    for line in lines:
+      aux = line.split("\t")
+      pos = int(aux[1])
+      if pos-1 >= end or pos <= start:
+        continue
+      ID = aux[2] if aux[2]!='.' else None
+      if meta.get('sample') is None:
+        score = vcf_info(vcf_fields(aux, meta['csq']))
+      else:
+        score = vcf_sample(aux, meta['sample'])
+        if score is None:
+          continue
+      rows.append((trackname,aux[0],pos-1,pos,ID,score,None,None,None,None,None,None,None))
+  return rows
+
+
+# bin sizes of the summary levels stored in tbl_zoom for 'value' and 'score' tracks
+ZOOM_LEVELS = (1000, 4000, 16000, 64000, 256000, 1024000, 4096000)
+
+
+def build_zoom(c, trackid, first = 0):
+  '''summarize a value track into count/sum/min/max per bin at each zoom level'''
+  size = ZOOM_LEVELS[0]
+  c.execute("INSERT INTO tbl_zoom SELECT trackid, 0, chr, (start/?)*?, (start/?)*?+?, count(*), sum(cast(score as REAL)), min(cast(score as REAL)), max(cast(score as REAL)) FROM tbl_segments WHERE rowid>? AND trackid=? AND score IS NOT NULL GROUP BY chr, start/?",(size,size,size,size,size,first,trackid,size))
+  for level in range(1,len(ZOOM_LEVELS)):
+    size = ZOOM_LEVELS[level]
+    c.execute("INSERT INTO tbl_zoom SELECT trackid, ?, chr, (start/?)*?, (start/?)*?+?, sum(count), sum(sum), min(min), max(max) FROM tbl_zoom WHERE trackid=? AND level=? GROUP BY chr, start/?",(level,size,size,size,size,size,trackid,level-1,size))
 
 
 def add2DB(db, track, trackname, tracktype, color, scale):
@@ -193,38 +1000,124 @@ def add2DB(db, track, trackname, tracktype, color, scale):
   except:
     scale = json.dumps([])
 
-  c = db.cursor()
-  c.execute('INSERT INTO tbl_tracks VALUES (NULL,?,?,?,?)',(trackname,tracktype,color,scale))
-  trackid = c.lastrowid
+  with bulk_load(db):
+    c = db.cursor()
+    c.execute('INSERT INTO tbl_tracks VALUES (NULL,?,?,?,?)',(trackname,tracktype,color,scale))
+    trackid = c.lastrowid
+    first = c.execute('SELECT coalesce(max(rowid),0) FROM tbl_segments').fetchone()[0]
 
-  con = open_file(track)
-  for line in con:
-    try: line = line.decode('utf-8')
-    except: pass
-    line = line.rstrip().split("\t")
-    row = [trackid]
-    for i in range(12):
-      val = None
-      if i < len(line):
-        if i in [1,2,6,7,9]:
-          val = int(line[i])
-        elif i == 4 and tracktype in ['value', 'score']:
-          val = float(line[i])
-        elif i == 5:
-          if line[i] in ['+','-']:
-            val = line[i]
-        else:
-          val = line[i]
-      row.append(val)
-    c.execute('INSERT INTO tbl_segments VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)',row)
+    t0 = time.time()
+    con = open_file(track)
+    n = insert_segments(c, bed_rows(con, trackid, tracktype))
+    con.close()
+    elapsed = time.time() - t0
+    print("Loaded %d rows from '%s' in %.2f s (%d rows/s)." % (n, trackname, elapsed, n/elapsed if elapsed > 0 else n))
 
-  if tracktype in ['value', 'score'] and scale == '[]':
-    c.execute("UPDATE tbl_tracks SET data=(SELECT '[' || min(cast(score as REAL)) || ',' || max(cast(score as REAL)) || ']' FROM tbl_segments WHERE trackid=?) WHERE trackid=?",(trackid,trackid))
+    if tracktype in ['value', 'score']:
+      build_zoom(c, trackid, first)
+      if scale == '[]':
+        c.execute("UPDATE tbl_tracks SET data=(SELECT '[' || min(min) || ',' || max(max) || ']' FROM tbl_zoom WHERE trackid=? AND level=?) WHERE trackid=?",(trackid,len(ZOOM_LEVELS)-1,trackid))
 
-  if tracktype in ['gene','exons']:
-    aux_genes(c)
 
-  db.commit()
+def merge_tracks(db, directory):
+  '''copy every track stored in the database of another directory into an open database'''
+  with bulk_load(db):
+    db.execute('ATTACH DATABASE ? AS part', (os.path.join(directory, "Tracks.db"),))
+    try:
+      offset = db.execute('SELECT coalesce(max(trackid),0) FROM main.tbl_tracks').fetchone()[0]
+      rowids = db.execute('SELECT coalesce(max(rowid),0) FROM main.tbl_segments').fetchone()[0]
+      db.execute('INSERT INTO main.tbl_tracks (trackid,trackname,type,color,data) SELECT trackid+?,trackname,type,color,data FROM part.tbl_tracks ORDER BY trackid', (offset,))
+      columns = ','.join(SEGMENT_COLUMNS[1:]+('bin',))
+      db.execute('INSERT INTO main.tbl_segments (rowid,trackid,%s) SELECT rowid+?,trackid+?,%s FROM part.tbl_segments ORDER BY rowid' % (columns,columns), (rowids,offset))
+      db.execute('INSERT INTO main.tbl_genotypes (segid,format,present,layout,data) SELECT segid+?,format,present,layout,data FROM part.tbl_genotypes', (rowids,))
+      db.execute('INSERT INTO main.tbl_attributes (segid,key,value,number) SELECT segid+?,key,value,number FROM part.tbl_attributes', (rowids,))
+      db.execute('INSERT INTO main.tbl_samples (trackid,master,sample) SELECT trackid+?,master+?,sample FROM part.tbl_samples', (offset,offset))
+      db.execute('INSERT INTO main.tbl_zoom (trackid,level,chr,start,end,count,sum,min,max) SELECT trackid+?,level,chr,start,end,count,sum,min,max FROM part.tbl_zoom', (offset,))
+      db.execute('INSERT INTO main.tbl_external (trackid,path,format,meta) SELECT trackid+?,path,format,meta FROM part.tbl_external', (offset,))
+      db.commit()
+    finally:
+      db.execute('DETACH DATABASE part')
+
+
+def delete_tracks(c, trackids):
+  '''delete tracks and everything stored for them, with one statement per table that the trackid indexes resolve without a scan'''
+  if len(trackids) == 0:
+    return
+  ids = '(%s)' % ','.join('?'*len(trackids))
+  trackids = list(trackids)
+  c.execute('DELETE FROM tbl_genotypes WHERE segid IN (SELECT rowid FROM tbl_segments WHERE trackid IN %s)' % ids, trackids)
+  c.execute('DELETE FROM tbl_attributes WHERE segid IN (SELECT rowid FROM tbl_segments WHERE trackid IN %s)' % ids, trackids)
+  c.execute('DELETE FROM tbl_samples WHERE trackid IN %s OR master IN %s' % (ids,ids), trackids+trackids)
+  c.execute('DELETE FROM tbl_segments WHERE trackid IN %s' % ids, trackids)
+  c.execute('DELETE FROM tbl_zoom WHERE trackid IN %s' % ids, trackids)
+  c.execute('DELETE FROM tbl_external WHERE trackid IN %s' % ids, trackids)
+  c.execute('DELETE FROM tbl_tracks WHERE trackid IN %s' % ids, trackids)
+  # the trackid of the last track is given again to the next one, so its genes can't wait for aux_genes to notice it is gone
+  if 'trackid' in [row[1] for row in c.execute("PRAGMA table_info(aux_genes)")]:
+    c.execute('DELETE FROM aux_genes WHERE trackid IN %s' % ids, trackids)
+
+
+def file_hash(filename):
+  '''sha1 of the content of a file'''
+  digest = hashlib.sha1()
+  con = open(filename,'rb')
+  for block in iter(lambda: con.read(BUFFER_SIZE), b''):
+    digest.update(block)
+  con.close()
+  return digest.hexdigest()
+
+
+def input_arguments(method, args, kwargs):
+  '''name every argument of a call to a loading method, defaults included'''
+  call = inspect.signature(method).bind(None, *args, **kwargs)
+  call.apply_defaults()
+  arguments = dict(call.arguments)
+  del arguments[next(iter(arguments))]
+  return arguments
+
+
+def incremental(method):
+  '''make a loading method skip inputs already loaded unchanged in incremental builds'''
+  @functools.wraps(method)
+  def load(self, *args, **kwargs):
+    pending = self.__manifest__(method.__name__, input_arguments(method, args, kwargs))
+    if pending is None:
+      return
+    result = method(self, *args, **kwargs)
+    self.__manifested__(pending)
+    return result
+  return load
+
+
+def shard_name(chrom):
+  '''name the shards of a chromosome after it. Names that are not safe file names, or that would be taken for the base shard, get a short hash of the chromosome after their sanitized form, so two chromosomes never share a file'''
+  name = re.sub('[^A-Za-z0-9_.-]','_',chrom)
+  if name != chrom or name == 'base':
+    name += '-' + hashlib.sha1(chrom.encode('utf-8')).hexdigest()[:8]
+  return name
+
+
+def ingest_track(method, kwargs):
+  '''load a track into a new temporary database, return its directory'''
+  directory = tempfile.mkdtemp()
+  try:
+    createDB(directory)
+    gb = genomebrowser.fromDirectory(directory)
+    # an open batch leaves the indexes and the gene table to the database the track is merged into
+    gb.__batch__ = 1
+    getattr(gb, method)(**kwargs)
+  except:
+    shutil.rmtree(directory, ignore_errors=True)
+    raise
+  return directory
+
+
+def external_track(path):
+  '''check that a file can be used as an external track'''
+  if is_bgzf(path) and read_index(path) is not None:
+    return True
+  print("'%s' must be compressed with bgzip and indexed with tabix (.tbi or .csi) to be added as an external track." % path)
+  return False
 
 
 def insert_track(c,uniq,track):
@@ -238,38 +1131,182 @@ def insert_track(c,uniq,track):
 
 class genomebrowser:
 
-  def __init__(self, assembly, mapTrack = None, server = False, directory = 'GenomeBrowser'):
+  def __init__(self, assembly, mapTrack = None, server = False, directory = 'GenomeBrowser', incremental = False, mapFormat = 'json', assets = None):
     '''Generates an interactive genome browser.
   
     Arguments:
-      assembly -- a genome assembly, D3GB provides human assemblies ('NCBI36', 'GRCh37', 'GRCh38'), human assemblies with cytobands ('GRCh37.bands', 'GRCh38.bands'), or it can be an iterate of fasta file(s) paths or a single bed file path.
+      assembly -- a genome assembly, D3GB provides human assemblies ('NCBI36', 'GRCh37', 'GRCh38'), human assemblies with cytobands ('GRCh37.bands', 'GRCh38.bands'), or it can be an iterate of fasta file(s) paths or a single bed file path. The lengths of fasta files are kept in a private .gb.lengths file next to them, so later runs do not read them again.
       mapTrack -- a bed file path with values to represent on the genome map. (default None)
       server -- a logical value to enable or disable the server mode. Server mode: designed to be shared as a website. Resulting folder should be added to the Apache applications directory and enable writting permissions. In this way the genome browser will be working as a web site. Local mode: the genome browser will be functional on your local machine. (default False)
       directory -- a string representing the directory where the graph will be saved. (default "GenomeBrowser")
+      incremental -- a logical value to keep the database and the assets of an existing genome browser in directory. Files loaded again with addTrack, addTracks, addGFF or addVCF and the same arguments are skipped when their content did not change, and replace the tracks they loaded before when it did. Changing the assembly empties the database. (default False)
+      mapFormat -- a string with the format of the genome map data: "json" embeds it in index.html, "binary", "gzip" or "brotli" write it as typed arrays in a file next to index.html, uncompressed or compressed. (default "json")
+      assets -- a string with a shared directory where the scripts and styles are kept once per version, to be hard linked (or symlinked across file systems) instead of copied into every output directory. (default None)
     '''
     self.__directory__ = directory
+    self.__batch__ = 0
+    self.__auxgenes__ = False
+    self.__fasta__ = []
+    self.__pool__ = None
+    self.__incremental__ = incremental
     assembly = get_assembly(assembly)
     if assembly is not None:
-      data = genomemapJSON(mapTrack, assembly)
-      chromosomes = chromosomesJSON(assembly)
+      data, filename, payload = genomemap_output(mapTrack, assembly, mapFormat)
+      chromosomes = assembly.json
+      clean = not (incremental and os.path.isfile(os.path.join(directory,'Tracks.db')))
       if server:
-        createHTML(directory, ["d3.min.js","jspdf.min.js","functions.js","images.js","genomebrowser.js","genomemap.js"], data, chromosomes)
+        createHTML(directory, ["d3.min.js","jspdf.min.js","functions.js","images.js","genomebrowser.js","genomemap.js"], data, chromosomes, clean, assets)
         shutil.copy(os.path.join(os.path.dirname(__file__),'www','query.php'), directory)
       else:
-        createHTML(directory, ["d3.min.js","jspdf.min.js","sql.js","functions.js","images.js","query.js","genomebrowser.js","genomemap.js"], data, chromosomes)
+        createHTML(directory, ["d3.min.js","jspdf.min.js","sql.js","functions.js","images.js","query.js","genomebrowser.js","genomemap.js"], data, chromosomes, clean, assets)
         print('Open the "index.html" file with Mozilla Firefox to see the graph. If you want to see this local file with other web browser, please visit the help section on the D3gb Web site http://d3gb.usal.es/')
+      write_map(directory, filename, payload)
       createDB(directory)
+      db = openDB(directory)
+      key = json.dumps(['assembly'])
+      digest = hashlib.sha1(chromosomes.encode('utf-8')).hexdigest()
+      row = db.execute('SELECT hash FROM tbl_manifest WHERE input=?',(key,)).fetchone()
+      if row is not None and row[0] != digest:
+        db.close()
+        os.remove(os.path.join(directory,'Tracks.db'))
+        createDB(directory)
+        db = openDB(directory)
+      db.execute('INSERT OR REPLACE INTO tbl_manifest VALUES (?,NULL,NULL,?,NULL,?)',(key,digest,'[]'))
+      db.commit()
+      db.close()
     else:
       self.__directory__ = None
       print('Invalid assembly.')
 
 
+  @classmethod
+  def fromDirectory(cls, directory, incremental = False, pool = None):
+    '''Open a genome browser already generated in a directory, to add tracks to it or query it without writing its files again.
+
+    Arguments:
+      directory -- a string giving the directory of the genome browser.
+      incremental -- a logical value to skip the files loaded again unchanged, as in the constructor. (default False)
+      pool -- a pool of database connections, with get and put methods, the queries borrow their connections from. By default, each query opens its own connection. (default None)
+    '''
+    gb = cls.__new__(cls)
+    gb.__directory__ = directory
+    gb.__batch__ = 0
+    gb.__auxgenes__ = False
+    gb.__fasta__ = []
+    gb.__pool__ = pool
+    gb.__incremental__ = incremental
+    if not os.path.isfile(os.path.join(directory,'Tracks.db')):
+      gb.__directory__ = None
+      print("'%s' is not a genome browser directory." % directory)
+    return gb
+
+
   def remove(self):
     '''Remove this genome browser'''
     shutil.rmtree(self.__directory__)
 
 
-  def addTrack(self, track, trackname = None, tracktype = "gene", color = "#000", scale = None):
+  @contextlib.contextmanager
+  def __connection__(self):
+    '''a connection to read the database, borrowed from the pool of a query server if there is one'''
+    pool = getattr(self, '__pool__', None)
+    db = openDB(self.__directory__) if pool is None else pool.get()
+    try:
+      yield db
+    finally:
+      if pool is None:
+        db.close()
+      else:
+        pool.put(db)
+
+
+  @contextlib.contextmanager
+  def batch(self):
+    '''Load several tracks at once, building the indexes and the gene table only once at the end.
+    The indexes are dropped for the batch only when the database has no features yet; a batch added to a loaded database keeps them, as rebuilding them would cost more than updating them.
+
+    Usage:
+      with gb.batch():
+        gb.addTrack("genes.bed")
+        gb.addGFF("annotation.gff3")
+    '''
+    if self.__batch__ == 0:
+      db = openDB(self.__directory__)
+      c = db.cursor()
+      if c.execute("SELECT 1 FROM tbl_segments LIMIT 1").fetchone() is None:
+        drop_indexes(c)
+      db.commit()
+      db.close()
+    self.__batch__ += 1
+    try:
+      yield self
+    finally:
+      self.__batch__ -= 1
+      if self.__batch__ == 0:
+        db = openDB(self.__directory__)
+        self.__finish__(db.cursor())
+        db.commit()
+        db.close()
+
+
+  def __finish__(self, c, genes = False):
+    '''build indexes and the gene table after a load, unless a batch is open'''
+    self.__auxgenes__ = self.__auxgenes__ or genes
+    if self.__batch__ == 0:
+      create_indexes(c)
+      if self.__auxgenes__:
+        aux_genes(c)
+        self.__auxgenes__ = False
+
+
+  def __manifest__(self, method, arguments):
+    '''look an input up in the manifest before loading it. Return None to skip an input loaded unchanged with the same arguments in an incremental build, otherwise remove the tracks it loaded before and return the entry to record once it is loaded'''
+    path = next(iter(arguments.values()))
+    if self.__directory__ is None or not isinstance(path,str) or not os.path.isfile(path):
+      return {}
+    stat = os.stat(path)
+    arguments = dict(arguments)
+    del arguments[next(iter(arguments))]
+    pending = {'path': path, 'input': json.dumps([method, os.path.abspath(path), arguments.get('trackname')]), 'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': None, 'params': json.dumps(arguments, sort_keys=True, default=str)}
+    db = openDB(self.__directory__)
+    c = db.cursor()
+    row = c.execute('SELECT size,mtime,hash,params,tracks FROM tbl_manifest WHERE input=?',(pending['input'],)).fetchone()
+    if self.__incremental__ and row is not None:
+      tracks = json.loads(row[4])
+      loaded = c.execute('SELECT count(*) FROM tbl_tracks WHERE trackid IN (%s)' % ','.join('?'*len(tracks)),tracks).fetchone()[0] == len(tracks)
+      if loaded and row[3] == pending['params']:
+        touched = (row[0],row[1]) != (pending['size'],pending['mtime'])
+        if touched:
+          pending['hash'] = file_hash(path)
+        if not touched or pending['hash'] == row[2]:
+          c.execute('UPDATE tbl_manifest SET size=?,mtime=? WHERE input=?',(pending['size'],pending['mtime'],pending['input']))
+          db.commit()
+          db.close()
+          return None
+      delete_tracks(c, tracks)
+      self.__auxgenes__ = True
+      db.commit()
+    pending['last'] = c.execute('SELECT coalesce(max(trackid),0) FROM tbl_tracks').fetchone()[0]
+    db.close()
+    return pending
+
+
+  def __manifested__(self, pending):
+    '''record in the manifest an input and the tracks it loaded'''
+    if 'input' not in pending:
+      return
+    if self.__incremental__ and pending['hash'] is None:
+      pending['hash'] = file_hash(pending['path'])
+    db = openDB(self.__directory__)
+    c = db.cursor()
+    tracks = [row[0] for row in c.execute('SELECT trackid FROM tbl_tracks WHERE trackid>? ORDER BY trackid',(pending['last'],)).fetchall()]
+    c.execute('INSERT OR REPLACE INTO tbl_manifest VALUES (?,?,?,?,?,?)',(pending['input'],pending['size'],pending['mtime'],pending['hash'],pending['params'],json.dumps(tracks)))
+    db.commit()
+    db.close()
+
+
+  @incremental
+  def addTrack(self, track, trackname = None, tracktype = "gene", color = "#000", scale = None, external = False):
     '''Add tracks (bed files) to genome browser.
     
     Arguments:
@@ -278,14 +1315,79 @@ class genomebrowser:
       tracktype -- a string with the type of track should be drawn. Possible types are: "gene", "exons", "domain", "value" or "score". (default "gene")
       color -- a string giving the color of the track. (default "#000")
       scale -- a list with two values which specifies the minimun and maximun limits in the representation of the "score" or "value" tracks. By default, maximun and minimun scores are taken as the limits. (default None)
+      external -- a logical value to leave the bed file on disk instead of copying it into the database. The file must be compressed with bgzip and indexed with tabix, and it is read by region when the track is queried. (default False)
     '''
     if self.__directory__ is not None:
       if not tracktype in ['gene','domain','exons','value','score']:
         tracktype = 'gene'
       if not isinstance(trackname,str):
         trackname = os.path.split(track)[-1]
+      if external:
+        if not external_track(track):
+          return
+        if tracktype not in ['value', 'score'] or scale is None or len(scale) != 2:
+          scale = []
+        db = openDB(self.__directory__)
+        c = db.cursor()
+        c.execute('INSERT INTO tbl_tracks VALUES (NULL,?,?,?,?)',(trackname,tracktype,color,json.dumps(scale)))
+        c.execute('INSERT INTO tbl_external VALUES (?,?,?,?)',(c.lastrowid,os.path.abspath(track),'bed',json.dumps({'type': tracktype})))
+        db.commit()
+        db.close()
+        return
       db = openDB(self.__directory__)
       add2DB(db, track, trackname, tracktype, color, scale)
+      self.__finish__(db.cursor(), tracktype in ['gene','exons'])
+      db.commit()
+      db.close()
+
+
+  def addTracks(self, tracks, workers = None):
+    '''Add several tracks to genome browser, parsing the files in parallel.
+
+    Arguments:
+      tracks -- an iterable of tracks. Each track is a bed file path or a dictionary with the arguments of addTrack ("track", "trackname", ...), addGFF ("gfffile") or addVCF ("vcffile", "trackname", "show").
+      workers -- an integer giving the number of processes used to parse the files. By default, one per CPU. (default None)
+    '''
+    if self.__directory__ is None:
+      return
+    jobs = []
+    for track in tracks:
+      if isinstance(track,str):
+        track = {'track': track}
+      if 'gfffile' in track:
+        jobs.append(('addGFF', track))
+      elif 'vcffile' in track:
+        jobs.append(('addVCF', track))
+      else:
+        jobs.append(('addTrack', track))
+    with self.batch():
+      if workers == 1:
+        for job in jobs:
+          getattr(self, job[0])(**job[1])
+        return
+      pending = []
+      for job in jobs:
+        entry = self.__manifest__(job[0], input_arguments(getattr(genomebrowser, job[0]), (), job[1]))
+        if entry is not None:
+          pending.append((job, entry))
+      db = openDB(self.__directory__)
+      parts = []
+      try:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+          parts = [pool.submit(ingest_track, job[0], job[1]) for job, entry in pending]
+          for i, part in enumerate(parts):
+            directory = part.result()
+            entry = pending[i][1]
+            entry['last'] = db.execute('SELECT coalesce(max(trackid),0) FROM tbl_tracks').fetchone()[0]
+            merge_tracks(db, directory)
+            self.__manifested__(entry)
+            shutil.rmtree(directory)
+      finally:
+        # after a failed job or merge, the pool has waited for the other workers: remove the databases they left
+        for part in parts:
+          if part.done() and not part.cancelled() and part.exception() is None:
+            shutil.rmtree(part.result(), ignore_errors=True)
+      self.__finish__(db.cursor(), True)
       db.close()
 
 
@@ -296,53 +1398,294 @@ class genomebrowser:
       trackname -- a string giving the name of the track to remove.
     '''
     db = openDB(self.__directory__)
+    with bulk_load(db, DELETE_PRAGMAS):
+      c = db.cursor()
+      delete_tracks(c, [row[0] for row in c.execute('SELECT trackid FROM tbl_tracks WHERE trackname=?',(trackname,)).fetchall()])
+      self.__finish__(c, True)
+    db.close()
+
+
+  def query(self, chr, start, end, tracks = None, filters = None):
+    '''Get the features overlapping a genomic region.
+
+    Arguments:
+      chr -- a string giving the chromosome.
+      start -- an integer giving the 0-based start of the region.
+      end -- an integer giving the end of the region.
+      tracks -- an iterable of track names to look up. By default, all tracks are searched. (default None)
+      filters -- an iterable of (key, operator, value) tuples the attributes of the features must pass, as ("QUAL", ">", 30) or ("product", "contains", "kinase"). Operators are "=", "!=", "<", "<=", ">", ">=" and "contains". Attributes are read from gff, vcf and GenBank features stored in the database, so external tracks and vcf samples are left out when filtering. (default None)
+
+    Returns a list of (trackname, chr, start, end, name, score, strand, thickStart, thickEnd, itemRGB, blockCount, blockSizes, blockStarts) tuples sorted by start.
+    '''
+    where, params = region_filter(chr, start, end)
+    if len(params) == 0:
+      return []
+    sql = "SELECT trackname, chr, start, end, name, score, strand, thickStart, thickEnd, itemRGB, blockCount, blockSizes, blockStarts FROM tbl_segments NATURAL JOIN tbl_tracks WHERE " + where
+    if filters:
+      condition, values = attribute_filter(filters)
+      sql += " AND " + condition
+      params.extend(values)
+    if tracks is not None:
+      if isinstance(tracks,str):
+        tracks = (tracks,)
+      tracks = list(tracks)
+      names = " WHERE trackname IN (%s)" % ','.join('?'*len(tracks))
+      sql += " AND trackname IN (%s)" % ','.join('?'*len(tracks))
+      params.extend(tracks)
+    else:
+      names = ""
+    sql += " ORDER BY start, end"
+    with self.__connection__() as db:
+      if filters:
+        return db.execute(sql, params).fetchall()
+      rows, external, masters = self.__query__(db, sql, params, names, tracks, chr, start, end)
+    for track in external:
+      rows.extend(external_rows(track[0], track[1], track[2], json.loads(track[3]), chr, start, end))
+    if len(external) or len(masters):
+      rows.sort(key=lambda x: (x[2], x[3]))
+    return rows
+
+
+  def __query__(self, db, sql, params, names, tracks, chr, start, end):
+    '''run the queries of query on a connection'''
+    rows = db.execute(sql, params).fetchall()
+    external = db.execute("SELECT trackname, path, format, meta FROM tbl_external NATURAL JOIN tbl_tracks" + names, tracks or []).fetchall()
+    samples = db.execute("SELECT trackname, master, sample FROM tbl_samples NATURAL JOIN tbl_tracks" + names + " ORDER BY trackid", tracks or []).fetchall()
+    masters = dict()
+    for sample in samples:
+      masters.setdefault(sample[1], []).append(sample)
+    for master in masters:
+      where, params = region_filter(chr, start, end)
+      for variant in db.execute("SELECT chr, start, end, name, present, layout, data FROM tbl_segments JOIN tbl_genotypes ON segid=tbl_segments.rowid WHERE trackid=? AND " + where, [master] + params):
+        layout = json.loads(variant[5])
+        for sample in masters[master]:
+          values = genotype_values(variant[4], layout, variant[6], sample[2]-1)
+          if values is not None:
+            rows.append((sample[0],variant[0],variant[1],variant[2],variant[3],genotype_text(values),None,None,None,None,None,None,None))
+    return rows, external, masters
+
+
+  def getGenotypes(self, chr, start, end, track, samples = None):
+    '''Get the sample genotypes of a vcf track in a genomic region, decoding only the requested samples.
+
+    Arguments:
+      chr -- a string giving the chromosome.
+      start -- an integer giving the 0-based start of the region.
+      end -- an integer giving the end of the region.
+      track -- a string giving the name of the vcf track.
+      samples -- an iterable of sample names to decode. By default, all samples. (default None)
+
+    Returns a list of (chr, start, end, name, genotypes) tuples sorted by start, where genotypes maps each sample name to a dictionary of its FORMAT values (None for missing values, lists for comma-separated integers such as AD or PL), or to None if the sample has no data for the variant.
+    '''
+    if isinstance(samples,str):
+      samples = (samples,)
+    with self.__connection__() as db:
+      return self.__genotypes__(db, chr, start, end, track, samples)
+
+
+  def __genotypes__(self, db, chr, start, end, track, samples):
+    '''run the queries of getGenotypes on a connection'''
+    rows = []
+    for master in db.execute("SELECT trackid FROM tbl_tracks WHERE trackname=? AND type='vcf'", (track,)).fetchall():
+      names = db.execute("SELECT trackname, sample FROM tbl_samples NATURAL JOIN tbl_tracks WHERE master=? ORDER BY trackid", master).fetchall()
+      if samples is not None:
+        names = [x for x in names if x[0] in samples]
+      where, params = region_filter(chr, start, end)
+      for variant in db.execute("SELECT chr, start, end, name, present, layout, data FROM tbl_segments JOIN tbl_genotypes ON segid=tbl_segments.rowid WHERE trackid=? AND " + where + " ORDER BY start, end", list(master) + params):
+        layout = json.loads(variant[5])
+        genotypes = dict()
+        for name in names:
+          values = genotype_values(variant[4], layout, variant[6], name[1]-1)
+          genotypes[name[0]] = None if values is None else dict(values)
+        rows.append(variant[:4] + (genotypes,))
+    return rows
+
+
+  def querySummary(self, chr, start, end, tracks = None, bins = 1000):
+    '''Get a summary of the "value" and "score" tracks in a genomic region.
+
+    The coarsest precomputed zoom level giving at least "bins" values across the region is used. Regions too small for any zoom level are summarized from the stored features.
+
+    Arguments:
+      chr -- a string giving the chromosome.
+      start -- an integer giving the 0-based start of the region.
+      end -- an integer giving the end of the region.
+      tracks -- an iterable of track names to summarize. By default, all "value" and "score" tracks are summarized. (default None)
+      bins -- an integer giving the minimum number of values wanted across the region. (default 1000)
+
+    Returns a list of (trackname, chr, start, end, count, sum, min, max) tuples sorted by start.
+    '''
+    level = None
+    for i in range(len(ZOOM_LEVELS)):
+      if ZOOM_LEVELS[i]*bins <= end-start:
+        level = i
+    if isinstance(tracks,str):
+      tracks = (tracks,)
+    if level is None:
+      rows = []
+      # only the value and score tracks are read, so no genotypes or tabix files are decoded for nothing
+      with self.__connection__() as db:
+        names = [row[0] for row in db.execute("SELECT trackname FROM tbl_tracks WHERE type IN ('value','score')")]
+      if tracks is not None:
+        tracks = set(tracks)
+        names = [name for name in names if name in tracks]
+      if not names:
+        return rows
+      for row in self.query(chr, start, end, names):
+        if row[5] is not None:
+          value = float(row[5])
+          rows.append((row[0],row[1],row[2],row[3],1,value,value,value))
+      return rows
+    # tracks first, so each one is looked up in the zoom index by (trackid,level,chr,start);
+    # bins are ZOOM_LEVELS[level] long, so those ending after start also begin after start minus that length
+    sql = "SELECT trackname, chr, start, end, count, sum, min, max FROM tbl_tracks CROSS JOIN tbl_zoom USING (trackid) WHERE type IN ('value','score') AND level=? AND chr=? AND start>? AND start<? AND end>?"
+    params = [level,chr,start-ZOOM_LEVELS[level],end,start]
+    if tracks is not None:
+      tracks = list(tracks)
+      sql += " AND trackname IN (%s)" % ','.join('?'*len(tracks))
+      params.extend(tracks)
+    sql += " ORDER BY start"
+    with self.__connection__() as db:
+      return db.execute(sql, params).fetchall()
+
+
+  def searchGenes(self, term, limit = 10):
+    '''Search the gene and exons tracks for features whose name, or a word of their name or attributes, starts with a term.
+
+    Names starting with the term come first, in alphabetical order, then names with a word starting with it, ranked by relevance, then features with the term in their attributes. Words are only searched when sqlite has FTS5.
+
+    Arguments:
+      term -- a string giving the start of the name or word searched, case insensitive.
+      limit -- an integer giving the maximum number of features returned. (default 10)
+
+    Returns a list of (chr, start, end, name, score) tuples, best matches first.
+    '''
+    with self.__connection__() as db:
+      tables = [row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE name IN ('aux_genes','aux_genes_fts')")]
+      if 'aux_genes' not in tables:
+        return []
+      pattern = re.sub(r'([\\%_])', r'\\\1', term) + '%'
+      rows = db.execute("SELECT id, chr, start, end, name, score FROM aux_genes WHERE name LIKE ? ESCAPE '\\' ORDER BY name LIMIT ?",(pattern,limit)).fetchall()
+      if 'aux_genes_fts' in tables:
+        phrase = '"%s"*' % term.replace('"','""')
+        # attribute matches are not ranked: a common word can match every feature
+        for query, rank in (('{name}: ' + phrase, 'rank FROM aux_genes_fts WHERE aux_genes_fts MATCH ? ORDER BY rank'), ('{score}: ' + phrase, '0 AS rank FROM aux_genes_fts WHERE aux_genes_fts MATCH ?')):
+          if len(rows) >= limit:
+            break
+          found = set(row[0] for row in rows)
+          rows.extend(row for row in db.execute("SELECT id, chr, start, end, aux_genes.name, aux_genes.score FROM (SELECT rowid, %s LIMIT ?) JOIN aux_genes ON id=rowid ORDER BY rank" % rank,(query,limit+len(found))) if row[0] not in found)
+      return [row[1:] for row in rows[:limit]]
+
+
+  def exportShards(self, size = None):
+    '''Split the database into small SQLite files for the local mode, so only the ones overlapping the view have to be loaded.
+
+    The "shards" folder of the genome browser gets a "base.db" file with the tracks, samples, external tracks and gene table, one file per chromosome or region with its features, genotypes and zoom levels, and a "manifest.json" file listing them. Features and zoom rows belong to the shard holding their start, and "maxEnd" gives the largest end of a shard, so a view overlaps a shard when it starts before "maxEnd" and ends after "start".
+
+    Arguments:
+      size -- an integer giving the length of the regions each chromosome is split into. By default, one shard per chromosome. (default None)
+    '''
+    directory = os.path.join(self.__directory__,'shards')
+    if os.path.exists(directory):
+      shutil.rmtree(directory)
+    os.mkdir(directory)
+    db = openDB(self.__directory__)
     c = db.cursor()
-    ci = db.cursor()
-    for row in ci.execute('SELECT trackid FROM tbl_tracks WHERE trackname=?',(trackname,)):      
-      c.execute('DELETE FROM tbl_segments WHERE trackid=?',(row[0],))
-      c.execute('DELETE FROM tbl_tracks WHERE trackid=?',(row[0],))
-    aux_genes(c)
+    create_indexes(c)
     db.commit()
+    manifest = {'base': 'base.db', 'size': size, 'shards': []}
+
+    def attach(filename):
+      shard = sqlite3.connect(os.path.join(directory,filename))
+      create_tables(shard.cursor())
+      shard.commit()
+      shard.close()
+      c.execute('ATTACH DATABASE ? AS shard',(os.path.join(directory,filename),))
+
+    def detach():
+      db.commit()
+      c.execute('DETACH DATABASE shard')
+
+    attach(manifest['base'])
+    for table in ('tbl_tracks','tbl_samples','tbl_external'):
+      c.execute('INSERT INTO shard.%s SELECT * FROM main.%s' % (table,table))
+    if c.execute("SELECT count(*) FROM sqlite_master WHERE name='aux_genes'").fetchone()[0]:
+      c.execute('CREATE TABLE shard.aux_genes AS SELECT * FROM main.aux_genes')
+    detach()
+
+    columns = ','.join(SEGMENT_COLUMNS+('bin',))
+    chromosomes = [row[0] for row in c.execute('SELECT DISTINCT chr FROM tbl_segments ORDER BY chr').fetchall()]
+    for chrom in chromosomes:
+      last = c.execute('SELECT max(start) FROM tbl_segments WHERE chr=?',(chrom,)).fetchone()[0]
+      step = size or last+1
+      for start in range(0, last+1, step):
+        end = start+step
+        rows, maxEnd = c.execute('SELECT count(*), max(end) FROM tbl_segments WHERE chr=? AND start>=? AND start<?',(chrom,start,end)).fetchone()
+        # coarse zoom bins can start in a range without features
+        zooms, zoomEnd = c.execute('SELECT count(*), max(end) FROM tbl_zoom WHERE chr=? AND start>=? AND start<?',(chrom,start,end)).fetchone()
+        if rows == 0 and zooms == 0:
+          continue
+        maxEnd = max(x for x in (maxEnd,zoomEnd) if x is not None)
+        filename = shard_name(chrom) + ('.db' if size is None else '.%d.db' % (start//step))
+        attach(filename)
+        c.execute('INSERT INTO shard.tbl_segments (rowid,%s) SELECT rowid,%s FROM main.tbl_segments WHERE chr=? AND start>=? AND start<?' % (columns,columns),(chrom,start,end))
+        c.execute('INSERT INTO shard.tbl_genotypes SELECT g.* FROM main.tbl_genotypes g JOIN shard.tbl_segments s ON g.segid=s.rowid')
+        c.execute('INSERT INTO shard.tbl_attributes SELECT a.* FROM main.tbl_attributes a JOIN shard.tbl_segments s ON a.segid=s.rowid')
+        c.execute('INSERT INTO shard.tbl_zoom SELECT * FROM main.tbl_zoom WHERE chr=? AND start>=? AND start<?',(chrom,start,end))
+        c.execute('CREATE INDEX shard.location ON tbl_segments (chr,start,end)')
+        c.execute('CREATE INDEX shard.binned ON tbl_segments (chr,bin)')
+        detach()
+        manifest['shards'].append({'file': filename, 'chr': chrom, 'start': start, 'end': end if size else None, 'maxEnd': maxEnd, 'rows': rows, 'bytes': os.path.getsize(os.path.join(directory,filename))})
     db.close()
+    con = open(os.path.join(directory,'manifest.json'),'w')
+    con.write(json.dumps(manifest))
+    con.close()
+    print("The database has been split in %d shards in the '%s' folder." % (len(manifest['shards']), directory))
 
 
   def addSequence(self, fastafile):
-    '''Add sequences on Fasta format to genome browser.
+    '''Add sequences on Fasta format to genome browser. They are packed in the "sequences.2bit" file of the genome browser directory.
     
     Arguments:
       fastafile -- a string or iterable representing the input Fasta file(s) to be added in the genome browser.
     '''
-    directory = self.__directory__
-    try: os.mkdir(os.path.join(directory,'sequences'))
-    except: pass
     if isinstance(fastafile,str):
       fastafile = (fastafile,)
+    fastafile = [i for i in fastafile if fasta_key(i) not in self.__fasta__]
+    if len(fastafile) == 0:
+      return
+    store = TwoBitWriter(os.path.join(self.__directory__,SEQUENCES))
     for i in fastafile:
-      con = open_file(i)
-      seq = ''
-      for line in con:
-        try: line = line.decode('utf-8')
-        except: pass
-        line = line.rstrip()
-        if line.startswith('>'):
-          if not isinstance(seq,str):
-            seq.close()
-          chrom = re.split(' |\|',re.sub('^>','',line))[0]
-          seq = open(os.path.join(directory,'sequences',chrom+'.fa'),'w')
-          seq.write(">"+chrom+"\n")
-        else:
-          seq.write(line)
-      seq.close()
-      con.close()
+      write_lengths(i, scan_fasta(i, store))
+      self.__fasta__.append(fasta_key(i))
+    store.close()
+
+
+  def getSequence(self, chr, start, end):
+    '''Get a region of the sequences added to this genome browser, reading only the bytes it needs.
+
+    Arguments:
+      chr -- a string with the chromosome name.
+      start -- an integer with the 0-based start of the region.
+      end -- an integer with the end of the region (not included).
+    '''
+    path = os.path.join(self.__directory__,SEQUENCES)
+    if not os.path.isfile(path):
+      return None
+    return sequence_store(path, os.path.getmtime(path)).sequence(chr, start, end)
 
 
-  def addVCF(self, vcffile, trackname=None, show=None):
+  @incremental
+  def addVCF(self, vcffile, trackname=None, show=None, external=False):
     '''Add vcf tracks to genome browser.
     
     Arguments:
       vcffile -- a string representing the input vcf file to be represented in the genome browser.
       trackname -- a string giving a name for the track.
       show -- an iterable giving the info features to display. (default None)
+      external -- a logical value to leave the vcf file on disk instead of copying it into the database. The file must be compressed with bgzip and indexed with tabix, and it is read by region when the track is queried. (default False)
+
+    The genotypes of the samples are packed in one tbl_genotypes row per variant instead of one tbl_segments row per variant and sample, and are read back with query or getGenotypes. The sql.js and query.php clients, which read the sample rows from tbl_segments, have to be updated to read them.
     '''
 
     def insert_track(c,name,master=False,json=None):
@@ -350,20 +1693,23 @@ class genomebrowser:
       c.execute('INSERT INTO tbl_tracks VALUES (NULL,?,?,?,?)',(name,tracktype,None,json))
       return c.lastrowid
 
-    def insert_segment(c,trackid,chrom,pos,ID,info):
-      c.execute('INSERT INTO tbl_segments (trackid,chr,start,end,name,score) VALUES (?,?,?,?,?,?)',(trackid,chrom,pos-1,pos,ID,info))
-
-    def get_description(line):
-      desc = []
-      line = re.findall('<(.+)>',line)[0].split(',')
-      for l in line:
-        l = l.split('=')
-        if l[0] == 'ID':
-          desc.append(l[1])
-        if l[0] == 'Description':
-          desc.append(l[1].replace('"',''))
-      return desc
-
+    segments = []
+    genotypes = []
+    def flush(c):
+      insert_segments(c,segments,VCF_COLUMNS,True)
+      c.executemany('INSERT INTO tbl_genotypes VALUES (?,?,?,?,?)',genotypes)
+      del segments[:]
+      del genotypes[:]
+
+    def insert_segment(c,rowid,trackid,chrom,pos,ID,fields,samples):
+      segments.append((rowid,trackid,chrom,pos-1,pos,ID,vcf_info(fields),[field for field in fields if field[0] not in ('','.')]))
+      if samples is not None:
+        genotypes.append((rowid,)+samples)
+      if len(segments) >= BATCH_SIZE:
+        flush(c)
+
+    if external and not external_track(vcffile):
+      return
     uniq_tracks = []
     trackid = 0
     chrom = ''
@@ -377,71 +1723,53 @@ class genomebrowser:
     dataformat = {}
     db = openDB(self.__directory__)
     c = db.cursor()
+    rowid = c.execute('SELECT coalesce(max(rowid),0) FROM tbl_segments').fetchone()[0]
     con = open_file(vcffile)
     if not isinstance(trackname,str):
       trackname = os.path.split(vcffile)[-1]
 
     for line in con:
-      try: line = line.decode('utf-8')
-      except: pass
       line  = line.rstrip()
       if line.startswith("##INFO=<ID="):
-        desc = get_description(line)
+        desc = vcf_description(line)
         if desc[0] == 'CSQ':
           datacsq = re.findall('Format: (.+)$',desc[1])[0].split('|')
         else:
           data['info'][desc[0]] = desc[1]
       elif line.startswith("##FORMAT=<ID="):
-        desc = get_description(line)
+        desc = vcf_description(line)
         dataformat[desc[0]] = desc[1]
       elif line.startswith("#CHROM"):
-        data = {} if len(data['info']) is 0 else data
+        data = {} if len(data['info']) == 0 else data
         uniq_tracks.append(insert_track(c,trackname,True,json.dumps(data)))
         aux = line.split("\t")
         for i in range(9,len(aux)):
           uniq_tracks.append(insert_track(c,aux[i],False,json.dumps(dataformat)))
+          if not external:
+            c.execute('INSERT INTO tbl_samples VALUES (?,?,?)',(uniq_tracks[-1],uniq_tracks[0],i-8))
+        if external:
+          path = os.path.abspath(vcffile)
+          c.execute('INSERT INTO tbl_external VALUES (?,?,?,?)',(uniq_tracks[0],path,'vcf',json.dumps({'csq': datacsq})))
+          for i in range(1,len(uniq_tracks)):
+            c.execute('INSERT INTO tbl_external VALUES (?,?,?,?)',(uniq_tracks[i],path,'vcf',json.dumps({'sample': i})))
+          break
       elif not line.startswith("#"):
         aux = line.split("\t")
-        trackid = uniq_tracks[0]
         chrom = aux[0]
         pos = int(aux[1])
         ID = aux[2] if aux[2]!='.' else None
-        score = ["REF="+aux[3]]
-        if aux[4]!='.':
-          score.append("ALT="+aux[4]);
-        if aux[5]!='.':
-          score.append("QUAL="+aux[5]);
-        try:
-          info = aux[7].split(';')
-          for infi in info:
-            if infi.startswith("CSQ="):
-              csq = infi.replace('CSQ=','').split(',')[0].split('|')
-              for i in range(len(datacsq)):
-                if csq[i]!="":
-                  score.append(datacsq[i]+"="+csq[i])
-            else:
-              score.append(infi)
-        except:
-          pass
-        info = '|'.join(score)
-
-        insert_segment(c,trackid,chrom,pos,ID,info)
-        try: fmt = aux[8].split(":")
-        except: continue
-        for i in range(1,len(uniq_tracks)):
-          attr = aux[i+8].split(":")
-          if len(fmt) == len(attr):
-            trackid = uniq_tracks[i]
-            for j in range(len(fmt)):
-              attr[j] = fmt[j]+'='+attr[j]
-            info = '|'.join(attr)
-            insert_segment(c,trackid,chrom,pos,ID,info)
+        rowid += 1
+        samples = vcf_genotypes(aux,len(uniq_tracks)-1) if len(uniq_tracks) > 1 else None
+        insert_segment(c,rowid,uniq_tracks[0],chrom,pos,ID,vcf_fields(aux,datacsq),samples)
 
+    flush(c)
     con.close()
+    self.__finish__(c)
     db.commit()
     db.close()
 
 
+  @incremental
   def addGFF(self,gfffile):
     '''Add tracks in a gff file to  genome browser.
     
@@ -450,198 +1778,415 @@ class genomebrowser:
     '''
 
     uniq_tracks = dict()
-    trackName = ''
-    IDs = dict()
-    segments = []
-
-    scaffold = ''
-    start = 0
-    end = 0
-    name = ''
-    score = ''
-    strand = None
-    thickStart = None
-    thickEnd = None
 
     db = openDB(self.__directory__)
-    c = db.cursor()
-    con = open_file(gfffile)
-    for line in con:
-      try: line = line.decode('utf-8')
-      except: pass
-      line  = line.rstrip()
-      if line.startswith('#') or line is '':
-        continue
-      aux = line.split("\t")
-      trackName = aux[2]
-      try:
-        regex = re.compile(r"\b(\w+)\=([^\=]*)(?=;\w+\=|$)")
-        attrs =  dict(regex.findall(aux[8]))
-      except:
-        attrs = dict()
-      start = int(aux[3])-1
-      end = int(aux[4])
-      try: name = attrs.pop('Name')
-      except: name = None
-      try: ID = attrs.pop('ID')
-      except: ID = None
-      if (name is None) and not (ID is None):
-        name = ID
-      if trackName == 'exon':
-        try: name = attrs.pop('Parent')
-        except: continue
-        size = str(end - start)
-        # get start, blockCount, blockSizes, blockStarts from parent:
-        f = [segments[IDs[name]][x] for x in [0,2,9,10,11]] 
-        st = str(start - f[1])
-        segments[IDs[name]][9] = f[2] + 1 # blockCount
-        segments[IDs[name]][10] = f[3] + size + ',' # blockSizes
-        segments[IDs[name]][11] = f[4] + st + ',' # blockStarts
-        # change track type to exons:
-        if segments[IDs[name]][9] == 1: 
-          c.execute('UPDATE tbl_tracks SET type=?,color=? WHERE trackid=?',('exons','goldenrod',f[0]))
-        continue
-      insert_track(c,uniq_tracks,trackName)
-      score = json.dumps(attrs,separators=('|','=')) if len(attrs)!=0 else None
-      score = re.sub('["{}]','',score)
-      scaffold = aux[0]
-      strand = aux[6] if aux[6] in ['+','-'] else None
-      thickStart = None
-      thickEnd = None
-      if aux[7] in ['0','1','2']:
-        if strand!='-':
-          thickStart = start+int(aux[7])
-          thickEnd = end
-        else:
-          thickStart = start
-          thickEnd = end-int(aux[7])
-      segments.append([uniq_tracks[trackName],scaffold,start,end,name,score,strand,thickStart,thickEnd,0,"",""])
-      if not ID is None and not ID in IDs.keys():
-        IDs[ID] = len(segments)-1
+    with bulk_load(db):
+      c = db.cursor()
+      con = open_file(gfffile)
+      insert_segments(c, gff_rows(con, c, uniq_tracks), GFF_COLUMNS, True)
+      gff_late(c)
+      con.close()
+      self.__finish__(c, True)
+    db.close()
+
+
+GFF_ATTRIBUTES = re.compile(r"\b(\w+)\=([^\=]*)(?=;\w+\=|$)")
+GFF_QUOTES = re.compile('["{}]')
+GFF_PENDING = 200000
 
+
+def gff_feature(aux, attrs, trackid, start, end, name):
+  '''convert the fields of a gff line into a tbl_segments row followed by its lists of block sizes and starts and its attributes'''
+  score = GFF_QUOTES.sub('',json.dumps(attrs,separators=('|','='))) if len(attrs)!=0 else None
+  strand = aux[6] if aux[6] in ['+','-'] else None
+  thickStart = None
+  thickEnd = None
+  if aux[7] in ['0','1','2']:
+    if strand!='-':
+      thickStart = start+int(aux[7])
+      thickEnd = end
+    else:
+      thickStart = start
+      thickEnd = end-int(aux[7])
+  return [trackid,aux[0],start,end,name,score,strand,thickStart,thickEnd,[],[],list(attrs.items())]
+
+
+def gff_row(feature):
+  '''join the block lists of a gff feature into the blockCount, blockSizes and blockStarts columns'''
+  sizes, starts, attributes = feature[9:]
+  return feature[:9] + [len(sizes), ''.join(map('%d,'.__mod__, sizes)), ''.join(map('%d,'.__mod__, starts)), attributes]
+
+
+def gff_block(c, feature, start, end, exons):
+  '''add an exon to its parent feature, turning the parent track into an exons track'''
+  feature[9].append(end-start)
+  feature[10].append(start-feature[2])
+  if feature[0] not in exons:
+    c.execute('UPDATE tbl_tracks SET type=?,color=? WHERE trackid=?',('exons','goldenrod',feature[0]))
+    exons.add(feature[0])
+
+
+def gff_spill(c, features, IDs):
+  '''move the pending gff features and their exons into temporary tables'''
+  c.execute('CREATE TEMP TABLE gff_features (id INTEGER PRIMARY KEY, gffid TEXT, trackid INTEGER, chr TEXT, start INTEGER, end INTEGER, name TEXT, score TEXT, strand TEXT, thickStart INTEGER, thickEnd INTEGER, attributes TEXT)')
+  c.execute('CREATE TEMP TABLE gff_blocks (parent TEXT, start INTEGER, end INTEGER)')
+  owners = dict((id(feature), ID) for ID, feature in IDs.items())
+  for feature in features:
+    ID = owners.get(id(feature))
+    c.execute('INSERT INTO temp.gff_features VALUES (NULL,?,?,?,?,?,?,?,?,?,?,?)', [ID] + feature[:9] + [json.dumps(feature[11])])
+    c.executemany('INSERT INTO temp.gff_blocks VALUES (?,?,?)', [(ID, feature[2]+s, feature[2]+s+size) for size, s in zip(feature[9], feature[10])])
+
+
+def gff_spilled(c, exons):
+  '''yield the rows of the spilled gff features, joined with their exons, and drop the temporary tables. Exons of features yielded before the spill are kept for gff_late'''
+  db = c.connection
+  c.execute('CREATE INDEX temp.gff_features_gffid ON gff_features (gffid)')
+  c.execute('INSERT INTO temp.gff_late SELECT f.segid, b.start, b.end FROM temp.gff_blocks b JOIN temp.gff_flushed f ON f.gffid=b.parent WHERE NOT EXISTS (SELECT 1 FROM temp.gff_features WHERE gffid=b.parent) ORDER BY b.rowid')
+  orphans = c.execute('SELECT count(*) FROM temp.gff_blocks b WHERE NOT EXISTS (SELECT 1 FROM temp.gff_features WHERE gffid=b.parent) AND NOT EXISTS (SELECT 1 FROM temp.gff_flushed WHERE gffid=b.parent)').fetchone()[0]
+  if orphans:
+    print("%d exons without a parent feature have been skipped." % orphans)
+  blocks = db.execute('SELECT p.id, b.start, b.end FROM temp.gff_blocks b JOIN (SELECT gffid, min(id) AS id FROM temp.gff_features WHERE gffid IS NOT NULL GROUP BY gffid) p ON p.gffid=b.parent ORDER BY p.id, b.rowid')
+  block = next(blocks, None)
+  for row in db.execute('SELECT * FROM temp.gff_features ORDER BY id'):
+    feature = list(row[2:11]) + [[],[],json.loads(row[11])]
+    while block is not None and block[0] == row[0]:
+      gff_block(c, feature, block[1], block[2], exons)
+      block = next(blocks, None)
+    yield gff_row(feature)
+  c.execute('DROP TABLE temp.gff_features')
+  c.execute('DROP TABLE temp.gff_blocks')
+
+
+def gff_late(c):
+  '''add to their rows the exons whose parent feature was inserted before them, once gff_rows has been consumed, and drop the temporary tables of the load'''
+  exons = set()
+  late = c.execute('SELECT segid, start, end FROM temp.gff_late ORDER BY segid, rowid').fetchall()
+  for segid, blocks in itertools.groupby(late, lambda x: x[0]):
+    trackid, start, sizes, starts = c.execute('SELECT trackid, start, blockSizes, blockStarts FROM tbl_segments WHERE rowid=?',(segid,)).fetchone()
+    feature = [trackid,None,start,None,None,None,None,None,None,[int(x) for x in (sizes or '').split(',') if x],[int(x) for x in (starts or '').split(',') if x],None]
+    for block in blocks:
+      gff_block(c, feature, block[1], block[2], exons)
+    row = gff_row(feature)
+    c.execute('UPDATE tbl_segments SET blockCount=?, blockSizes=?, blockStarts=? WHERE rowid=?',(row[9],row[10],row[11],segid))
+  c.execute('DROP TABLE temp.gff_flushed')
+  c.execute('DROP TABLE temp.gff_late')
+
+
+def gff_rows(lines, c, uniq_tracks):
+  '''yield the tbl_segments rows of a gff file. Features are held only until a ### directive closes their group, as in sorted GFF3 files; when an exon comes before its parent or too many features are pending, the rest of the file is spilled to temporary tables and joined with its exons at the end. The rowids the yielded features will get are recorded by ID, so exons of a group already closed are kept for gff_late to add once the rows are inserted'''
+  features = []
+  IDs = dict()
+  exons = set()
+  spill = False
+  c.execute('CREATE TEMP TABLE gff_flushed (gffid TEXT PRIMARY KEY, segid INTEGER) WITHOUT ROWID')
+  c.execute('CREATE TEMP TABLE gff_late (segid INTEGER, start INTEGER, end INTEGER)')
+  # rows are inserted in order, each one getting max(rowid)+1
+  segid = c.execute('SELECT coalesce(max(rowid),0) FROM tbl_segments').fetchone()[0] + 1
+  for line in lines:
+    line  = line.rstrip()
+    if line.startswith('#') or line == '':
+      if line.startswith('###') and not spill:
+        positions = dict((id(feature), i) for i, feature in enumerate(features))
+        c.executemany('INSERT OR IGNORE INTO temp.gff_flushed VALUES (?,?)', [(ID, segid+positions[id(feature)]) for ID, feature in IDs.items()])
+        for feature in features:
+          yield gff_row(feature)
+        segid += len(features)
+        features = []
+        IDs = dict()
+      continue
+    aux = line.split("\t")
+    trackName = aux[2]
+    attrs = dict(GFF_ATTRIBUTES.findall(aux[8])) if len(aux) > 8 else dict()
+    start = int(aux[3])-1
+    end = int(aux[4])
+    name = attrs.pop('Name', None)
+    ID = attrs.pop('ID', None)
+    if name is None:
+      name = ID
+    if trackName == 'exon':
+      if 'Parent' not in attrs:
+        continue
+      parent = attrs['Parent']
+      if not spill and parent not in IDs:
+        flushed = c.execute('SELECT segid FROM temp.gff_flushed WHERE gffid=?',(parent,)).fetchone()
+        if flushed is not None:
+          c.execute('INSERT INTO temp.gff_late VALUES (?,?,?)', (flushed[0],start,end))
+          continue
+        gff_spill(c, features, IDs)
+        spill = True
+        features = []
+        IDs = dict()
+      if spill:
+        c.execute('INSERT INTO temp.gff_blocks VALUES (?,?,?)', (parent,start,end))
+      else:
+        gff_block(c, IDs[parent], start, end, exons)
+      continue
+    insert_track(c,uniq_tracks,trackName)
+    feature = gff_feature(aux, attrs, uniq_tracks[trackName], start, end, name)
+    if spill:
+      c.execute('INSERT INTO temp.gff_features VALUES (NULL,?,?,?,?,?,?,?,?,?,?,?)', [ID] + feature[:9] + [json.dumps(feature[11])])
+      continue
+    features.append(feature)
+    if ID is not None and ID not in IDs:
+      IDs[ID] = feature
+    if len(features) >= GFF_PENDING:
+      gff_spill(c, features, IDs)
+      spill = True
+      features = []
+      IDs = dict()
+  if spill:
+    yield from gff_spilled(c, exons)
+  else:
+    for feature in features:
+      yield gff_row(feature)
+
+
+GBK_GENE = re.compile('gene=|"')
+GBK_LOCUS_TAG = re.compile('locus_tag=|"')
+GBK_LOCATION = re.compile('<|>|\n')
+GBK_COMPLEMENT = re.compile('complement\\(|\\)')
+GBK_JOIN = re.compile('join\\(|\\)')
+
+
+def genbank_segment(trackid, scaffold, feature):
+  '''convert the location and qualifiers of a GenBank feature into a tbl_segments row followed by its attributes'''
+  name = None
+  score = []
+  attributes = []
+  strand = '+'
+  blockCount = None
+  blockSizes = None
+  blockStarts = None
+  pos = GBK_LOCATION.sub('','\n'.join(feature[0]))
+  if 'complement' in pos:
+    strand = '-'
+    pos = GBK_COMPLEMENT.sub('',pos)
+  if 'join' in pos:
+    pos = GBK_JOIN.sub('',pos).split(",")
+    blockCount = len(pos)
+    pos = sorted(map(lambda x: list(map(int,x.split('..'))),pos))
+    start = pos[0][0]-1
+    end = pos[-1][-1]
+    blockSizes = ','.join(map(lambda x: str(x[-1]-(x[0]-1)), pos))
+    blockStarts = ','.join(map(lambda x: str((x[0]-1)-start), pos))
+  else:
+    pos = list(map(int,pos.split("..")))
+    start = pos[0]-1
+    end = pos[-1]
+  for i in range(1,len(feature)):
+    s = '\n'.join(feature[i])
+    if s.startswith("gene="):
+      name = GBK_GENE.sub('',s)
+    elif s.startswith("locus_tag=") and name is None:
+      name = GBK_LOCUS_TAG.sub('',s)
+    elif not s.startswith("translation="):
+      score.append(s.replace('"',''))
+      s = score[-1].replace('\n',' ').split('=',1)
+      attributes.append((s[0],s[1] if len(s) > 1 else None))
+  score = '|'.join(score) if len(score) else None
+  return (trackid,scaffold,start,end,name,score,strand,blockCount,blockSizes,blockStarts,attributes)
+
+
+def parse_genbank(lines, c, sequences, uniq_tracks, assembly):
+  '''parse GenBank records into tbl_segments rows and a sequence store writer, appending the records to assembly'''
+  HEADER, FEATURES, ORIGIN = 1, 2, 3
+  state = HEADER
+  track = None
+  feature = None
+  segments = []
+  exons = set()
+
+  def flush_feature():
+    if feature is not None:
+      segments.append(genbank_segment(uniq_tracks[track], assembly[-1][0], feature))
+      if any(map(lambda x: 'join' in x, feature[0])):
+        if track not in exons:
+          exons.add(track)
+          c.execute('UPDATE tbl_tracks SET type=?,color=? WHERE trackid=?',('exons','goldenrod',uniq_tracks[track]))
+      if len(segments) >= BATCH_SIZE:
+        insert_segments(c, segments, GBK_COLUMNS, True)
+        del segments[:]
+
+  for line in lines:
+    if state == ORIGIN and line[:1] == ' ':
+      # sequence line: right-aligned position in columns 1-9, then groups of bases
+      if len(line) > 10 and line[9] == ' ':
+        sequences.write(line[10:].replace(' ','').rstrip('\r\n'))
+      else:
+        sequences.write(''.join(line.split()[1:]))
+    elif 'A' <= line[:1] <= 'Z':
+      if state == FEATURES:
+        flush_feature()
+        feature = None
+      aux = line.split()
+      if aux[0] == "LOCUS":
+        assembly.append([aux[1],0,int(aux[2])])
+        state = HEADER
+      elif aux[0] == "VERSION":
+        if aux[1].find(assembly[-1][0]) == 0:
+          assembly[-1][0] = aux[1]
+        state = HEADER
+      elif aux[0] == "FEATURES":
+        state = FEATURES
+      elif aux[0] == "ORIGIN":
+        state = ORIGIN
+        sequences.start(assembly[-1][0])
+      else:
+        state = HEADER
+    elif state == FEATURES:
+      if len(line) > 5 and line[5] != " ":
+        flush_feature()
+        feature = None
+        aux = line.split()
+        track = aux[0]
+        if track != "source" and len(aux) > 1:
+          feature = [[aux[1]]]
+          insert_track(c,uniq_tracks,track)
+      elif feature is not None:
+        line = line.strip()
+        if line.startswith('/'):
+          feature.append([line[1:]])
+        elif not feature[-1][0].startswith('translation='):
+          feature[-1].append(line)
+    elif state == ORIGIN and line.startswith('//'):
+      state = HEADER
+  if state == FEATURES:
+    flush_feature()
+  insert_segments(c, segments, GBK_COLUMNS, True)
+
+
+def genbank_records(gbkfile, parts):
+  '''split a plain GenBank file into about "parts" byte ranges made of whole LOCUS records'''
+  con = open(gbkfile,'rb')
+  try:
+    data = mmap.mmap(con.fileno(), 0, access=mmap.ACCESS_READ)
+  except ValueError:
     con.close()
-    cur = db.cursor()
-    for row in segments:
-      c.execute('INSERT INTO tbl_segments (trackid,chr,start,end,name,score,strand,thickStart,thickEnd,blockCount,blockSizes,blockStarts) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)',row)
-      
-    aux_genes(c)
+    return []
+  starts = [0] if data[:5] == b'LOCUS' else []
+  i = data.find(b'\nLOCUS')
+  while i != -1:
+    starts.append(i+1)
+    i = data.find(b'\nLOCUS', i+1)
+  size = len(data)
+  data.close()
+  con.close()
+  if len(starts) == 0:
+    return []
+  starts[0] = 0
+  starts.append(size)
+  target = size/float(parts)
+  ranges = []
+  first = 0
+  for i in range(1, len(starts)):
+    if starts[i]-starts[first] >= target or i == len(starts)-1:
+      ranges.append((starts[first], starts[i]))
+      first = i
+  return ranges
+
+
+def genbank_lines(gbkfile, start, end):
+  '''yield the text lines of a byte range of a file'''
+  con = open(gbkfile,'rb',buffering=BUFFER_SIZE)
+  con.seek(start)
+  pos = start
+  for line in con:
+    if pos >= end:
+      break
+    pos += len(line)
+    yield line.decode('utf-8','replace')
+  con.close()
+
+
+def genbank_part(gbkfile, start, end):
+  '''parse a byte range of a GenBank file into a new temporary directory, return it with its assembly'''
+  directory = tempfile.mkdtemp()
+  createDB(directory)
+  db = openDB(directory)
+  assembly = []
+  sequences = TwoBitWriter(os.path.join(directory,SEQUENCES))
+  with bulk_load(db):
+    parse_genbank(genbank_lines(gbkfile, start, end), db.cursor(), sequences, dict(), assembly)
+  sequences.close()
+  db.close()
+  return directory, assembly
+
+
+def merge_genbank(db, directory, uniq_tracks):
+  '''copy the features parsed into another directory into an open database, matching tracks by name'''
+  part = openDB(directory)
+  tracks = part.execute('SELECT trackid,trackname,type FROM tbl_tracks ORDER BY trackid').fetchall()
+  part.close()
+  c = db.cursor()
+  c.execute('CREATE TEMP TABLE IF NOT EXISTS trackmap (old INTEGER PRIMARY KEY, new INTEGER)')
+  c.execute('DELETE FROM temp.trackmap')
+  for trackid, track, tracktype in tracks:
+    insert_track(c, uniq_tracks, track)
+    c.execute('INSERT INTO temp.trackmap VALUES (?,?)', (trackid, uniq_tracks[track]))
+    if tracktype == 'exons':
+      c.execute('UPDATE tbl_tracks SET type=?,color=? WHERE trackid=?',('exons','goldenrod',uniq_tracks[track]))
+  db.commit()
+  db.execute('ATTACH DATABASE ? AS part', (os.path.join(directory, "Tracks.db"),))
+  try:
+    rowids = db.execute('SELECT coalesce(max(rowid),0) FROM main.tbl_segments').fetchone()[0]
+    columns = ','.join(GBK_COLUMNS[1:]+('bin',))
+    db.execute('INSERT INTO main.tbl_segments (rowid,trackid,%s) SELECT s.rowid+?,m.new,%s FROM part.tbl_segments s JOIN temp.trackmap m ON s.trackid = m.old ORDER BY s.rowid' % (columns, ','.join(map(lambda x: 's.'+x, GBK_COLUMNS[1:]+('bin',)))), (rowids,))
+    db.execute('INSERT INTO main.tbl_attributes (segid,key,value,number) SELECT segid+?,key,value,number FROM part.tbl_attributes', (rowids,))
     db.commit()
-    db.close()
+  finally:
+    db.execute('DETACH DATABASE part')
 
 
-def gbk2genomebrowser(gbkfile, server = False, directory = "GenomeBrowser"):
+def gbk2genomebrowser(gbkfile, server = False, directory = "GenomeBrowser", workers = 1, assets = None):
   '''Creates an interactive genome browser from a GenBank file.
   
   Arguments:
     gbkfile -- a string representing the input GenBank file to be represented in the genome browser.
     server -- a logical value to enable or disable the server mode. Server mode: designed to be shared as a website. Resulting folder should be added to the Apache applications directory and enable writting permissions. In this way the genome browser will be working as a web site. Local mode: the genome browser will be functional on your local machine. (default False)
     directory -- a string representing the directory where the graph will be saved. (default "GenomeBrowser")
+    workers -- an integer giving the number of processes used to parse the LOCUS records of a multi-record file, None for one per CPU. Compressed files are always parsed by a single process. (default 1)
+    assets -- a string with a shared directory where the scripts and styles are kept once per version, to be hard linked (or symlinked across file systems) instead of copied into every output directory. (default None)
   '''
-  current = 1
-  track = ''
-  string = ''
-  sequence = ''
-
   uniq_tracks = dict()
   assembly = []
 
   tmp = tempfile.mkdtemp()
   createDB(tmp)
   db = openDB(tmp)
-  c = db.cursor()
-
-  def trackData(c,string):
-    if string != '':
-      string = string.split('\n/')
-      scaffold = assembly[-1][0]
-      start = 0
-      end = 0
-      name = None
-      score = None
-      strand = '+'
-      blockCount = None
-      blockSizes = None
-      blockStarts = None
-      pos = string.pop(0)
-      pos = re.sub('<|>|\\n','',pos)
-      if 'complement' in pos:
-        strand = '-'
-        pos = re.sub('complement\(|\)','',pos)
-      if 'join' in pos:
-        c.execute('UPDATE tbl_tracks SET type=?,color=? WHERE trackid=?',('exons','goldenrod',uniq_tracks[track]))
-        pos = re.sub('join\(|\)','',pos)
-        pos = pos.split(",")
-        blockCount = len(pos)
-        pos = list(map(lambda x: list(map(int,x.split('..'))),pos))
-        pos.sort()
-        start = pos[0][0]-1
-        end = pos[-1][1]
-        blockSizes = ','.join(list(map(lambda x: str(x[1]-(x[0]-1)), pos)))
-        blockStarts = ','.join(list(map(lambda x: str((x[0]-1)-start), pos)))
-      else:
-        pos = list(map(int,pos.split("..")))
-        start = pos[0]-1
-        end = pos[1]
-      for s in string:
-        if s.startswith("gene="):
-          name = re.sub('gene=|"','',s)
-        elif s.startswith("locus_tag=") and name is None:
-          name = re.sub('locus_tag=|"','',s)
-        elif not s.startswith("translation="):
-          if score is None:
-            score = s.replace('"','')
-          else:
-            score = score + '|' + s.replace('"','')
-      c.execute('INSERT INTO tbl_segments (trackid,chr,start,end,name,score,strand,blockCount,blockSizes,blockStarts) VALUES (?,?,?,?,?,?,?,?,?,?)',(uniq_tracks[track],scaffold,start,end,name,score,strand,blockCount,blockSizes,blockStarts))
-
-  con = open_file(gbkfile)
-  for line in con:
-    try: line = line.decode('utf-8')
-    except: pass
-    aux = re.split(' +',line.strip())
-    if aux[0]=="LOCUS":
-      assembly.append([aux[1],0,int(aux[2])])
-      current = 1
-    elif aux[0]=="VERSION":
-      if aux[1].find(assembly[-1][0]) == 0:
-        assembly[-1][0] = aux[1]
-      current = 1
-    elif aux[0]=="FEATURES":
-      current = 2
-    elif aux[0]=="ORIGIN":
-      trackData(c,string)
-      string = ''
-      current = 3
-      sequence = open(os.path.join(tmp,assembly[-1][0]+".fa"),'w')
-      sequence.write(">"+assembly[-1][0]+"\n")
-    elif re.search("^[A-Z]",line[0]):
-      current = 1
+  ranges = []
+  if workers != 1:
+    workers = workers or os.cpu_count() or 1
+    con = open(gbkfile,'rb')
+    compressed = con.read(2) == b'\x1f\x8b'
+    con.close()
+    if not compressed:
+      ranges = genbank_records(gbkfile, 4*workers)
+  sequences = TwoBitWriter(os.path.join(tmp,SEQUENCES))
+  part_directories = []
+  with bulk_load(db):
+    c = db.cursor()
+    if len(ranges) > 1:
+      with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        parts = [pool.submit(genbank_part, gbkfile, start, end) for start, end in ranges]
+        for part in parts:
+          part_directory, part_assembly = part.result()
+          merge_genbank(db, part_directory, uniq_tracks)
+          sequences.extend(os.path.join(part_directory,SEQUENCES))
+          assembly.extend(part_assembly)
+          part_directories.append(part_directory)
     else:
-      if current==2:
-        if line[5]!=" ":
-          trackData(c,string)
-          string = ''
-          track = aux[0]
-          if(track!="source"):
-            string = aux[1]
-            insert_track(c,uniq_tracks,track)
-        else:
-          if(track!="source"):
-            string = string+'\n'+line.strip()
-      if current==3:
-        if aux[0]!="//":
-          sequence.write(''.join(aux[1:]))
-        else:
-          sequence.close()
-  con.close()
-  aux_genes(c)
-  db.commit()
+      con = open_file(gbkfile)
+      parse_genbank(con, c, sequences, uniq_tracks, assembly)
+      con.close()
+    create_indexes(c)
+    aux_genes(c)
   db.close()
+  sequences.close()
+  for part_directory in part_directories:
+    shutil.rmtree(part_directory)
 
-  gb = genomebrowser(assembly,None,server,directory)
-  os.mkdir(os.path.join(directory,"sequences"))
-  for chrom in assembly:
-    shutil.move(os.path.join(tmp,chrom[0]+".fa"),os.path.join(directory,"sequences",chrom[0]+".fa"))
+  gb = genomebrowser(assembly,None,server,directory,assets=assets)
+  shutil.move(os.path.join(tmp,SEQUENCES),os.path.join(directory,SEQUENCES))
   os.remove(os.path.join(directory,'Tracks.db'))
   shutil.move(os.path.join(tmp,'Tracks.db'),os.path.join(directory,'Tracks.db'))
   shutil.rmtree(tmp)
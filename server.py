@@ -0,0 +1,225 @@
+'''Serve a genome browser directory over HTTP with asyncio, as an alternative to Apache and query.php.
+
+Usage:
+  python server.py [directory] [port]
+
+Besides the files of the directory, the server answers these GET (or form POST) requests with json:
+  /tracks                                         [[trackname, type, color], ...]
+  /chromosomes                                    [[chr, last feature end], ...]
+  /query?chr=&start=&end=[&tracks=a,b][&filters=] genomebrowser.query, filters as a json list of [key, operator, value]
+  /summary?chr=&start=&end=[&tracks=a,b][&bins=]  genomebrowser.querySummary
+  /genotypes?chr=&start=&end=&track=[&samples=]   genomebrowser.getGenotypes
+  /sequence?chr=&start=&end=                      genomebrowser.getSequence
+  /search?term=[&limit=]                          genomebrowser.searchGenes
+'''
+import os, sys, json, queue, sqlite3, asyncio, collections, concurrent.futures, mimetypes, urllib.parse
+from genomebrowser import genomebrowser
+
+MMAP_SIZE = 1 << 30
+CACHE_SIZE = 1024
+READ_LIMIT = 1 << 20
+FILE_BLOCK = 1 << 20
+
+
+class ConnectionPool:
+  '''read-only sqlite connections shared by the query threads'''
+
+  def __init__(self, filename, size, immutable = True):
+    if not immutable:
+      db = sqlite3.connect(filename)
+      db.execute('PRAGMA journal_mode=WAL')
+      db.close()
+    uri = 'file:%s?mode=ro%s' % (urllib.parse.quote(os.path.abspath(filename)), '&immutable=1' if immutable else '')
+    self.__queue__ = queue.Queue()
+    self.__connections__ = []
+    for i in range(size):
+      db = sqlite3.connect(uri, uri=True, check_same_thread=False)
+      db.execute('PRAGMA mmap_size=%d' % MMAP_SIZE)
+      self.__connections__.append(db)
+      self.__queue__.put(db)
+
+  def get(self):
+    return self.__queue__.get()
+
+  def put(self, db):
+    self.__queue__.put(db)
+
+  def close(self):
+    for db in self.__connections__:
+      db.close()
+
+
+class QueryServer:
+  '''asyncio HTTP server answering the queries of a genome browser directory'''
+
+  def __init__(self, directory, connections = 8, cache = CACHE_SIZE, immutable = True):
+    self.__directory__ = os.path.realpath(directory)
+    self.__database__ = os.path.join(directory,'Tracks.db')
+    self.__pool__ = ConnectionPool(self.__database__, connections, immutable)
+    self.__executor__ = concurrent.futures.ThreadPoolExecutor(connections)
+    self.__gb__ = genomebrowser.fromDirectory(directory, pool=self.__pool__)
+    self.__cache__ = collections.OrderedDict()
+    self.__size__ = cache
+    self.__chromosomes__ = None
+
+  def __version__(self):
+    '''identify the state of the database by the size and modification time of its file and of its write-ahead log, as commits to a WAL database only touch the log until it is checkpointed'''
+    version = ()
+    for filename in (self.__database__, self.__database__+'-wal'):
+      try:
+        stat = os.stat(filename)
+        version += (stat.st_size, stat.st_mtime_ns)
+      except OSError:
+        version += (None, None)
+    return version
+
+  def __chromosomes_list__(self):
+    '''chromosomes with features and the end of their last feature, computed once per database version'''
+    version = self.__version__()
+    if self.__chromosomes__ is None or self.__chromosomes__[0] != version:
+      db = self.__pool__.get()
+      try:
+        self.__chromosomes__ = (version, [list(row) for row in db.execute('SELECT chr, max(end) FROM tbl_segments GROUP BY chr')])
+      finally:
+        self.__pool__.put(db)
+    return self.__chromosomes__[1]
+
+  def __tracks__(self):
+    db = self.__pool__.get()
+    try:
+      return db.execute('SELECT trackname, type, color FROM tbl_tracks ORDER BY trackid').fetchall()
+    finally:
+      self.__pool__.put(db)
+
+  def __answer__(self, path, args):
+    '''run a query in a worker thread, return its json'''
+    gb = self.__gb__
+    names = lambda x: None if x not in args else args[x].split(',')
+    if path == '/tracks':
+      rows = self.__tracks__()
+    elif path == '/chromosomes':
+      rows = self.__chromosomes_list__()
+    elif path == '/query':
+      rows = gb.query(args['chr'], int(args['start']), int(args['end']), names('tracks'), json.loads(args['filters']) if 'filters' in args else None)
+    elif path == '/summary':
+      rows = gb.querySummary(args['chr'], int(args['start']), int(args['end']), names('tracks'), int(args.get('bins', 1000)))
+    elif path == '/genotypes':
+      rows = gb.getGenotypes(args['chr'], int(args['start']), int(args['end']), args['track'], names('samples'))
+    elif path == '/search':
+      rows = gb.searchGenes(args['term'], int(args.get('limit', 10)))
+    else:
+      rows = gb.getSequence(args['chr'], int(args['start']), int(args['end']))
+    return json.dumps(rows).encode('utf-8')
+
+  async def respond(self, path, args):
+    '''return the status, content type and body answering a request. The body of a file is the open file, for handle to stream'''
+    if path in ('/tracks','/chromosomes','/query','/summary','/genotypes','/sequence','/search'):
+      key = (path,) + self.__version__() + tuple(sorted(args.items()))
+      if key in self.__cache__:
+        self.__cache__.move_to_end(key)
+        return 200, 'application/json', self.__cache__[key]
+      try:
+        body = await asyncio.get_running_loop().run_in_executor(self.__executor__, self.__answer__, path, args)
+      except (KeyError, ValueError, TypeError) as e:
+        return 400, 'text/plain', ('Bad request: %s\n' % e).encode('utf-8')
+      except Exception as e:
+        return 500, 'text/plain', ('Server error: %s\n' % e).encode('utf-8')
+      self.__cache__[key] = body
+      if len(self.__cache__) > self.__size__:
+        self.__cache__.popitem(last=False)
+      return 200, 'application/json', body
+    filename = os.path.realpath(os.path.join(self.__directory__, urllib.parse.unquote(path).lstrip('/') or 'index.html'))
+    if not filename.startswith(self.__directory__+os.sep) or not os.path.isfile(filename):
+      return 404, 'text/plain', b'Not found\n'
+    return 200, mimetypes.guess_type(filename)[0] or 'application/octet-stream', open(filename,'rb')
+
+  async def __stream__(self, con, size, writer):
+    '''copy the first "size" bytes of a file to a connection in blocks read by the worker threads, so the event loop never waits on the disk. Return whether they were all sent'''
+    loop = asyncio.get_running_loop()
+    while size > 0:
+      block = await loop.run_in_executor(self.__executor__, con.read, min(size, FILE_BLOCK))
+      if not block:
+        break
+      size -= len(block)
+      writer.write(block)
+      await writer.drain()
+    return size <= 0
+
+  async def handle(self, reader, writer):
+    '''serve the requests of a keep-alive connection'''
+    try:
+      while True:
+        line = await reader.readline()
+        if not line:
+          break
+        request = line.decode('latin-1').split()
+        if len(request) != 3:
+          break
+        headers = dict()
+        while True:
+          line = await reader.readline()
+          if line in (b'\r\n', b'\n', b''):
+            break
+          key, value = line.decode('latin-1').split(':', 1)
+          headers[key.strip().lower()] = value.strip()
+        target = urllib.parse.urlsplit(request[1])
+        args = dict(urllib.parse.parse_qsl(target.query))
+        length = min(int(headers.get('content-length', 0)), READ_LIMIT)
+        if length:
+          args.update(urllib.parse.parse_qsl((await reader.readexactly(length)).decode('utf-8')))
+        status, ctype, body = await self.respond(target.path, args)
+        keep = request[2] == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        try:
+          # files, the database included, are sent as large as they were when the request came
+          size = len(body) if isinstance(body, bytes) else os.fstat(body.fileno()).st_size
+          writer.write(('HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n' % (status, 'OK' if status == 200 else 'Error', ctype, size, 'keep-alive' if keep else 'close')).encode('latin-1'))
+          if request[0] != 'HEAD':
+            if isinstance(body, bytes):
+              writer.write(body)
+            elif not await self.__stream__(body, size, writer):
+              # a file cut while it was sent cannot fill the announced length
+              keep = False
+          await writer.drain()
+        finally:
+          if not isinstance(body, bytes):
+            body.close()
+        if not keep:
+          break
+    except (ConnectionError, asyncio.IncompleteReadError):
+      pass
+    finally:
+      writer.close()
+
+  async def serve(self, host = '127.0.0.1', port = 8000):
+    server = await asyncio.start_server(self.handle, host, port)
+    print("Serving '%s' on http://%s:%d/" % (self.__directory__, host, port))
+    async with server:
+      await server.serve_forever()
+
+  def close(self):
+    self.__executor__.shutdown()
+    self.__pool__.close()
+
+
+def serve(directory = 'GenomeBrowser', host = '127.0.0.1', port = 8000, connections = 8, cache = CACHE_SIZE, immutable = True):
+  '''Serve a genome browser directory and its queries over HTTP until interrupted.
+
+  Arguments:
+    directory -- a string giving the genome browser directory. (default "GenomeBrowser")
+    host -- a string giving the address to listen on. (default "127.0.0.1")
+    port -- an integer giving the port to listen on. (default 8000)
+    connections -- an integer giving the number of pooled read-only database connections and query threads. (default 8)
+    cache -- an integer giving the number of recent query responses kept in memory. (default 1024)
+    immutable -- a logical value to open the database as immutable, skipping all locking. Set it to False if tracks can be added while serving: the database is then switched to WAL mode so reads and writes do not block each other. (default True)
+  '''
+  server = QueryServer(directory, connections, cache, immutable)
+  try:
+    asyncio.run(server.serve(host, port))
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.close()
+
+
+if __name__ == '__main__':
+  serve(sys.argv[1] if len(sys.argv) > 1 else 'GenomeBrowser', port = int(sys.argv[2]) if len(sys.argv) > 2 else 8000)
@@ -0,0 +1,15 @@
+import os, sys
+import pytest
+
+# the modules are imported flat, as genomebrowser.py imports utils, bgzf and twobit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import genomebrowser
+
+
+@pytest.fixture
+def gb(tmp_path):
+  '''a genome browser over a bare database, without the html files'''
+  directory = str(tmp_path / 'gb')
+  os.mkdir(directory)
+  genomebrowser.createDB(directory)
+  return genomebrowser.genomebrowser.fromDirectory(directory)
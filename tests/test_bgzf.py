@@ -0,0 +1,119 @@
+import os, zlib, gzip, struct, random
+import pytest
+from bgzf import BgzfReader, is_bgzf, read_index, read_region, reg2bins
+from utils import open_file
+
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+def bgzf_block(data):
+  '''compress up to 64kb into one BGZF block'''
+  deflate = zlib.compressobj(6, zlib.DEFLATED, -15)
+  payload = deflate.compress(data) + deflate.flush()
+  header = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00' + struct.pack('<H', 18+len(payload)+8-1)
+  return header + payload + struct.pack('<2I', zlib.crc32(data), len(data))
+
+
+def write_bgzf(path, data, size = 1 << 12):
+  '''write data as BGZF blocks of "size" uncompressed bytes, return the virtual offset of every line start'''
+  offsets = []
+  con = open(path, 'wb')
+  for i in range(0, len(data), size):
+    block = data[i:i+size]
+    for j in range(len(block)):
+      if i+j == 0 or data[i+j-1:i+j] == b'\n':
+        offsets.append(con.tell() << 16 | j)
+    con.write(bgzf_block(block))
+  con.write(BGZF_EOF)
+  con.close()
+  return offsets
+
+
+def bed_lines(n, seed = 1):
+  r = random.Random(seed)
+  rows = []
+  for chrom in ('chr1', 'chr2', 'chr10'):
+    for s in sorted(r.randrange(0, 3000000) for i in range(n)):
+      rows.append('%s\t%d\t%d\tf%d\t%.2f' % (chrom, s, s+r.randint(1, 200000 if r.random() < 0.05 else 2000), len(rows), r.random()))
+  return rows
+
+
+def test_reader_inflates_every_block(tmp_path):
+  data = ('\n'.join(bed_lines(2000)) + '\n').encode('utf-8')
+  path = str(tmp_path / 'a.bed.gz')
+  write_bgzf(path, data)
+  assert is_bgzf(path)
+  for threads in (1, 4):
+    con = BgzfReader(path, threads)
+    assert con.read() == data
+    con.close()
+  con = open_file(path)
+  assert con.read() == data.decode('utf-8')
+  con.close()
+
+
+def test_reader_seeks_virtual_offsets(tmp_path):
+  lines = [line.encode('utf-8') + b'\n' for line in bed_lines(500)]
+  path = str(tmp_path / 'a.bed.gz')
+  offsets = write_bgzf(path, b''.join(lines), 1000)
+  con = BgzfReader(path, 2)
+  for i in random.Random(2).sample(range(len(lines)), 50):
+    con.seek_virtual(offsets[i])
+    assert con.readline() == lines[i]
+  con.close()
+
+
+def test_plain_gzip_is_not_bgzf(tmp_path):
+  path = str(tmp_path / 'a.gz')
+  con = gzip.open(path, 'wb')
+  con.write(b'chr1\t0\t10\n')
+  con.close()
+  assert not is_bgzf(path)
+  con = open_file(path)
+  assert con.read() == 'chr1\t0\t10\n'
+  con.close()
+
+
+def test_reg2bins_default_scheme():
+  assert reg2bins(0, 1) == [0, 1, 9, 73, 585, 4681]
+  assert 4681 + (100000 >> 14) in reg2bins(100000, 100001)
+
+
+@pytest.mark.parametrize('csi', [False, True])
+def test_read_region_matches_a_scan(tmp_path, csi):
+  pysam = pytest.importorskip('pysam')
+  lines = bed_lines(3000)
+  plain = str(tmp_path / 'a.bed')
+  con = open(plain, 'w')
+  con.write('\n'.join(lines) + '\n')
+  con.close()
+  path = pysam.tabix_index(plain, preset='bed', csi=csi, force=True)
+  assert os.path.isfile(path + ('.csi' if csi else '.tbi'))
+  index = read_index(path)
+  r = random.Random(3)
+  for i in range(200):
+    chrom = r.choice(('chr1', 'chr2', 'chr10', 'chrX'))
+    start = r.randrange(0, 3100000)
+    end = start + r.randint(1, r.choice((100, 10000, 1000000)))
+    expected = [line for line in lines if line.split('\t')[0] == chrom and int(line.split('\t')[1]) < end and int(line.split('\t')[2]) > start]
+    assert list(read_region(path, chrom, start, end, index)) == expected
+
+
+def test_read_region_of_a_vcf(tmp_path):
+  pysam = pytest.importorskip('pysam')
+  r = random.Random(4)
+  header = '##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+  records = []
+  for pos in sorted(r.sample(range(1, 500000), 2000)):
+    ref = r.choice(('A', 'CT', 'GATTACA'))
+    records.append('chr1\t%d\t.\t%s\tA\t.\tPASS\t.' % (pos, ref))
+  plain = str(tmp_path / 'a.vcf')
+  con = open(plain, 'w')
+  con.write(header + '\n'.join(records) + '\n')
+  con.close()
+  path = pysam.tabix_index(plain, preset='vcf', force=True)
+  for i in range(100):
+    start = r.randrange(0, 500000)
+    end = start + r.randint(1, 5000)
+    expected = [x for x in records if int(x.split('\t')[1])-1 < end and int(x.split('\t')[1])-1+len(x.split('\t')[3]) > start]
+    assert list(read_region(path, 'chr1', start, end)) == expected
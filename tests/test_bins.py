@@ -0,0 +1,46 @@
+import random
+from genomebrowser import bin_from_range, bin_ranges, BIN_STANDARD_MAX
+
+
+def in_ranges(b, ranges):
+  return any(first <= b <= last for first, last in ranges)
+
+
+def test_bin_from_range_ucsc_values():
+  # values of binFromRange/binFromRangeExtended in the UCSC kent source
+  assert bin_from_range(0, 1) == 585
+  assert bin_from_range(0, 1 << 17) == 585
+  assert bin_from_range(0, (1 << 17)+1) == 73
+  assert bin_from_range(1 << 17, (1 << 17)+1) == 586
+  assert bin_from_range(0, 1 << 20) == 73
+  assert bin_from_range(0, 1 << 23) == 9
+  assert bin_from_range(0, 1 << 26) == 1
+  assert bin_from_range(0, BIN_STANDARD_MAX) == 0
+  assert bin_from_range(BIN_STANDARD_MAX, BIN_STANDARD_MAX+1) == 4681 + 4681 + (BIN_STANDARD_MAX >> 17)
+  assert bin_from_range(0, BIN_STANDARD_MAX+1) == 4681
+  assert bin_from_range(BIN_STANDARD_MAX, 2*BIN_STANDARD_MAX) == 4681 + 2
+
+
+def test_bin_ranges_cover_overlapping_features():
+  r = random.Random(1)
+  for i in range(5000):
+    length = r.choice((1 << 20, 1 << 28, 1 << 31))
+    start = r.randrange(0, length)
+    end = start + r.randint(1, r.choice((10, 1 << 17, 1 << 22, 1 << 27)))
+    qstart = r.randrange(0, length)
+    qend = qstart + r.randint(1, r.choice((10, 1 << 17, 1 << 24)))
+    if start < qend and end > qstart:
+      assert in_ranges(bin_from_range(start, end), bin_ranges(qstart, qend))
+
+
+def test_bin_ranges_of_a_region_hold_its_features():
+  for start, end in ((0, 1), (131071, 131073), (BIN_STANDARD_MAX-5, BIN_STANDARD_MAX+5), (3 << 29, (3 << 29)+1000)):
+    ranges = bin_ranges(start, end)
+    for s in range(start, end, max(1, (end-start)//50)):
+      assert in_ranges(bin_from_range(s, s+1), ranges)
+    assert in_ranges(bin_from_range(start, end), ranges)
+
+
+def test_bin_ranges_of_an_empty_region():
+  assert bin_ranges(10, 10) == []
+  assert bin_ranges(-10, 0) == []
@@ -0,0 +1,77 @@
+import os, time, tempfile
+import pytest
+import genomebrowser
+
+
+def write_genes(path, names):
+  path.write_text(''.join('chr1\t%d\t%d\t%s\t0\t+\n' % (i*1000, i*1000+500, name) for i, name in enumerate(names)))
+  return str(path)
+
+
+def test_changed_last_gene_track_is_searched_again(tmp_path, gb):
+  gb = genomebrowser.genomebrowser.fromDirectory(gb.__directory__, incremental=True)
+  genes = tmp_path / 'genes.bed'
+  gb.addTrack(write_genes(tmp_path / 'other.bed', ['KEEP1']), 'other')
+  gb.addTrack(write_genes(genes, ['OLDGENE1', 'OLDGENE2']), 'genes')
+  assert [row[3] for row in gb.searchGenes('OLD')] == ['OLDGENE1', 'OLDGENE2']
+  write_genes(genes, ['NEWGENE1', 'NEWGENE2', 'NEWGENE3'])
+  os.utime(str(genes), (time.time()+10, time.time()+10))
+  gb.addTrack(str(genes), 'genes')
+  assert [row[4] for row in gb.query('chr1', 0, 10000, 'genes')] == ['NEWGENE1', 'NEWGENE2', 'NEWGENE3']
+  assert gb.searchGenes('OLD') == []
+  assert [row[3] for row in gb.searchGenes('NEW')] == ['NEWGENE1', 'NEWGENE2', 'NEWGENE3']
+  assert [row[3] for row in gb.searchGenes('KEEP')] == ['KEEP1']
+
+
+def test_track_removed_and_added_in_a_batch(tmp_path, gb):
+  with gb.batch():
+    gb.addTrack(write_genes(tmp_path / 'a.bed', ['AGENE']), 'A')
+  with gb.batch():
+    gb.removeTrack('A')
+    gb.addTrack(write_genes(tmp_path / 'b.bed', ['BGENE']), 'B')
+  assert gb.searchGenes('AGENE') == []
+  assert [row[3] for row in gb.searchGenes('BGENE')] == ['BGENE']
+
+
+def test_batch_keeps_the_indexes_of_a_loaded_database(tmp_path, gb):
+  def indexes():
+    db = genomebrowser.openDB(gb.__directory__)
+    names = set(row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='tbl_segments'"))
+    db.close()
+    return names
+  with gb.batch():
+    assert indexes() == set()
+    gb.addTrack(write_genes(tmp_path / 'a.bed', ['AGENE']), 'A')
+  loaded = indexes()
+  assert loaded
+  with gb.batch():
+    assert indexes() == loaded
+    gb.addTrack(write_genes(tmp_path / 'b.bed', ['BGENE']), 'B')
+  assert indexes() == loaded
+
+
+def test_failed_parallel_load_leaves_no_temporary_databases(tmp_path, gb, monkeypatch):
+  scratch = tmp_path / 'scratch'
+  scratch.mkdir()
+  monkeypatch.setattr(tempfile, 'tempdir', str(scratch))
+  bad = tmp_path / 'bad.bed'
+  bad.write_text('chr1\tstart\t100\tX\n')
+  tracks = [write_genes(tmp_path / ('g%d.bed' % i), ['G%d' % i]) for i in range(3)]
+  with pytest.raises(ValueError):
+    gb.addTracks(tracks[:1] + [str(bad)] + tracks[1:], workers=2)
+  assert os.listdir(str(scratch)) == []
+
+
+def test_removing_a_track_keeps_the_journal(tmp_path, gb, monkeypatch):
+  gb.addTrack(write_genes(tmp_path / 'a.bed', ['AGENE']), 'A')
+  pragmas = []
+  connect = genomebrowser.openDB
+  def openDB(directory):
+    db = connect(directory)
+    db.set_trace_callback(lambda sql: pragmas.append(sql) if sql.startswith('PRAGMA') else None)
+    return db
+  monkeypatch.setattr(genomebrowser, 'openDB', openDB)
+  gb.removeTrack('A')
+  assert any(sql.startswith('PRAGMA cache_size=') for sql in pragmas)
+  assert not any(sql.startswith(('PRAGMA journal_mode=', 'PRAGMA synchronous=')) for sql in pragmas)
+  assert gb.query('chr1', 0, 10000) == []
@@ -0,0 +1,33 @@
+import io, json
+import pytest
+import genomebrowser
+from genomebrowser import Assembly, genomemap_data, genomemap_chunks
+from utils import write_script
+
+
+def test_streamed_map_json_matches_dumps(tmp_path):
+  bed = tmp_path / 'map.bed'
+  bed.write_text(''.join('chr%d\t%d\t%d\t.\t%d\n' % (1 + i % 3, i*1000, i*1000+500, i % 17) for i in range(3000)))
+  d = genomemap_data(str(bed), Assembly([['chr1', 0, 3000000], ['chr2', 0, 2000000], ['chr3', 0, 1000000], ['chrM', 0, 16000]]))
+  chunks = list(genomemap_chunks(d))
+  assert len(chunks) > 4
+  assert ''.join(chunks) == json.dumps(d)
+  con = io.StringIO()
+  write_script(con, 'data', iter(chunks))
+  assert con.getvalue() == '<script type="application/json" id="data">' + json.dumps(d) + '</script>'
+
+
+def test_numpy_and_python_maps_agree_on_ragged_rows(tmp_path, monkeypatch):
+  pytest.importorskip('numpy')
+  rows = []
+  for i in range(4000):
+    score = ('.', 'NA', '%d' % (i % 7), '%.3f' % (i / 7.0))[i % 4]
+    extra = '\t+' if i % 500 == 0 else ''
+    rows.append('chr%d\t%d\t%d\tf%d\t%s%s\n' % (1 + i % 3, i*700, i*700+500, i, score, extra))
+  rows.append('chrUn\t0\t10\tx\t5\n')
+  bed = tmp_path / 'map.bed'
+  bed.write_text(''.join(rows))
+  assembly = Assembly([['chr1', 0, 3000000], ['chr2', 0, 3000000], ['chr3', 0, 3000000]])
+  expected = genomemap_data(str(bed), assembly)
+  monkeypatch.setattr(genomebrowser, 'numpy', None)
+  assert genomemap_data(str(bed), assembly) == expected
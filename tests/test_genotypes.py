@@ -0,0 +1,76 @@
+import json, random
+from genomebrowser import gt_code, gt_text, pack_column, vcf_genotypes, vcf_sample, genotype_values, genotype_text
+
+
+def decode(aux, n):
+  fmt, present, layout, data = vcf_genotypes(aux, n)
+  layout = json.loads(layout)
+  return [genotype_values(present, layout, data, i) for i in range(n)], layout
+
+
+def test_gt_codes_round_trip():
+  for gt in ('0/0', '0/1', '1|0', '1|1', './.', '.|.', '0', '.', '2/125', '125|0', '1/.'):
+    code = gt_code(gt)
+    assert code is not None and code < 0xFFFF
+    assert gt_text(code) == gt
+  for gt in ('0/1/2', '01/1', '126/0', 'A', '', '0//1'):
+    assert gt_code(gt) is None
+
+
+def test_column_types():
+  assert pack_column('GT', ['0/1', None, '1|1'])[0] == 'H'
+  assert pack_column('GT', ['0/1/2', '0/1'])[0] == 't'
+  assert pack_column('DP', ['12', '.', None, '-3'])[0] == 'i'
+  assert pack_column('DP', ['12', '1234567890'])[0] == 't'
+  assert pack_column('GQ', ['12.5', '.', '0.25'])[0] == 'd'
+  assert pack_column('GQ', ['12.50'])[0] == 't'
+  assert pack_column('AD', ['10,2', '.', None, '0,0,.'])[0] == 'l'
+  assert pack_column('GP', ['0.1,0.9', '1,0'])[0] == 't'
+  assert pack_column('FT', ['PASS', 'q10;lowDP', None, ''])[0] == 't'
+
+
+def test_samples_round_trip():
+  r = random.Random(1)
+  n = 300
+  aux = ['chr1', '100', '.', 'A', 'G,T', '50', 'PASS', '.', 'GT:AD:DP:GQ:PL:FT']
+  for i in range(n):
+    aux.append('%s:%d,%d,%d:%d:%s:%d,%d,%d:%s' % (r.choice(['0/0', '0/1', '1|2', './.', '2']), r.randint(0, 30), r.randint(0, 30), r.randint(0, 30),
+      r.randint(0, 60), r.choice(['12.5', '.', '99.0']), r.randint(0, 99), r.randint(0, 99), r.randint(0, 99), r.choice(['PASS', 'lowDP', 'é'])))
+  aux[20] = './.:.:.:.:.:.'
+  aux[21] = '0/1:3,.,1:.:.:.:PASS'
+  aux[22] = '0/1:3'
+  values, layout = decode(aux, n)
+  assert [x[1] for x in layout] == ['H', 'l', 'i', 'd', 'l', 't']
+  for i in range(n):
+    if vcf_sample(aux, i+1) is None:
+      assert values[i] is None
+    else:
+      assert genotype_text(values[i]) == vcf_sample(aux, i+1)
+  assert dict(values[11])['AD'] is None
+  assert values[13] is None
+  assert dict(values[12])['AD'] == [3, None, 1]
+  assert isinstance(dict(values[0])['DP'], int)
+
+
+def test_vcf_track_queries(tmp_path, gb):
+  r = random.Random(2)
+  samples = ['S%d' % i for i in range(20)]
+  records = []
+  for pos in sorted(r.sample(range(1, 100000), 200)):
+    calls = ['%s:%d,%d:%d' % (r.choice(['0/0', '0/1', '1/1', './.']), r.randint(0, 20), r.randint(0, 20), r.randint(0, 40)) for s in samples]
+    records.append(['chr1', str(pos), '.', 'A', 'C', '30', 'PASS', 'DP=10', 'GT:AD:DP'] + calls)
+  vcf = str(tmp_path / 'a.vcf')
+  con = open(vcf, 'w')
+  con.write('##fileformat=VCFv4.2\n#' + '\t'.join(['CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT'] + samples) + '\n')
+  con.write(''.join('\t'.join(x) + '\n' for x in records))
+  con.close()
+  gb.addVCF(vcf, 'variants')
+  start, end = 20000, 60000
+  inside = [x for x in records if start < int(x[1]) <= end]
+  rows = gb.query('chr1', start, end, ['S3', 'S7'])
+  assert sorted((x[0], x[2], x[5]) for x in rows) == sorted((s, int(x[1])-1, vcf_sample(x, samples.index(s)+1)) for x in inside for s in ('S3', 'S7'))
+  genotypes = gb.getGenotypes('chr1', start, end, 'variants', ['S5'])
+  assert [x[2] for x in genotypes] == [int(x[1]) for x in inside]
+  for row, record in zip(genotypes, inside):
+    gt, ad, dp = record[14].split(':')
+    assert row[4] == {'S5': {'GT': gt, 'AD': [int(x) for x in ad.split(',')], 'DP': int(dp)}}
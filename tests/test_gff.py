@@ -0,0 +1,33 @@
+
+GFF = \
+'''##gff-version 3
+chr1\t.\tgene\t1000\t2000\t.\t+\t.\tID=g1;Name=G1
+chr1\t.\tmRNA\t1000\t2000\t.\t+\t.\tID=t1;Parent=g1
+chr1\t.\texon\t1000\t1177\t.\t+\t.\tParent=t1
+chr1\t.\texon\t1300\t1449\t.\t+\t.\tParent=t1
+###
+chr1\t.\tgene\t3000\t4000\t.\t-\t.\tID=g2;Name=G2
+chr1\t.\texon\t1964\t2000\t.\t+\t.\tParent=t1
+%s###
+'''
+
+
+def exons(gb):
+  return [row[10:] for row in gb.query('chr1', 0, 10000) if row[4] == 't1']
+
+
+def test_exons_of_a_closed_group_are_kept(tmp_path, gb):
+  gff = tmp_path / 'a.gff3'
+  gff.write_text(GFF % '')
+  gb.addGFF(str(gff))
+  assert exons(gb) == [(3, '178,150,37,', '0,300,964,')]
+  assert [row[4] for row in gb.query('chr1', 0, 10000)] == ['G1', 't1', 'G2']
+
+
+def test_exons_of_a_closed_group_are_kept_after_a_spill(tmp_path, gb):
+  # an exon before its parent spills the rest of the file to temporary tables
+  gff = tmp_path / 'a.gff3'
+  gff.write_text(GFF % 'chr1\t.\texon\t5100\t5200\t.\t+\t.\tParent=t2\nchr1\t.\tmRNA\t5000\t6000\t.\t+\t.\tID=t2\nchr1\t.\texon\t1500\t1600\t.\t+\t.\tParent=t1\n')
+  gb.addGFF(str(gff))
+  assert exons(gb) == [(4, '178,150,37,101,', '0,300,964,500,')]
+  assert [row[10:] for row in gb.query('chr1', 0, 10000) if row[4] == 't2'] == [(1, '101,', '100,')]
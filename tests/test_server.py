@@ -0,0 +1,72 @@
+import json, asyncio
+from server import QueryServer
+
+
+def bed(tmp_path, name, n):
+  path = tmp_path / name
+  path.write_text(''.join('chr1\t%d\t%d\tg%d\t0\t+\n' % (i*100, i*100+50, i) for i in range(n)))
+  return str(path)
+
+
+def test_tracks_are_added_while_serving_a_wal_database(tmp_path, gb):
+  gb.addTrack(bed(tmp_path, 'a.bed', 10), 'a')
+  server = QueryServer(gb.__directory__, 2, immutable=False)
+  try:
+    for path, n in (('/query', 10), ('/tracks', 1), ('/chromosomes', 1)):
+      status, ctype, body = asyncio.run(server.respond(path, {'chr': 'chr1', 'start': '0', 'end': '100000'}))
+      assert status == 200 and len(json.loads(body)) == n
+    assert json.loads(asyncio.run(server.respond('/chromosomes', {}))[2]) == [['chr1', 950]]
+    gb.addTrack(bed(tmp_path, 'b.bed', 20), 'b')
+    # commits to a WAL database only touch the -wal file, the cached answers must not be served again
+    status, ctype, body = asyncio.run(server.respond('/query', {'chr': 'chr1', 'start': '0', 'end': '100000'}))
+    assert len(json.loads(body)) == 30
+    assert len(json.loads(asyncio.run(server.respond('/tracks', {}))[2])) == 2
+    assert json.loads(asyncio.run(server.respond('/chromosomes', {}))[2]) == [['chr1', 1950]]
+    gb.removeTrack('a')
+    status, ctype, body = asyncio.run(server.respond('/query', {'chr': 'chr1', 'start': '0', 'end': '100000'}))
+    assert len(json.loads(body)) == 20
+  finally:
+    server.close()
+
+
+def test_failing_queries_get_an_error_response(tmp_path, gb):
+  gb.addTrack(bed(tmp_path, 'a.bed', 10), 'a')
+  server = QueryServer(gb.__directory__, 1)
+  try:
+    status, ctype, body = asyncio.run(server.respond('/query', {'chr': 'chr1', 'start': '0', 'end': '1000'}))
+    assert status == 200 and len(json.loads(body)) == 10
+    for args in ({'chr': 'chr1'}, {'chr': 'chr1', 'start': 'x', 'end': '1'}, {'chr': 'chr1', 'start': '0', 'end': '1', 'filters': '5'}):
+      status, ctype, body = asyncio.run(server.respond('/query', args))
+      assert status == 400 and body.startswith(b'Bad request')
+    status, ctype, body = asyncio.run(server.respond('/query', {'chr': 'chr1', 'start': '0', 'end': '1', 'filters': '[["a", "=", {"b": 1}]]'}))
+    assert status == 500 and body.startswith(b'Server error')
+    status, ctype, body = asyncio.run(server.respond('/nothing.html', {}))
+    assert status == 404
+  finally:
+    server.close()
+
+
+def test_files_are_streamed(tmp_path, gb):
+  data = bytes(range(256)) * (3 * (1 << 12) + 7)
+  (tmp_path / 'gb' / 'big.bin').write_bytes(data)
+  server = QueryServer(gb.__directory__, 2)
+
+  async def get(path):
+    listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+    reader, writer = await asyncio.open_connection(*listener.sockets[0].getsockname()[:2])
+    writer.write(('GET %s HTTP/1.1\r\nConnection: close\r\n\r\n' % path).encode('latin-1'))
+    response = await reader.read()
+    writer.close()
+    listener.close()
+    await listener.wait_closed()
+    return response.split(b'\r\n\r\n', 1)
+
+  try:
+    head, body = asyncio.run(get('/big.bin'))
+    assert b'Content-Length: %d' % len(data) in head and body == data
+    head, body = asyncio.run(get('/Tracks.db'))
+    assert body == open(str(tmp_path / 'gb' / 'Tracks.db'), 'rb').read()
+    head, body = asyncio.run(get('/../gb/missing'))
+    assert head.startswith(b'HTTP/1.1 404')
+  finally:
+    server.close()
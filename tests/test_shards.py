@@ -0,0 +1,48 @@
+import os, json, sqlite3
+
+
+def test_every_zoom_row_is_exported(tmp_path, gb):
+  bed = tmp_path / 'values.bed'
+  bed.write_text(''.join('chr1\t%d\t%d\t.\t%d\n' % (s, s+100, s % 7) for s in range(3500000, 4000000, 500)))
+  gb.addTrack(str(bed), 'values', 'value')
+  main = sqlite3.connect(os.path.join(gb.__directory__, 'Tracks.db'))
+  expected = sorted(main.execute('SELECT trackid, level, chr, start, end, count, sum, min, max FROM tbl_zoom').fetchall())
+  segments = main.execute('SELECT count(*) FROM tbl_segments').fetchone()[0]
+  main.close()
+  assert set(row[1] for row in expected) == set(range(7))
+  for size in (None, 100000, 1000000):
+    gb.exportShards(size)
+    directory = os.path.join(gb.__directory__, 'shards')
+    manifest = json.load(open(os.path.join(directory, 'manifest.json')))
+    zoom = []
+    for shard in manifest['shards']:
+      db = sqlite3.connect(os.path.join(directory, shard['file']))
+      rows = db.execute('SELECT trackid, level, chr, start, end, count, sum, min, max FROM tbl_zoom').fetchall()
+      db.close()
+      assert all(shard['start'] <= row[3] and row[4] <= shard['maxEnd'] for row in rows)
+      if shard['end'] is not None:
+        assert all(row[3] < shard['end'] for row in rows)
+      zoom.extend(rows)
+    assert sorted(zoom) == expected
+    assert sum(shard['rows'] for shard in manifest['shards']) == segments
+
+
+def test_sanitized_chromosome_names_get_their_own_shards(tmp_path, gb):
+  chromosomes = ['chr1|a', 'chr1_a', 'chr1/a', 'base', 'chr2']
+  bed = tmp_path / 'genes.bed'
+  bed.write_text(''.join('%s\t%d\t%d\tg%d\t0\t+\n' % (chrom, s, s+100, i) for i, chrom in enumerate(chromosomes) for s in range(0, 1000*(i+1), 1000)))
+  gb.addTrack(str(bed), 'genes')
+  for size in (None, 500):
+    gb.exportShards(size)
+    directory = os.path.join(gb.__directory__, 'shards')
+    manifest = json.load(open(os.path.join(directory, 'manifest.json')))
+    files = [shard['file'] for shard in manifest['shards']]
+    assert len(set(files)) == len(files) and manifest['base'] not in files
+    assert sorted(os.listdir(directory)) == sorted(files + [manifest['base'], 'manifest.json'])
+    assert 'chr2.db' in files or 'chr2.0.db' in files
+    for shard in manifest['shards']:
+      db = sqlite3.connect(os.path.join(directory, shard['file']))
+      assert db.execute('SELECT DISTINCT chr FROM tbl_segments').fetchall() == [(shard['chr'],)]
+      assert db.execute('SELECT count(*) FROM tbl_segments').fetchone()[0] == shard['rows']
+      db.close()
+    assert sorted((shard['chr'], shard['rows']) for shard in manifest['shards'] if shard['start'] == 0) == sorted((chrom, 1 if size else i+1) for i, chrom in enumerate(chromosomes))
@@ -0,0 +1,18 @@
+import genomebrowser
+
+
+def test_small_regions_are_summarized_from_the_value_tracks_only(tmp_path, gb, monkeypatch):
+  values = tmp_path / 'values.bed'
+  values.write_text(''.join('chr1\t%d\t%d\tv%d\t%d\n' % (i*100, i*100+50, i, i) for i in range(100)))
+  genes = tmp_path / 'genes.bed'
+  genes.write_text('chr1\t0\t5000\tGENE\t7\t+\n')
+  gb.addTrack(str(values), 'values', 'value')
+  gb.addTrack(str(genes), 'genes')
+  read = []
+  query = genomebrowser.genomebrowser.query
+  monkeypatch.setattr(genomebrowser.genomebrowser, 'query', lambda self, chr, start, end, tracks = None: read.append(list(tracks)) or query(self, chr, start, end, tracks))
+  rows = gb.querySummary('chr1', 1000, 2000)
+  assert read == [['values']]
+  assert rows == [('values', 'chr1', i*100, i*100+50, 1, float(i), float(i), float(i)) for i in range(10, 20)]
+  assert gb.querySummary('chr1', 1000, 2000, 'genes') == []
+  assert read == [['values']]
@@ -0,0 +1,132 @@
+import os, random
+import utils, twobit, genomebrowser
+from twobit import TwoBitWriter, TwoBitReader
+from genomebrowser import scan_fasta, read_lengths, get_assembly_from_fasta
+
+
+def sequence(n, seed = 1):
+  '''random bases in runs of upper case, soft masked and N bases'''
+  r = random.Random(seed)
+  runs = []
+  while n > 0:
+    k = min(n, r.randint(1, 300))
+    kind = r.random()
+    if kind < 0.1:
+      runs.append(r.choice('Nn')*k)
+    elif kind < 0.4:
+      runs.append(''.join(r.choice('acgt') for i in range(k)))
+    else:
+      runs.append(''.join(r.choice('ACGT') for i in range(k)))
+    n -= k
+  return ''.join(runs)
+
+
+def write_fasta(path, sequences, width = 60):
+  con = open(path, 'w')
+  for name, bases in sequences:
+    con.write('>%s description\n' % name)
+    for i in range(0, len(bases), width):
+      con.write(bases[i:i+width] + '\n')
+  con.close()
+
+
+def test_fasta_round_trip(tmp_path):
+  sequences = [('chr1', sequence(20000)), ('chr2', sequence(1)), ('chr3', 'N'*1000 + 'acgtACGT' + 'n'*7), ('chrM', sequence(4097, 2))]
+  fasta = str(tmp_path / 'a.fa')
+  write_fasta(fasta, sequences)
+  path = str(tmp_path / 'a.2bit')
+  store = TwoBitWriter(path)
+  assembly = scan_fasta(fasta, store)
+  store.close()
+  assert assembly == [[name, 0, len(bases)] for name, bases in sequences]
+  assert read_lengths(fasta) is None
+  assert get_assembly_from_fasta([fasta]) == assembly
+  assert read_lengths(fasta) == assembly
+  reader = TwoBitReader(path)
+  assert reader.names() == [x[0] for x in sequences]
+  assert reader.lengths() == [[name, len(bases)] for name, bases in sequences]
+  r = random.Random(3)
+  for name, bases in sequences:
+    assert reader.sequence(name, 0, len(bases)) == bases
+    for i in range(200):
+      start = r.randrange(-5, len(bases)+5)
+      end = start + r.randint(0, 700)
+      assert reader.sequence(name, start, end) == bases[max(0, start):max(0, min(end, len(bases)))]
+  assert reader.sequence('chrX', 0, 10) is None
+
+
+def test_pieces_across_buffers(tmp_path, monkeypatch):
+  monkeypatch.setattr(twobit, 'TWOBIT_BUFFER', 37)
+  bases = sequence(5000, 4)
+  path = str(tmp_path / 'a.2bit')
+  store = TwoBitWriter(path)
+  r = random.Random(5)
+  store.start('chr1')
+  i = 0
+  while i < len(bases):
+    k = r.randint(1, 50)
+    store.write(bases[i:i+k])
+    i += k
+  store.close()
+  assert TwoBitReader(path).sequence('chr1', 0, len(bases)) == bases
+
+
+def test_writer_keeps_and_merges_sequences(tmp_path):
+  first = str(tmp_path / 'a.2bit')
+  store = TwoBitWriter(first)
+  store.add('chr1', ['ACGT', 'nnnnA'])
+  store.add('chr2', ['acgtN'])
+  store.close()
+  other = str(tmp_path / 'b.2bit')
+  store = TwoBitWriter(other)
+  store.add('chr3', ['TTTTggggNNNN'])
+  store.close()
+  store = TwoBitWriter(first)
+  store.add('chr2', ['CCCC'])
+  store.extend(other)
+  store.close()
+  reader = TwoBitReader(first)
+  assert reader.names() == ['chr1', 'chr2', 'chr3']
+  assert [reader.sequence(name, 0, 100) for name in reader.names()] == ['ACGTnnnnA', 'CCCC', 'TTTTggggNNNN']
+
+
+def test_getSequence(tmp_path, gb):
+  sequences = [('chr1', sequence(3000, 6)), ('chr2', sequence(500, 7))]
+  fasta = str(tmp_path / 'a.fa')
+  write_fasta(fasta, sequences, 70)
+  assert gb.getSequence('chr1', 0, 10) is None
+  gb.addSequence(fasta)
+  assert os.path.isfile(os.path.join(gb.__directory__, 'sequences.2bit'))
+  assert gb.getSequence('chr1', 100, 2500) == sequences[0][1][100:2500]
+  assert gb.getSequence('chr2', 0, 1000) == sequences[1][1]
+  assert gb.getSequence('chr3', 0, 1000) is None
+
+
+def test_fasta_lengths_are_read_once_and_sequences_packed_on_request(tmp_path, monkeypatch):
+  www = tmp_path / 'www'
+  www.mkdir()
+  (www / 'template.html').write_text('<html><!--title--><!--head--><!--body--></html>')
+  for name in ('d3.min.js', 'jspdf.min.js', 'sql.js', 'functions.js', 'images.js', 'query.js', 'genomebrowser.js', 'genomemap.js'):
+    (www / name).write_text('')
+  monkeypatch.setattr(utils, 'www', str(www))
+  sequences = [('chr1|x', sequence(5000, 8)), ('chr2', sequence(700, 9))]
+  fasta = str(tmp_path / 'a.fa')
+  write_fasta(fasta, sequences)
+  directory = str(tmp_path / 'gb')
+  packed = []
+  writer = genomebrowser.TwoBitWriter
+  monkeypatch.setattr(genomebrowser, 'TwoBitWriter', lambda path: packed.append(path) or writer(path))
+  gb = genomebrowser.genomebrowser([fasta], directory=directory)
+  assert packed == []
+  assert not os.path.exists(fasta + '.fai')
+  assert read_lengths(fasta) == [['chr1', 0, 5000], ['chr2', 0, 700]]
+  # the sidecar is trusted while the file keeps its size and modification time
+  monkeypatch.setattr(genomebrowser, 'scan_fasta', None)
+  assert genomebrowser.get_assembly([fasta]) == [['chr1', 0, 5000], ['chr2', 0, 700]]
+  monkeypatch.undo()
+  monkeypatch.setattr(utils, 'www', str(www))
+  gb.addSequence(fasta)
+  assert [gb.getSequence(name, 0, 10000) for name in ('chr1', 'chr2')] == [bases for name, bases in sequences]
+  write_fasta(fasta, sequences[:1])
+  assert read_lengths(fasta) is None
+  assert genomebrowser.get_assembly([fasta]) == [['chr1', 0, 5000]]
@@ -0,0 +1,255 @@
+import os, re, struct, bisect, shutil, tempfile, array
+
+# 2bit is the UCSC packed nucleotide format: four bases per byte (T=0, C=1, A=2, G=3)
+# plus, for each sequence, the runs of N and of lower case (soft masked) bases, with an
+# index of sequence offsets at the start of the file so any range can be read with a seek.
+
+TWOBIT_SIGNATURE = 0x1A412743
+TWOBIT_CODES = str.maketrans('TCAGtcag', '01230123', '')
+TWOBIT_ACGT = str.maketrans('', '', 'ACGTacgt')
+TWOBIT_BUFFER = 1 << 20
+TWOBIT_BYTES = [''.join('TCAG'[(b >> shift) & 3] for shift in (6,4,2,0)) for b in range(256)]
+N_PATTERN = re.compile('[^ACGTacgt]+')
+MASK_PATTERN = re.compile('[a-z]+')
+
+
+def add_block(starts, sizes, start, end):
+  '''append a run to a block list, merging it with the previous run if they touch'''
+  if len(starts) and starts[-1]+sizes[-1] == start:
+    sizes[-1] += end-start
+  else:
+    starts.append(start)
+    sizes.append(end-start)
+
+
+class TwoBitWriter:
+  '''write sequences into a 2bit file, keeping the sequences it already holds'''
+
+  def __init__(self, filename):
+    self.__filename__ = filename
+    self.__spool__ = tempfile.TemporaryFile()
+    self.__records__ = []
+    self.__current__ = None
+    self.__old__ = TwoBitReader(filename) if os.path.isfile(filename) else None
+
+  def start(self, name):
+    '''begin a new sequence, the following calls to write append bases to it'''
+    self.__end__()
+    self.__current__ = {'name': name, 'size': 0, 'codes': '', 'pending': [], 'buffered': 0, 'offset': self.__spool__.tell(),
+      'nStarts': array.array('I'), 'nSizes': array.array('I'), 'maskStarts': array.array('I'), 'maskSizes': array.array('I')}
+
+  def write(self, bases):
+    '''append a piece of sequence, without line breaks, to the current sequence'''
+    record = self.__current__
+    record['pending'].append(bases)
+    record['buffered'] += len(bases)
+    if record['buffered'] >= TWOBIT_BUFFER:
+      self.__pack__()
+
+  def __pack__(self):
+    '''pack the buffered pieces of the current sequence'''
+    record = self.__current__
+    bases = ''.join(record['pending'])
+    record['pending'] = []
+    record['buffered'] = 0
+    pos = record['size']
+    plain = len(bases.translate(TWOBIT_ACGT)) == 0
+    if plain and bases.islower():
+      add_block(record['maskStarts'], record['maskSizes'], pos, pos+len(bases))
+    elif not bases.isupper():
+      for m in MASK_PATTERN.finditer(bases):
+        add_block(record['maskStarts'], record['maskSizes'], pos+m.start(), pos+m.end())
+    if not plain:
+      for m in N_PATTERN.finditer(bases):
+        add_block(record['nStarts'], record['nSizes'], pos+m.start(), pos+m.end())
+      bases = N_PATTERN.sub(lambda m: '0'*len(m.group()), bases)
+    record['size'] += len(bases)
+    codes = record['codes'] + bases.translate(TWOBIT_CODES)
+    n = len(codes) - len(codes) % 4
+    if n:
+      self.__spool__.write(int(codes[:n], 4).to_bytes(n//4, 'big'))
+    record['codes'] = codes[n:]
+
+  def add(self, name, pieces):
+    '''write a whole sequence from an iterable of pieces'''
+    self.start(name)
+    for bases in pieces:
+      self.write(bases)
+    self.__end__()
+
+  def extend(self, filename, names = None):
+    '''copy every sequence of another 2bit file, or the named ones'''
+    self.__end__()
+    reader = TwoBitReader(filename)
+    for name in reader.names() if names is None else names:
+      self.__records__.append({'name': name, 'reader': reader})
+
+  def __end__(self):
+    record = self.__current__
+    if record is None:
+      return
+    self.__pack__()
+    codes = record['codes']
+    if len(codes):
+      codes += '0'*(4-len(codes))
+      self.__spool__.write(int(codes, 4).to_bytes(1, 'big'))
+    del record['codes'], record['pending']
+    self.__records__.append(record)
+    self.__current__ = None
+
+  def __header__(self, record):
+    '''pack the part of a record that precedes its bases'''
+    header = struct.pack('<2I', record['size'], len(record['nStarts'])) + record['nStarts'].tobytes() + record['nSizes'].tobytes()
+    header += struct.pack('<I', len(record['maskStarts'])) + record['maskStarts'].tobytes() + record['maskSizes'].tobytes()
+    return header + struct.pack('<I', 0)
+
+  def close(self):
+    '''write the 2bit file'''
+    self.__end__()
+    records = []
+    names = set()
+    for record in reversed(self.__records__):
+      if record['name'] not in names:
+        names.add(record['name'])
+        records.append(record)
+    records.reverse()
+    if self.__old__ is not None:
+      records = [{'name': name, 'reader': self.__old__} for name in self.__old__.names() if name not in names] + records
+    headers = []
+    sizes = []
+    for record in records:
+      if 'reader' in record:
+        header, size = record['reader'].raw(record['name'])
+      else:
+        header, size = self.__header__(record), (record['size']+3)//4
+      headers.append(header)
+      sizes.append(size)
+    offset = 16 + sum(map(lambda x: 1+len(x['name'].encode('utf-8'))+4, records))
+    version = 0 if offset + sum(map(len, headers)) + sum(sizes) < 1 << 32 else 1
+    offsetFormat = '<I' if version == 0 else '<Q'
+    if version:
+      offset += 4*len(records)
+    tmp = self.__filename__ + '.tmp'
+    con = open(tmp, 'wb')
+    con.write(struct.pack('<4I', TWOBIT_SIGNATURE, version, len(records), 0))
+    for i, record in enumerate(records):
+      name = record['name'].encode('utf-8')
+      con.write(struct.pack('<B', len(name)) + name + struct.pack(offsetFormat, offset))
+      offset += len(headers[i]) + sizes[i]
+    for i, record in enumerate(records):
+      con.write(headers[i])
+      if 'reader' in record:
+        record['reader'].copy(record['name'], con)
+      else:
+        self.__spool__.seek(record['offset'])
+        shutil.copyfileobj(LimitedReader(self.__spool__, sizes[i]), con)
+    con.close()
+    self.__spool__.close()
+    os.replace(tmp, self.__filename__)
+
+
+class LimitedReader:
+  '''file-like view of the next n bytes of a file'''
+
+  def __init__(self, con, n):
+    self.__con__ = con
+    self.__left__ = n
+
+  def read(self, size = -1):
+    if size < 0 or size > self.__left__:
+      size = self.__left__
+    data = self.__con__.read(size)
+    self.__left__ -= len(data)
+    return data
+
+
+class TwoBitReader:
+  '''random access reader of 2bit files'''
+
+  def __init__(self, filename):
+    self.__filename__ = filename
+    con = open(filename, 'rb')
+    signature, version, count, reserved = struct.unpack('<4I', con.read(16))
+    if signature != TWOBIT_SIGNATURE:
+      con.close()
+      raise IOError('%s is not a 2bit file' % filename)
+    offsetFormat = '<I' if version == 0 else '<Q'
+    offsetSize = struct.calcsize(offsetFormat)
+    self.__offsets__ = dict()
+    self.__order__ = []
+    for i in range(count):
+      name = con.read(con.read(1)[0]).decode('utf-8')
+      self.__offsets__[name] = struct.unpack(offsetFormat, con.read(offsetSize))[0]
+      self.__order__.append(name)
+    self.__records__ = dict()
+    con.close()
+
+  def names(self):
+    '''the names of the sequences in file order'''
+    return list(self.__order__)
+
+  def __record__(self, name, con = None):
+    '''read the size, N blocks, mask blocks and bases offset of a sequence'''
+    if name not in self.__records__:
+      close = con is None
+      if close:
+        con = open(self.__filename__, 'rb')
+      con.seek(self.__offsets__[name])
+      size, n = struct.unpack('<2I', con.read(8))
+      nStarts = array.array('I', con.read(4*n))
+      nSizes = array.array('I', con.read(4*n))
+      m = struct.unpack('<I', con.read(4))[0]
+      maskStarts = array.array('I', con.read(4*m))
+      maskSizes = array.array('I', con.read(4*m))
+      con.read(4)
+      self.__records__[name] = (size, nStarts, nSizes, maskStarts, maskSizes, con.tell())
+      if close:
+        con.close()
+    return self.__records__[name]
+
+  def lengths(self):
+    '''list of [name, length] pairs in file order'''
+    con = open(self.__filename__, 'rb')
+    lengths = [[name, self.__record__(name, con)[0]] for name in self.__order__]
+    con.close()
+    return lengths
+
+  def raw(self, name):
+    '''return the packed header of a sequence and the size in bytes of its bases'''
+    size, nStarts, nSizes, maskStarts, maskSizes, dna = self.__record__(name)
+    header = struct.pack('<2I', size, len(nStarts)) + nStarts.tobytes() + nSizes.tobytes()
+    header += struct.pack('<I', len(maskStarts)) + maskStarts.tobytes() + maskSizes.tobytes() + struct.pack('<I', 0)
+    return header, (size+3)//4
+
+  def copy(self, name, out):
+    '''copy the packed bases of a sequence into an open file'''
+    size = self.__record__(name)[0]
+    con = open(self.__filename__, 'rb')
+    con.seek(self.__record__(name)[5])
+    shutil.copyfileobj(LimitedReader(con, (size+3)//4), out)
+    con.close()
+
+  def sequence(self, name, start, end):
+    '''return the bases of a sequence in a 0-based, half-open range, None for unknown sequences'''
+    if name not in self.__offsets__:
+      return None
+    size, nStarts, nSizes, maskStarts, maskSizes, dna = self.__record__(name)
+    start = max(0, start)
+    end = min(size, end)
+    if start >= end:
+      return ''
+    con = open(self.__filename__, 'rb')
+    con.seek(dna + start//4)
+    data = con.read((end+3)//4 - start//4)
+    con.close()
+    first = start - start % 4
+    bases = bytearray(''.join(map(TWOBIT_BYTES.__getitem__, data))[start-first:end-first], 'ascii')
+    for blockStarts, blockSizes, masked in ((nStarts, nSizes, False), (maskStarts, maskSizes, True)):
+      i = max(0, bisect.bisect_right(blockStarts, start)-1)
+      while i < len(blockStarts) and blockStarts[i] < end:
+        s = max(start, blockStarts[i]) - start
+        e = min(end, blockStarts[i]+blockSizes[i]) - start
+        if e > s:
+          bases[s:e] = bases[s:e].lower() if masked else b'N'*(e-s)
+        i += 1
+    return bases.decode('ascii')
@@ -1,48 +1,126 @@
-import os, shutil, re, webbrowser, gzip
+import os, shutil, re, webbrowser, gzip, io, hashlib
+from bgzf import BgzfReader, is_bgzf
 
-def open_file(filename):
+BUFFER_SIZE = 1 << 20
+
+def open_file(filename, threads = None):
+  '''open a plain, gzip or BGZF file as text, BGZF blocks are inflated in parallel by "threads" threads'''
   con = open(filename,'rb')
-  if con.read(1) == b'\x1f' and con.read(1) == b'\x8b':
-    return gzip.open(filename,'rb')
+  magic = con.read(2)
+  con.close()
+  if magic == b'\x1f\x8b':
+    if is_bgzf(filename):
+      raw = io.BufferedReader(BgzfReader(filename, threads), BUFFER_SIZE)
+    else:
+      raw = io.BufferedReader(gzip.open(filename,'rb'), BUFFER_SIZE)
+    return io.TextIOWrapper(raw, encoding='utf-8', errors='replace')
   else:
-    return open(filename,'r')
+    return open(filename,'r',buffering=BUFFER_SIZE,encoding='utf-8',errors='replace')
 
 def unique(items):
-  uniq = list()
-  for i in items:
-    if not i in uniq:
-      uniq.append(i)
-  return uniq
+  return list(dict.fromkeys(items))
+
+def same_file(source, copy):
+  '''check if a copied or linked file is still up to date with its source'''
+  if not os.path.isfile(copy):
+    return False
+  if os.path.samefile(source, copy):
+    return True
+  return not os.path.islink(copy) and os.path.getsize(copy) == os.path.getsize(source) and os.path.getmtime(copy) >= os.path.getmtime(source)
 
 www = os.path.join(os.path.dirname(__file__), 'www')
 
-def createHTML(directory, dependencies, data, chromosomes):
-  if os.path.exists(directory):
+TEMPLATE_MARKS = re.compile('(<!--title-->|<!--head-->|<!--body-->)')
+
+def shared_assets(assets):
+  '''copy the scripts and styles once into a version directory of a shared assets directory, named after their content, and return it'''
+  files = sorted(filter(lambda x: x != 'template.html' and os.path.isfile(os.path.join(www,x)), os.listdir(www)))
+  digest = hashlib.sha1()
+  for depend in files:
+    digest.update(depend.encode('utf-8') + b'\0')
+    con = open(os.path.join(www,depend),'rb')
+    digest.update(con.read())
+    con.close()
+  version = os.path.join(assets, digest.hexdigest()[:16])
+  if not os.path.isdir(version):
+    tmp = version + '.%d.tmp' % os.getpid()
+    os.makedirs(tmp)
+    for depend in files:
+      shutil.copy(os.path.join(www,depend), tmp)
+    try:
+      os.rename(tmp, version)
+    except OSError:
+      shutil.rmtree(tmp)
+  return version
+
+def install_asset(source, dirName, link):
+  '''copy, hard link or symlink an asset into a directory, falling back to a symlink and then a copy when a link cannot be made'''
+  target = os.path.join(dirName, os.path.basename(source))
+  if os.path.lexists(target):
+    os.remove(target)
+  if link == 'hardlink':
+    try:
+      os.link(source, target)
+      return
+    except OSError:
+      link = 'symlink'
+  if link == 'symlink':
+    try:
+      os.symlink(os.path.abspath(source), target)
+      return
+    except OSError:
+      pass
+  shutil.copy(source, target)
+
+def write_script(con, name, data):
+  '''write a json payload, a string or an iterable of strings, as a script element'''
+  con.write('<script type="application/json" id="' + name + '">')
+  if isinstance(data, str):
+    con.write(data)
+  else:
+    for chunk in data:
+      con.write(chunk)
+  con.write('</script>')
+
+def createHTML(directory, dependencies, data, chromosomes, clean = True, assets = None, link = 'hardlink'):
+  if clean and os.path.exists(directory):
     shutil.rmtree(directory)
-  os.makedirs(directory)
-  html = open(os.path.join(www, 'template.html')).read()
+  if not os.path.exists(directory):
+    os.makedirs(directory)
+  source = www if assets is None else shared_assets(assets)
   name = directory.split(os.sep)[-1]
-  html = html.replace('<!--title-->', name)
-  dep = '<!--head-->'
+  dep = ['<!--head-->']
   for depend in dependencies:
     dirName = ''
     if re.search(".css$",depend):
-      dep = dep + "\n" + '<link rel="stylesheet" type="text/css" href="styles/' + depend + '"></link>'
+      dep.append('<link rel="stylesheet" type="text/css" href="styles/' + depend + '"></link>')
       dirName = os.path.join(directory,'styles')
     else:
-      dep = dep + "\n" + '<script type="text/javascript" src="scripts/' + depend + '"></script>'
+      dep.append('<script type="text/javascript" src="scripts/' + depend + '"></script>')
       dirName = os.path.join(directory,'scripts')
     if not os.path.exists(dirName):
       os.mkdir(dirName)
-    shutil.copy(os.path.join(www,depend), dirName)
+    if clean or not same_file(os.path.join(source,depend), os.path.join(dirName,depend)):
+      if assets is None:
+        shutil.copy(os.path.join(www,depend), dirName)
+      else:
+        install_asset(os.path.join(source,depend), dirName, link)
 
-  html = html.replace('<!--head-->', dep)
-  chromosomes = '<script type="application/json" id="chromosomes">' + chromosomes + '</script>'
-  html = html.replace('<!--body-->','<!--body-->\n' + chromosomes)
-  data = '<script type="application/json" id="data">' + data + '</script>'
-  html = html.replace('<!--body-->','<!--body-->\n' + data)
+  template = open(os.path.join(www, 'template.html'))
   index_path = os.path.join(directory, "index.html")
   con = open(index_path,"w")
-  con.write(html)
+  for part in TEMPLATE_MARKS.split(template.read()):
+    if part == '<!--title-->':
+      con.write(name)
+    elif part == '<!--head-->':
+      con.write("\n".join(dep))
+    elif part == '<!--body-->':
+      con.write('<!--body-->\n')
+      write_script(con, 'data', data)
+      con.write('\n')
+      write_script(con, 'chromosomes', chromosomes)
+    else:
+      con.write(part)
+  template.close()
   con.close()
   print("The graph has been generated in the '%s' folder." % directory)